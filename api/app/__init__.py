@@ -6,9 +6,10 @@ Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
 See COPYRIGHT, AUTHORS, LICENSE for more details.
 """
 
-from .controller.binary_controller import api as binary
-from flask import Blueprint
+from .controller.binary_controller import add_server_timing, api as binary
+from flask import Blueprint, Response, current_app
 from flask_restplus import Api
+import http
 
 bp = Blueprint('api', __name__)
 api = Api(
@@ -18,4 +19,14 @@ api = Api(
 )
 
 api.add_namespace(binary)
+bp.after_request(add_server_timing)
+
+
+@bp.route('/metrics')
+def metrics():
+    # Stage latencies of this process in the Prometheus text format
+    metrics = current_app.config.get("METRICS")
+    if metrics is None:
+        return Response("Metrics are disabled\n", status=http.HTTPStatus.NOT_FOUND, mimetype="text/plain")
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
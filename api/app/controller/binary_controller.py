@@ -6,54 +6,838 @@ Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
 See COPYRIGHT, AUTHORS, LICENSE for more details.
 """
 
-from flask_restplus import Resource
+from flask_restplus import Resource, inputs
 from app.model.binary import BinaryDTO
 import http
-import pandas as pd
 import numpy
-from flask import request
+from flask import Response, g, request, stream_with_context
 from flask_restplus import Resource
-from app.helpers.calculate_features import UNKNOWN_ARCHITECTURE, get_architecture, calculate_features
+from app.helpers.admission import AdmissionRejected
+from app.helpers.archive import iter_archive
+from app.helpers.calculate_features import UNKNOWN_ARCHITECTURE, get_architecture
+from app.helpers.cascade import CascadePredictor
+from app.helpers.decompress import (DEFAULT_MAX_DECOMPRESSED_SIZE, DecompressedSizeError, decompressed_chunks,
+                                    decompressing_reader)
+from app.helpers.elf_sections import code_sections, file_buffer, section_chunks
+from app.helpers.executable_header import HEADER_SIZE, header_architecture
+from isadetect_features.feature_batch import calculate_features_batch
+from isadetect_features.feature_schema import FEATURE_SCHEMA
+from isadetect_features.feature_parallel import DEFAULT_PARALLEL_THRESHOLD, calculate_features_parallel
+from isadetect_features.feature_stream import (DEFAULT_CHUNK_SIZE, calculate_byte_frequencies_stream, calculate_features_stream,
+                                       read_chunks)
+from app.helpers.metrics import RequestTimer
+from app.helpers.result_cache import file_sha256
+from app.helpers.sampling import DEFAULT_SAMPLE_WINDOW_SIZE, DEFAULT_SAMPLE_WINDOWS, sample_windows, sampled_features
+from app.helpers.segmentation import DEFAULT_STRIDE, DEFAULT_WINDOW_SIZE, segment
+import contextlib
+import functools
+import hashlib
+import itertools
+import json
 import os
+import queue
+import shutil
 import sys
+import tempfile
 from flask import current_app as app
 
 api = BinaryDTO.api
 parser = BinaryDTO.parser
+lookup_parser = BinaryDTO.lookup_parser
 binary_output = BinaryDTO.binary_output
+segment_parser = BinaryDTO.segment_parser
+batch_parser = BinaryDTO.batch_parser
+segments_output = BinaryDTO.segments_output
+models_output = BinaryDTO.models_output
+job_output = BinaryDTO.job_output
+raw_parser = BinaryDTO.raw_parser
+features_parser = BinaryDTO.features_parser
+schema_output = BinaryDTO.schema_output
+
+# Model types the API serves, the other keys of app.config are settings
+MODEL_TYPES = ("code", "full", "fragment", "cascade")
+
+# Number of files of a batch request classified with one model call
+DEFAULT_BATCH_SIZE = 64
+
+# Files of a batch request up to this size are read into memory and
+# featurized together with the other files of their batch, larger files
+# are featurized while they are read
+BATCH_BUFFER_SIZE = 1 << 20
+
+# Raw uploads that have to be read more than once are spooled to disk when
+# they are larger than this
+RAW_SPOOL_SIZE = 4 << 20
+
+# Largest accepted body of precomputed features, far more than a JSON
+# feature vector needs
+MAX_FEATURES_BODY = 1 << 20
+
+
+def served_predictor(model_type):
+    # The predictor of a served model type, or None
+    if model_type not in MODEL_TYPES:
+        return None
+    return app.config.get(model_type)
+
+
+def served_sources():
+    # Model files of the served types, workers of the classifier pool
+    # forget the others
+    sources = set()
+    for model_type in MODEL_TYPES:
+        predictor = app.config.get(model_type)
+        if predictor is not None:
+            sources.update(stage.source for stage in getattr(predictor, "stages", [predictor]) if stage.source is not None)
+    return frozenset(sources)
+
+
+def start_timer():
+    # Requests are only timed when metrics or Server-Timing are enabled
+    if app.config.get("METRICS") is None and not app.config.get("SERVER_TIMING"):
+        return None
+    timer = RequestTimer()
+    g.request_timer = timer
+    return timer
+
+
+def finish_timer(timer, model_type):
+    if timer is None:
+        return
+    timer.finish()
+    metrics = app.config.get("METRICS")
+    if metrics is not None:
+        metrics.observe(model_type, timer)
+
+
+def add_server_timing(response):
+    # Registered as an after_request function of the blueprint
+    timer = g.get("request_timer")
+    if timer is not None and app.config.get("SERVER_TIMING"):
+        response.headers["Server-Timing"] = timer.server_timing()
+    return response
+
+
+def admit(model_type):
+    # Hold a slot of the admission control lane of the request, lanes are
+    # chosen by model type and the size of the body
+    admission = app.config.get("ADMISSION")
+    if admission is None:
+        return contextlib.nullcontext()
+    return admission.admit(model_type, request.content_length)
+
+
+def rejected(e):
+    # Response to a request admission control did not admit
+    return {"message": str(e)}, e.status, {"Retry-After": str(e.retry_after)}
+
+
+def admitted(method):
+    # Admit a multipart request before its form is parsed, so a full lane
+    # rejects the upload before the body is received. The form is not read
+    # yet, so the lane is chosen by the type query parameter, if given, and
+    # the size of the body, batches of mixed types use the lane of type
+    # batch. Streamed responses hold the slot until they have been sent
+    @functools.wraps(method)
+    def post(*args, **kwargs):
+        types = set(request.args.getlist("type"))
+        model_type = (types.pop() if len(types) == 1 else "batch") if types else None
+        slot = contextlib.ExitStack()
+        try:
+            slot.enter_context(admit(model_type))
+        except AdmissionRejected as e:
+            return rejected(e)
+        try:
+            response = method(*args, **kwargs)
+        except BaseException:
+            slot.close()
+            raise
+        if isinstance(response, Response):
+            response.call_on_close(slot.close)
+        else:
+            slot.close()
+        return response
+    return post
+
+
+def calculate_upload_features(binary, timer=None):
+    # Calculate features out of the uploaded binary one chunk at a time,
+    # so the upload is never held in memory as a whole
+    chunk_size = app.config.get("CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+    parallel_workers = app.config.get("PARALLEL_WORKERS")
+    if parallel_workers:
+        # Large uploads are split across worker processes
+        binary.seek(0, os.SEEK_END)
+        size = binary.tell()
+        binary.seek(0)
+        args = (binary, size, parallel_workers, app.config.get("PARALLEL_THRESHOLD", DEFAULT_PARALLEL_THRESHOLD),
+                chunk_size)
+        if timer is not None:
+            return timer.time("features", calculate_features_parallel, *args)
+        return calculate_features_parallel(*args)
+    chunks = read_chunks(binary, chunk_size)
+    if timer is not None:
+        chunks = timer.chunks("read", chunks)
+    return calculate_features_stream(chunks, timer)
+
+
+def architecture(label):
+    # Fetch the string representation of the architecture
+    if label == UNKNOWN_ARCHITECTURE:
+        return "unknown"
+    return get_architecture(label)
+
+
+def prediction_response(predictor, prediction, top_k=None):
+    # If the architecture is unknown, it is returned with full confidence
+    if prediction["label"] == UNKNOWN_ARCHITECTURE:
+        response = {"prediction": "unknown", "prediction_probability": 1}
+    else:
+        response = {"prediction": get_architecture(prediction["label"]),
+                    "prediction_probability": prediction["probability"]}
+    # Clients that cache results can invalidate them when the version changes
+    response["model_version"] = predictor.version
+    response["source"] = "model"
+    if top_k:
+        response["top_predictions"] = [{"prediction": architecture(label), "prediction_probability": probability}
+                                       for label, probability in prediction["top"]]
+    return response
+
+
+def observe_cascade(model_type, rows, fell_through):
+    metrics = app.config.get("METRICS")
+    if metrics is not None:
+        metrics.observe_cascade(model_type, rows, fell_through)
+
+
+def predict_rows(model_type, predictor, features):
+    # Class probabilities of a feature matrix, counting the rows a cascade
+    # lets fall through to its full model
+    if isinstance(predictor, CascadePredictor):
+        probabilities, fell_through = predictor.cascade_proba(features)
+        observe_cascade(model_type, len(probabilities), int(fell_through.sum()))
+        return probabilities
+    return predictor.predict_proba(features)
+
+
+def header_label(binary):
+    # Well-formed executables name their architecture in the header, the
+    # label is None for anything else, which is left to the model
+    binary.seek(0, os.SEEK_END)
+    size = binary.tell()
+    binary.seek(0)
+    header = binary.read(HEADER_SIZE)
+    binary.seek(0)
+    return header_architecture(header, size)
+
+
+def header_response(label, top_k=None):
+    response = {"prediction": get_architecture(label), "prediction_probability": 1, "model_version": None,
+                "source": "header"}
+    if top_k:
+        response["top_predictions"] = [{"prediction": response["prediction"], "prediction_probability": 1}]
+    return response
+
+
+def use_header(model_type):
+    return model_type == "full" and app.config.get("HEADER_FAST_PATH")
+
+
+def classify_matrix(model_type, predictor, features, top_k=None):
+    # One predict_proba call for all rows
+    probabilities = predict_rows(model_type, predictor, features)
+    return [prediction_response(predictor, prediction, top_k)
+            for prediction in predictor.predictions(probabilities, top_k or 1)]
+
+
+def classify_pending(pending, top_k=None):
+    # The buffered files are featurized as the rows of one matrix, then the
+    # files are grouped by model type and every group is classified with one
+    # model call
+    features = [item for _, _, item in pending]
+    buffered = [i for i, item in enumerate(features) if isinstance(item, bytes)]
+    if buffered:
+        rows = calculate_features_batch([features[i] for i in buffered], dtype=numpy.float64)
+        for i, row in zip(buffered, rows):
+            features[i] = row
+    results = [None] * len(pending)
+    by_type = {}
+    for i, (_, model_type, _) in enumerate(pending):
+        by_type.setdefault(model_type, []).append(i)
+    for model_type, rows in by_type.items():
+        matrix = numpy.array([features[i] for i in rows], dtype=numpy.float64)
+        for i, result in zip(rows, classify_matrix(model_type, app.config[model_type], matrix, top_k)):
+            results[i] = result
+    for (name, _, _), result in zip(pending, results):
+        yield dict({"name": name}, **result)
+
+
+def classify_cascade(binary, model_type, predictor, timer=None):
+    # The byte frequencies are enough while the cheap model of the cascade
+    # is confident, the fingerprints are only scanned when it is not
+    chunks = read_chunks(binary, app.config.get("CHUNK_SIZE", DEFAULT_CHUNK_SIZE))
+    if timer is not None:
+        chunks = timer.chunks("read", chunks)
+    byte_frequencies = calculate_byte_frequencies_stream(chunks, timer)
+    if timer is not None:
+        probabilities = timer.time("cheap_inference", predictor.cheap_proba, byte_frequencies)
+    else:
+        probabilities = predictor.cheap_proba(byte_frequencies)
+    if predictor.confident(probabilities)[0]:
+        observe_cascade(model_type, 1, 0)
+        return {"features": byte_frequencies, "probabilities": probabilities}
+
+    observe_cascade(model_type, 1, 1)
+    binary.seek(0)
+    features = calculate_upload_features(binary, timer)
+    if timer is not None:
+        return {"features": features, "probabilities": timer.time("inference", predictor.full.predict_proba, features)}
+    return {"features": features, "probabilities": predictor.full.predict_proba(features)}
+
+
+def predict_upload(model_type, predictor, features):
+    # Uploads of micro-batched types wait for concurrent uploads of the same
+    # type and are classified together with them
+    batcher = app.config.get("MICRO_BATCHER")
+    if batcher is not None and model_type in app.config.get("MICRO_BATCH_TYPES", ()):
+        return batcher.predict_proba(model_type, predictor, features)
+    return predict_rows(model_type, predictor, features)
+
+
+def classify_upload(binary, model_type, predictor, timer=None):
+    # Returns the features and class probabilities of an uploaded binary
+
+    def compute():
+        if isinstance(predictor, CascadePredictor):
+            return classify_cascade(binary, model_type, predictor, timer)
+
+        pool = app.config.get("CLASSIFIER_POOL")
+        if pool is not None and predictor.source is not None:
+            # Features and inference run in a worker process
+            if timer is not None:
+                features, probabilities = timer.time("pool", pool.classify, binary, predictor.source, served_sources())
+            else:
+                features, probabilities = pool.classify(binary, predictor.source, served_sources())
+            return {"features": features, "probabilities": probabilities}
+
+        features = calculate_upload_features(binary, timer)
+        if timer is not None:
+            return {"features": features,
+                    "probabilities": timer.time("inference", predict_upload, model_type, predictor, features)}
+        return {"features": features, "probabilities": predict_upload(model_type, predictor, features)}
+
+    cache = app.config.get("RESULT_CACHE")
+    if cache is None:
+        return compute()
+    # The same binaries are uploaded over and over, so results are cached by
+    # the hash of the payload and identical concurrent uploads are only
+    # classified once
+    sha256 = timer.time("hash", file_sha256, binary) if timer is not None else file_sha256(binary)
+    return cache.get_or_compute(cache_key(sha256, model_type, predictor), compute)
+
+
+def classify_code_sections(binary, predictor, timer=None):
+    # Returns the features and class probabilities of the code sections of
+    # an ELF upload, the same bytes the code model was trained on, or None
+    # if it has none. The sections are featurized as slices of the upload
+    with file_buffer(binary) as data:
+        sections = timer.time("sections", code_sections, data) if timer is not None else code_sections(data)
+        if not sections:
+            return None
+
+        def compute():
+            chunks = section_chunks(data, sections, app.config.get("CHUNK_SIZE", DEFAULT_CHUNK_SIZE))
+            features = calculate_features_stream(chunks, timer)
+            if timer is not None:
+                return {"features": features, "probabilities": timer.time("inference", predictor.predict_proba, features)}
+            return {"features": features, "probabilities": predictor.predict_proba(features)}
+
+        cache = app.config.get("RESULT_CACHE")
+        if cache is None:
+            return compute()
+        if timer is not None:
+            sha256 = timer.time("hash", lambda: hashlib.sha256(data).hexdigest())
+        else:
+            sha256 = hashlib.sha256(data).hexdigest()
+        return cache.get_or_compute(cache_key(sha256, "code_sections", predictor), compute)
+
+
+def use_code_sections(model_type):
+    return model_type == "full" and app.config.get("CODE_SECTIONS") and "code" in app.config
+
+
+def code_sections_response(code_predictor, result, top_k=None):
+    prediction = code_predictor.predictions(result["probabilities"], top_k or 1)[0]
+    response = prediction_response(code_predictor, prediction, top_k)
+    response["source"] = "code_sections"
+    return response
+
+
+def classify_sampled(binary, model_type, predictor, top_k=None, timer=None):
+    # Classifies stratified windows of the upload instead of all of it, so
+    # the time taken is bounded by the size of the sample. The windows are
+    # read from the mapped upload and also classified as interleaved
+    # sub-samples, the fraction of them that agree with the prediction is
+    # returned as its estimated confidence
+    with file_buffer(binary) as data:
+        offsets = sample_windows(len(data), app.config.get("SAMPLE_WINDOWS", DEFAULT_SAMPLE_WINDOWS),
+                                 app.config.get("SAMPLE_WINDOW_SIZE", DEFAULT_SAMPLE_WINDOW_SIZE))
+        if timer is not None:
+            features, subsamples = timer.time("sample", sampled_features, data, offsets)
+        else:
+            features, subsamples = sampled_features(data, offsets)
+    rows = numpy.array([features] + subsamples, dtype=numpy.float64)
+    if timer is not None:
+        probabilities = timer.time("inference", predict_rows, model_type, predictor, rows)
+    else:
+        probabilities = predict_rows(model_type, predictor, rows)
+    predictions = predictor.predictions(probabilities, top_k or 1)
+    response = prediction_response(predictor, predictions[0], top_k)
+    response["sampled_bytes"] = sum(end - start for start, end in offsets)
+    if subsamples:
+        response["estimated_confidence"] = sum(prediction["label"] == predictions[0]["label"]
+                                               for prediction in predictions[1:]) / len(subsamples)
+    else:
+        # The whole upload was classified
+        response["estimated_confidence"] = 1.0
+    return response
+
+
+def classify_binary(binary, model_type, predictor, top_k=None, timer=None, sampled=False):
+    # Returns the response for an uploaded binary. Full executables are
+    # answered from their header, or classified by their code sections with
+    # the code model, if possible
+    if use_header(model_type):
+        label = timer.time("header", header_label, binary) if timer is not None else header_label(binary)
+        if label is not None:
+            cache = app.config.get("RESULT_CACHE")
+            if cache is not None:
+                # Nothing is computed, the answer is only cached so that a
+                # lookup of the binary finds it
+                sha256 = timer.time("hash", file_sha256, binary) if timer is not None else file_sha256(binary)
+                cache.put(cache_key(sha256, "header", None), {"label": label})
+            return header_response(label, top_k)
+
+    if sampled:
+        return classify_sampled(binary, model_type, predictor, top_k, timer)
+
+    if use_code_sections(model_type):
+        code_predictor = app.config["code"]
+        result = classify_code_sections(binary, code_predictor, timer)
+        if result is not None:
+            return code_sections_response(code_predictor, result, top_k)
+
+    result = classify_upload(binary, model_type, predictor, timer)
+    prediction = predictor.predictions(result["probabilities"], top_k or 1)[0]
+    return prediction_response(predictor, prediction, top_k)
+
+
+def streamable(model_type, predictor, sampled=False):
+    # Whether a raw upload can be classified in one pass over the request
+    # body. The fast paths of full uploads, sampling, cascades and worker
+    # processes need to seek in the upload
+    if use_header(model_type) or use_code_sections(model_type) or isinstance(predictor, CascadePredictor):
+        return False
+    if sampled:
+        return False
+    if app.config.get("PARALLEL_WORKERS"):
+        return False
+    return app.config.get("CLASSIFIER_POOL") is None or predictor.source is None
+
+
+def classify_stream(chunks, model_type, predictor, top_k=None, timer=None):
+    # Returns the response for an upload that is featurized in one pass while
+    # it is received, and hashed on the way for the result cache
+    digest = hashlib.sha256()
+
+    def hashed_chunks():
+        for chunk in chunks:
+            digest.update(chunk)
+            yield chunk
+
+    features = calculate_features_stream(timer.chunks("read", hashed_chunks()) if timer is not None else hashed_chunks(),
+                                         timer)
+    if timer is not None:
+        probabilities = timer.time("inference", predict_upload, model_type, predictor, features)
+    else:
+        probabilities = predict_upload(model_type, predictor, features)
+    cache = app.config.get("RESULT_CACHE")
+    if cache is not None:
+        cache.put(cache_key(digest.hexdigest(), model_type, predictor),
+                  {"features": features, "probabilities": probabilities})
+    prediction = predictor.predictions(probabilities, top_k or 1)[0]
+    return prediction_response(predictor, prediction, top_k)
+
+
+def classify_compressed(file_t, compression, model_type, predictor, top_k=None, timer=None, sampled=False):
+    # Compressed uploads are decompressed chunk by chunk into the feature
+    # extractor. Types that need to seek in the upload are decompressed into
+    # a spooled file first, so they get the same fast paths, results and
+    # cache keys as the uncompressed upload
+    chunks = decompressed_chunks(decompressing_reader(file_t, compression),
+                                 app.config.get("CHUNK_SIZE", DEFAULT_CHUNK_SIZE),
+                                 app.config.get("MAX_DECOMPRESSED_SIZE", DEFAULT_MAX_DECOMPRESSED_SIZE))
+    if streamable(model_type, predictor, sampled):
+        return classify_stream(chunks, model_type, predictor, top_k, timer)
+    with tempfile.SpooledTemporaryFile(RAW_SPOOL_SIZE) as binary:
+        for chunk in timer.chunks("decompress", chunks) if timer is not None else chunks:
+            binary.write(chunk)
+        binary.seek(0)
+        return classify_binary(binary, model_type, predictor, top_k, timer, sampled)
+
+
+def parse_features(body, content_type):
+    # Feature vector of a JSON body, a list or {"features": [...]}, or of a
+    # body of little endian float32 values
+    if content_type == "application/json":
+        features = json.loads(body)
+        if isinstance(features, dict):
+            features = features.get("features")
+        # numpy would also convert strings and booleans
+        if not isinstance(features, list) or not all(isinstance(value, (int, float)) and not isinstance(value, bool)
+                                                     for value in features):
+            raise ValueError("JSON features have to be a list of numbers")
+    else:
+        if len(body) % 4:
+            raise ValueError("Body of float32 features has %d bytes, not a multiple of 4" % len(body))
+        features = numpy.frombuffer(body, dtype="<f4")
+    return FEATURE_SCHEMA.validate(features)
+
+
+def cache_key(sha256, model_type, predictor):
+    # Models loaded without a known version are told apart by identity, so
+    # results never outlive the model object that produced them. Answers
+    # from the header do not depend on a model
+    if predictor is None:
+        return (sha256.lower(), model_type, None)
+    version = predictor.version or "id-" + str(id(predictor))
+    return (sha256.lower(), model_type, version)
+
+
+def cached_response(cache, sha256, model_type, predictor, top_k=None):
+    # The response classify_binary gave for a binary, or None. Full uploads
+    # may have been answered from their header or their code sections, so
+    # those entries are looked up first, in the same order
+    if use_header(model_type):
+        result = cache.get(cache_key(sha256, "header", None))
+        if result is not None:
+            return header_response(result["label"], top_k)
+    if use_code_sections(model_type):
+        code_predictor = app.config["code"]
+        result = cache.get(cache_key(sha256, "code_sections", code_predictor))
+        if result is not None:
+            return code_sections_response(code_predictor, result, top_k)
+    result = cache.get(cache_key(sha256, model_type, predictor))
+    if result is None:
+        return None
+    prediction = predictor.predictions(result["probabilities"], top_k or 1)[0]
+    return prediction_response(predictor, prediction, top_k)
+
 
 @api.route('/')
 class BinaryUpload(Resource):
     @api.expect(parser)
     @api.response(http.HTTPStatus.OK, 'Success', binary_output)
+    @api.response(http.HTTPStatus.TOO_MANY_REQUESTS, 'Lane of the request is full, see Retry-After')
+    @api.response(http.HTTPStatus.SERVICE_UNAVAILABLE, 'Timed out waiting for a slot, see Retry-After')
+    @admitted
+    def post(self):
+        timer = start_timer()
+        if timer is not None:
+            # Parsing the multipart body spools the upload
+            timer.time("upload", lambda: request.files)
+        # A type query parameter, which admission control sees, overrides
+        # the type of the form
+        model_type = request.args.get("type") or request.form.get("type")
+        top_k = request.form.get("top_k", type=int)
+        predictor = served_predictor(model_type)
+        if predictor is None:
+            return {"message": "Failed to find model to classify type: " + str(model_type)}
+
+        compression = request.form.get("compression")
+        sampled = request.form.get("sampled", False, type=inputs.boolean)
+        try:
+            if compression:
+                response = classify_compressed(request.files["binary"].stream, compression, model_type, predictor,
+                                               top_k, timer, sampled)
+            else:
+                response = classify_binary(request.files["binary"].stream, model_type, predictor, top_k, timer,
+                                           sampled)
+        except ZeroDivisionError:
+            return {"message": "Cannot classify an empty file"}, http.HTTPStatus.BAD_REQUEST
+        except DecompressedSizeError as e:
+            return {"message": str(e)}, http.HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+        except ValueError as e:
+            return {"message": str(e)}, http.HTTPStatus.BAD_REQUEST
+        finish_timer(timer, model_type)
+        return response
+
+
+@api.route('/raw')
+class BinaryRaw(Resource):
+    @api.expect(raw_parser)
+    @api.doc(consumes=["application/octet-stream"])
+    @api.response(http.HTTPStatus.OK, 'Success', binary_output)
+    @api.response(http.HTTPStatus.BAD_REQUEST, 'Empty body or corrupt compressed body')
+    @api.response(http.HTTPStatus.REQUEST_ENTITY_TOO_LARGE, 'Body decompresses to more than the limit')
+    @api.response(http.HTTPStatus.TOO_MANY_REQUESTS, 'Lane of the request is full, see Retry-After')
+    @api.response(http.HTTPStatus.SERVICE_UNAVAILABLE, 'Timed out waiting for a slot, see Retry-After')
+    def post(self):
+        timer = start_timer()
+        model_type = request.args.get("type", "code")
+        top_k = request.args.get("top_k", type=int)
+        compression = request.headers.get("Content-Encoding", request.args.get("compression", "identity"))
+        sampled = request.args.get("sampled", False, type=inputs.boolean)
+        predictor = served_predictor(model_type)
+        if predictor is None:
+            return {"message": "Failed to find model to classify type: " + str(model_type)}
+
+        # The body is the binary, there is no multipart form to parse, so
+        # requests are admitted before their body is read
+        try:
+            with admit(model_type):
+                if compression.lower() != "identity":
+                    response = classify_compressed(request.stream, compression, model_type, predictor, top_k, timer,
+                                                   sampled)
+                elif streamable(model_type, predictor, sampled):
+                    chunks = read_chunks(request.stream, app.config.get("CHUNK_SIZE", DEFAULT_CHUNK_SIZE))
+                    response = classify_stream(chunks, model_type, predictor, top_k, timer)
+                else:
+                    with tempfile.SpooledTemporaryFile(RAW_SPOOL_SIZE) as binary:
+                        if timer is not None:
+                            timer.time("upload", shutil.copyfileobj, request.stream, binary)
+                        else:
+                            shutil.copyfileobj(request.stream, binary)
+                        binary.seek(0)
+                        response = classify_binary(binary, model_type, predictor, top_k, timer, sampled)
+        except AdmissionRejected as e:
+            return rejected(e)
+        except ZeroDivisionError:
+            return {"message": "Cannot classify an empty file"}, http.HTTPStatus.BAD_REQUEST
+        except DecompressedSizeError as e:
+            return {"message": str(e)}, http.HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+        except ValueError as e:
+            return {"message": str(e)}, http.HTTPStatus.BAD_REQUEST
+        finish_timer(timer, model_type)
+        return response
+
+
+@api.route('/features')
+class BinaryFeatures(Resource):
+    @api.response(http.HTTPStatus.OK, 'Success', schema_output)
+    def get(self):
+        # Clients that calculate the features themselves check that they
+        # use the same columns as the API
+        return FEATURE_SCHEMA.to_dict()
+
+    @api.expect(features_parser)
+    @api.doc(consumes=["application/json", "application/octet-stream"])
+    @api.response(http.HTTPStatus.OK, 'Success', binary_output)
+    @api.response(http.HTTPStatus.BAD_REQUEST, 'Features do not match the feature schema')
+    @api.response(http.HTTPStatus.REQUEST_ENTITY_TOO_LARGE, 'Body is too large')
+    @api.response(http.HTTPStatus.TOO_MANY_REQUESTS, 'Lane of the request is full, see Retry-After')
+    @api.response(http.HTTPStatus.SERVICE_UNAVAILABLE, 'Timed out waiting for a slot, see Retry-After')
     def post(self):
-        # Read uploaded file into memory
-        binary = request.files["binary"].read()
+        model_type = request.args.get("type", "code")
+        top_k = request.args.get("top_k", type=int)
+        schema_version = request.args.get("schema_version")
+        predictor = served_predictor(model_type)
+        if predictor is None:
+            return {"message": "Failed to find model to classify type: " + str(model_type)}
+        if schema_version is not None and schema_version != FEATURE_SCHEMA.version:
+            return {"message": "Features of schema %s cannot be classified, the API uses feature schema %s"
+                    % (schema_version, FEATURE_SCHEMA.version)}, http.HTTPStatus.BAD_REQUEST
+        if request.content_length is not None and request.content_length > MAX_FEATURES_BODY:
+            return {"message": "Body is larger than %d bytes" % MAX_FEATURES_BODY}, http.HTTPStatus.REQUEST_ENTITY_TOO_LARGE
 
-        # Calculate features out of the binary
-        features = calculate_features(binary)
+        try:
+            features = parse_features(request.stream.read(MAX_FEATURES_BODY), request.mimetype)
+        except (TypeError, ValueError) as e:
+            return {"message": str(e)}, http.HTTPStatus.BAD_REQUEST
+        try:
+            with admit(model_type):
+                probabilities = predict_upload(model_type, predictor, features)
+        except AdmissionRejected as e:
+            return rejected(e)
+        prediction = predictor.predictions(probabilities, top_k or 1)[0]
+        return prediction_response(predictor, prediction, top_k)
 
-        # Transform features into pandas dataframe
-        query_df = pd.DataFrame([features])
-        query = pd.get_dummies(query_df)
 
-        # Use trained model to predict the architecture
+@api.route('/jobs')
+class BinaryJobs(Resource):
+    @api.expect(parser)
+    @api.response(http.HTTPStatus.ACCEPTED, 'Job queued', job_output)
+    @api.response(http.HTTPStatus.SERVICE_UNAVAILABLE, 'Job queue is full')
+    def post(self):
         model_type = request.form.get("type")
+        top_k = request.form.get("top_k", type=int)
+        compression = request.form.get("compression")
+        sampled = request.form.get("sampled", False, type=inputs.boolean)
+        predictor = served_predictor(model_type)
+        if predictor is None:
+            return {"message": "Failed to find model to classify type: " + str(model_type)}
+        jobs = app.config.get("JOB_QUEUE")
+        if jobs is None:
+            return {"message": "Asynchronous classification is disabled"}, http.HTTPStatus.NOT_FOUND
+
+        # The upload is closed when the request ends, so the job gets its own
+        # copy on disk, compressed uploads are kept compressed
+        with tempfile.NamedTemporaryFile(dir=app.config.get("JOB_DIR"), prefix="isadetect-job-", delete=False) as f:
+            shutil.copyfileobj(request.files["binary"].stream, f)
+            path = f.name
+        flask_app = app._get_current_object()
+
+        def run():
+            try:
+                with flask_app.app_context(), open(path, "rb") as binary:
+                    if compression:
+                        return classify_compressed(binary, compression, model_type, predictor, top_k, sampled=sampled)
+                    return classify_binary(binary, model_type, predictor, top_k, sampled=sampled)
+            finally:
+                os.remove(path)
+
         try:
-            model = app.config[model_type]
-        except KeyError:
+            job_id = jobs.submit(run)
+        except queue.Full:
+            os.remove(path)
+            return {"message": "Job queue is full, try again later"}, http.HTTPStatus.SERVICE_UNAVAILABLE
+        return {"job_id": job_id, "status": "queued"}, http.HTTPStatus.ACCEPTED
+
+
+@api.route('/jobs/<string:job_id>')
+@api.param('job_id', 'Id returned when the job was queued')
+class BinaryJob(Resource):
+    @api.response(http.HTTPStatus.OK, 'Success', job_output)
+    @api.response(http.HTTPStatus.NOT_FOUND, 'Job does not exist or has expired')
+    def get(self, job_id):
+        jobs = app.config.get("JOB_QUEUE")
+        job = jobs.get(job_id) if jobs is not None else None
+        if job is None:
+            return {"message": "Failed to find job: " + job_id}, http.HTTPStatus.NOT_FOUND
+        return job
+
+
+@api.route('/batch')
+class BinaryBatch(Resource):
+    @api.expect(batch_parser)
+    @api.response(http.HTTPStatus.OK, 'Success, one JSON result per line (application/x-ndjson)', binary_output)
+    @api.response(http.HTTPStatus.TOO_MANY_REQUESTS, 'Lane of the request is full, see Retry-After')
+    @api.response(http.HTTPStatus.SERVICE_UNAVAILABLE, 'Timed out waiting for a slot, see Retry-After')
+    @admitted
+    def post(self):
+        binaries = request.files.getlist("binaries")
+        archive = request.files.get("archive")
+        types = request.args.getlist("type") or request.form.getlist("type") or ["code"]
+        top_k = request.form.get("top_k", type=int)
+        if len(types) > 1 and (archive is not None or len(types) != len(binaries)):
+            return {"message": "Give one type for all files or one type per uploaded file"}, http.HTTPStatus.BAD_REQUEST
+        for model_type in types:
+            if served_predictor(model_type) is None:
+                return {"message": "Failed to find model to classify type: " + str(model_type)}
+
+        if archive is not None:
+            try:
+                files = iter_archive(archive.stream,
+                                     app.config.get("MAX_DECOMPRESSED_SIZE", DEFAULT_MAX_DECOMPRESSED_SIZE))
+            except ValueError as e:
+                return {"message": str(e)}, http.HTTPStatus.BAD_REQUEST
+        else:
+            files = ((binary.filename, binary.stream) for binary in binaries)
+
+        chunk_size = app.config.get("CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+        batch_size = app.config.get("BATCH_SIZE", DEFAULT_BATCH_SIZE)
+
+        # Files are featurized and classified batch_size at a time, results
+        # are streamed back as soon as their batch is done
+        def results():
+            pending = []
+            for i, (name, file_t) in enumerate(files):
+                model_type = types[i] if len(types) > 1 else types[0]
+                if isinstance(file_t, DecompressedSizeError):
+                    # Archive members that would exceed the decompressed size
+                    # limit are never read
+                    yield json.dumps({"name": name, "message": str(file_t)}) + "\n"
+                    continue
+                data = file_t.read(BATCH_BUFFER_SIZE + 1)
+                if not data:
+                    yield json.dumps({"name": name, "message": "Cannot classify an empty file"}) + "\n"
+                    continue
+                if len(data) <= BATCH_BUFFER_SIZE:
+                    pending.append((name, model_type, data))
+                else:
+                    pending.append((name, model_type,
+                                    calculate_features_stream(itertools.chain([data], read_chunks(file_t, chunk_size)))))
+                if len(pending) >= batch_size:
+                    for result in classify_pending(pending, top_k):
+                        yield json.dumps(result) + "\n"
+                    pending = []
+            for result in classify_pending(pending, top_k):
+                yield json.dumps(result) + "\n"
+
+        return Response(stream_with_context(results()), mimetype="application/x-ndjson")
+
+
+@api.route('/models')
+class Models(Resource):
+    @api.response(http.HTTPStatus.OK, 'Success', models_output)
+    def get(self):
+        # Memory of the loaded models in this worker process
+        store = app.config.get("MODEL_STORE")
+        usage = store.memory_usage() if store is not None else []
+        types = {}
+        for model_type in MODEL_TYPES:
+            predictor = app.config.get(model_type)
+            if predictor is not None:
+                for stage in getattr(predictor, "stages", [predictor]):
+                    types.setdefault(stage.version, []).append(model_type)
+        for model in usage:
+            model["types"] = types.get(model["version"], [])
+        return {"pid": os.getpid(), "models": usage}
+
+
+@api.route('/<string:sha256>')
+@api.param('sha256', 'sha256 hex digest of the binary')
+class BinaryLookup(Resource):
+    @api.expect(lookup_parser)
+    @api.response(http.HTTPStatus.OK, 'Success', binary_output)
+    @api.response(http.HTTPStatus.NOT_FOUND, 'Binary has not been classified')
+    def get(self, sha256):
+        model_type = request.args.get("type", "code")
+        top_k = request.args.get("top_k", type=int)
+        predictor = served_predictor(model_type)
+        if predictor is None:
             return {"message": "Failed to find model to classify type: " + str(model_type)}
 
-        prediction = model.predict(query).astype(numpy.int64)
-        prediction_int = prediction[0].item()
+        cache = app.config.get("RESULT_CACHE")
+        response = cached_response(cache, sha256, model_type, predictor, top_k) if cache is not None else None
+        if response is None:
+            return {"message": "Binary has not been classified with type: " + model_type}, http.HTTPStatus.NOT_FOUND
+        return response
+
 
-        # If the architecture is unknown, return it
-        if prediction_int == UNKNOWN_ARCHITECTURE:
-            return {"prediction": "unknown", "prediction_probability": 1}
+@api.route('/segments')
+class BinarySegments(Resource):
+    @api.expect(segment_parser)
+    @api.response(http.HTTPStatus.OK, 'Success', segments_output)
+    @api.response(http.HTTPStatus.TOO_MANY_REQUESTS, 'Lane of the request is full, see Retry-After')
+    @api.response(http.HTTPStatus.SERVICE_UNAVAILABLE, 'Timed out waiting for a slot, see Retry-After')
+    @admitted
+    def post(self):
+        model_type = request.args.get("type") or request.form.get("type", "fragment")
+        model = served_predictor(model_type)
+        if model is None:
+            return {"message": "Failed to find model to classify type: " + str(model_type)}
 
-        # Calculate prediction probability
-        prediction_proba = model.predict_proba(query)
-        probability = prediction_proba[0][prediction_int - 1]
+        window_size = request.form.get("window_size", DEFAULT_WINDOW_SIZE, type=int)
+        stride = request.form.get("stride", DEFAULT_STRIDE, type=int)
+
+        # Classify every window of the binary and merge them into regions
+        # of the same architecture. Windows are slices of the upload, which
+        # is memory mapped when it was spooled to disk
+        try:
+            with file_buffer(request.files["binary"].stream) as binary:
+                regions = segment(binary, model, window_size, stride)
+        except ValueError as e:
+            return {"message": str(e)}, http.HTTPStatus.BAD_REQUEST
 
-        # Fetch the string representation of the architecture
-        return {"prediction": get_architecture(prediction_int), "prediction_probability": probability}
+        return {"regions": regions, "model_version": model.version}
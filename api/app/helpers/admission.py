@@ -0,0 +1,171 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import contextlib
+import http
+import json
+import math
+import threading
+import time
+
+# Weight of the latest request in the moving average of a lane's service time
+SERVICE_TIME_WEIGHT = 0.2
+
+
+class AdmissionRejected(Exception):
+    """ Raised when a request is not admitted to its lane. status is the HTTP
+    status of the response and retry_after the seconds after which the
+    client should try again. """
+
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Lane():
+    """ Runs at most concurrency requests at a time and lets at most queue
+    requests wait for their turn, each for up to queue_timeout seconds. """
+
+    def __init__(self, name, concurrency, queue=0, queue_timeout=1.0, clock=time.monotonic):
+        if concurrency < 1 or queue < 0 or queue_timeout < 0:
+            raise ValueError("Lane %s needs a concurrency of at least 1 and a non-negative queue and queue_timeout" % name)
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.queue_timeout = queue_timeout
+        self.clock = clock
+        self.active = 0
+        self.waiting = 0
+        self.service_time = None
+        self.condition = threading.Condition()
+
+    def retry_after(self):
+        # Whole seconds until the requests ahead are expected to be done
+        if self.service_time is None:
+            return 1
+        return max(1, int(math.ceil(self.service_time * (self.waiting + 1) / self.concurrency)))
+
+    def acquire(self):
+        """ Take a slot of the lane and return the time it was taken. Raises
+        AdmissionRejected with 429 if the queue is full, or with 503 if the
+        request waited queue_timeout seconds without getting a slot. """
+        with self.condition:
+            if self.active >= self.concurrency or self.waiting:
+                if self.waiting >= self.queue:
+                    raise AdmissionRejected("Too many %s requests, try again later" % self.name,
+                                            http.HTTPStatus.TOO_MANY_REQUESTS, self.retry_after())
+                self.waiting += 1
+                try:
+                    deadline = self.clock() + self.queue_timeout
+                    while self.active >= self.concurrency:
+                        timeout = deadline - self.clock()
+                        if timeout <= 0:
+                            raise AdmissionRejected("Timed out waiting for a %s slot, try again later" % self.name,
+                                                    http.HTTPStatus.SERVICE_UNAVAILABLE, self.retry_after())
+                        self.condition.wait(timeout)
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+        return self.clock()
+
+    def release(self, acquired):
+        """ Give back a slot taken at time acquired. """
+        seconds = self.clock() - acquired
+        with self.condition:
+            self.active -= 1
+            if self.service_time is None:
+                self.service_time = seconds
+            else:
+                self.service_time += SERVICE_TIME_WEIGHT * (seconds - self.service_time)
+            self.condition.notify()
+
+
+class AdmissionControl():
+    """ Separate lanes of bounded concurrency per model type and payload size
+    class, so that a burst of large uploads of one type cannot take all
+    worker threads from small requests of another.
+
+    The configuration names the size classes, ordered by their largest
+    payload in bytes (null for no limit), and the lanes:
+
+        {
+            "size_classes": [["small", 65536], ["large", null]],
+            "lanes": {
+                "fragment": {"concurrency": 8, "queue": 64, "queue_timeout": 0.5},
+                "full/large": {"concurrency": 1, "queue": 4, "queue_timeout": 30},
+                "default": {"concurrency": 4, "queue": 16, "queue_timeout": 5}
+            }
+        }
+
+    A request of model type t and size class c uses the lane "t/c", else
+    the lane "t", else the lane "c", else the lane "default". Requests whose
+    type is not known before their body is read only use the lanes "c" and
+    "default". Requests without a lane are not limited. Lanes are kept per
+    process.
+    """
+
+    def __init__(self, lanes, size_classes=(), metrics=None, clock=time.monotonic):
+        self.lanes = {name: Lane(name, clock=clock, **limits) for name, limits in lanes.items()}
+        self.size_classes = [(name, limit) for name, limit in size_classes]
+        self.metrics = metrics
+
+    @classmethod
+    def from_config(cls, path, metrics=None):
+        """ Load the lanes from a JSON configuration file. Raises ValueError
+        if it is not valid. """
+        with open(path) as f:
+            config = json.load(f)
+        try:
+            return cls(config["lanes"], config.get("size_classes", ()), metrics)
+        except (KeyError, TypeError) as e:
+            raise ValueError("Invalid admission control configuration %s: %s" % (path, e))
+
+    def size_class(self, size):
+        # Requests without a Content-Length are put in the largest class
+        for name, limit in self.size_classes:
+            if limit is None or (size is not None and size <= limit):
+                return name
+        return None
+
+    def lane(self, model_type, size):
+        """ Return the lane of a request, or None. model_type is None if the
+        type of the request is not known yet. """
+        size_class = self.size_class(size)
+        names = [str(size_class), "default"]
+        if model_type is not None:
+            names = [str(model_type) + "/" + str(size_class), str(model_type)] + names
+        for name in names:
+            lane = self.lanes.get(name)
+            if lane is not None:
+                return lane
+        return None
+
+    def acquire(self, model_type, size):
+        """ Take a slot of the lane of a request, see Lane.acquire. Returns
+        the function that gives it back. """
+        lane = self.lane(model_type, size)
+        if lane is None:
+            return lambda: None
+        try:
+            acquired = lane.acquire()
+        except AdmissionRejected as e:
+            if self.metrics is not None:
+                self.metrics.observe_rejection(lane.name, int(e.status))
+            raise
+        return lambda: lane.release(acquired)
+
+    @contextlib.contextmanager
+    def admit(self, model_type, size):
+        """ Hold a slot of the lane of a request for the duration of the
+        with block. """
+        release = self.acquire(model_type, size)
+        try:
+            yield
+        finally:
+            release()
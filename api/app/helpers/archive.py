@@ -0,0 +1,67 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import tarfile
+import zipfile
+
+from .decompress import DEFAULT_MAX_DECOMPRESSED_SIZE, DecompressedSizeError
+
+
+def _zip_members(archive, max_size):
+    size = 0
+    with archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            # A zip member is only decompressed when it is opened, so one
+            # that does not fit is skipped and the next ones may still fit
+            if size + info.file_size > max_size:
+                yield info.filename, DecompressedSizeError(
+                    "Member decompresses to more than the %d bytes left of the archive" % (max_size - size))
+                continue
+            size += info.file_size
+            with archive.open(info) as member:
+                yield info.filename, member
+
+
+def _tar_members(archive, max_size):
+    size = 0
+    with archive:
+        for info in archive:
+            # Reaching the next header of a compressed tar decompresses the
+            # member before it, read or not, so every member counts
+            size += info.size
+            if not info.isfile():
+                continue
+            if size > max_size:
+                yield info.name, DecompressedSizeError(
+                    "Archive decompresses to more than %d bytes, the remaining members are skipped" % max_size)
+                return
+            yield info.name, archive.extractfile(info)
+
+
+def iter_archive(file_t, max_size=DEFAULT_MAX_DECOMPRESSED_SIZE):
+    """ Return an iterator over the name and a file object of every regular
+    file in a zip or tar (optionally compressed) archive. Members are read
+    one at a time, the archive is never extracted as a whole. Raises
+    ValueError right away if file_t is neither.
+
+    The members of an archive decompress to at most max_size bytes in
+    total. A member that does not fit is yielded with a
+    DecompressedSizeError instead of a file object; in a tar archive it
+    also ends the iteration. """
+    if zipfile.is_zipfile(file_t):
+        file_t.seek(0)
+        return _zip_members(zipfile.ZipFile(file_t), max_size)
+
+    file_t.seek(0)
+    try:
+        archive = tarfile.open(fileobj=file_t, mode="r:*")
+    except tarfile.TarError:
+        raise ValueError("Archive has to be a zip or tar file")
+    return _tar_members(archive, max_size)
@@ -0,0 +1,96 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from isadetect_features.feature_schema import BYTE_FEATURES
+
+from .predictor import Predictor
+
+
+def load_cascade_config(path):
+    """ Read a cascade configuration written by ml/calibrate_cascade.py.
+    Model paths are relative to the directory of the configuration file. """
+    with open(path) as f:
+        config = json.load(f)
+    directory = os.path.dirname(os.path.abspath(path))
+    for key in ("cheap_model", "full_model"):
+        config[key] = os.path.join(directory, config[key])
+    config["threshold"] = float(config["threshold"])
+    return config
+
+
+class CascadePredictor(Predictor):
+    """ Classifies with a cheap model trained on the byte frequencies only
+    and falls through to the full model for the rows where the top
+    probability of the cheap model is below threshold.
+
+    Uploads only need the byte histogram as long as the cheap model is
+    confident, fingerprints are scanned for the rows that fall through. The
+    probabilities of both models are returned in the class order of the full
+    model, so the cascade is used like any other predictor.
+    """
+
+    def __init__(self, cheap, full, threshold):
+        if cheap.model.n_features_in_ != BYTE_FEATURES:
+            raise ValueError("Cheap model of a cascade expects %d features instead of the %d byte frequencies"
+                             % (cheap.model.n_features_in_, BYTE_FEATURES))
+        missing = np.setdiff1d(cheap.classes_, full.classes_)
+        if len(missing):
+            raise ValueError("Cheap model of a cascade has classes the full model does not have: "
+                             + ", ".join(str(label) for label in missing))
+        self.cheap = cheap
+        self.full = full
+        # Predictors of the loaded model files, kept by ModelStore.prune
+        self.stages = (cheap, full)
+        self.threshold = threshold
+        self.model = full.model
+        self.small_batch_model = full.small_batch_model
+        self.classes_ = full.classes_
+        self.version = "%s+%s@%g" % (cheap.version, full.version, threshold)
+        # Not run in a ClassifierPool, the cascade decides per upload whether
+        # the fingerprints are needed
+        self.source = None
+        # Column of every cheap class in the probabilities of the full model
+        self.columns = np.searchsorted(self.classes_, cheap.classes_)
+
+    def warm_up(self, rows=4, seed=0):
+        self.cheap.warm_up(rows, seed)
+        self.full.warm_up(rows, seed)
+
+    def cheap_proba(self, byte_frequencies):
+        """ Return the probabilities of the cheap model for a row or matrix
+        of byte frequencies, in the class order of the full model. """
+        cheap = self.cheap.predict_proba(byte_frequencies)
+        probabilities = np.zeros((len(cheap), len(self.classes_)), dtype=cheap.dtype)
+        probabilities[:, self.columns] = cheap
+        return probabilities
+
+    def confident(self, probabilities):
+        """ Return the mask of the rows the cheap model answers. """
+        return probabilities.max(axis=1) >= self.threshold
+
+    def cascade_proba(self, features):
+        """ Return the class probabilities of a feature row or matrix and
+        the mask of the rows that fell through to the full model. """
+        features = np.asarray(features, dtype=np.float64)
+        if features.ndim == 1:
+            features = features[None, :]
+        probabilities = self.cheap_proba(features[:, :BYTE_FEATURES])
+        fell_through = ~self.confident(probabilities)
+        if fell_through.any():
+            full = self.full.predict_proba(features[fell_through])
+            probabilities = probabilities.astype(full.dtype)
+            probabilities[fell_through] = full
+        return probabilities, fell_through
+
+    def predict_proba(self, features):
+        return self.cascade_proba(features)[0]
@@ -0,0 +1,73 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import gzip
+import lzma
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    # zstd uploads are only accepted with the zstandard package installed
+    zstandard = None
+
+from isadetect_features.feature_stream import DEFAULT_CHUNK_SIZE
+
+# Uploads that decompress to more than this are rejected
+DEFAULT_MAX_DECOMPRESSED_SIZE = 1 << 30
+
+# Content-Encoding values by compression
+COMPRESSIONS = {
+    "gzip": "gzip",
+    "x-gzip": "gzip",
+    "xz": "xz",
+    "x-xz": "xz",
+    "zstd": "zstd",
+}
+
+
+class DecompressedSizeError(ValueError):
+    pass
+
+
+def decompressing_reader(file_t, compression):
+    """ Return a file object that reads the decompressed contents of a gzip,
+    xz or zstd compressed file object. Raises ValueError for other
+    compressions. """
+    compression = COMPRESSIONS.get(compression.lower())
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=file_t, mode="rb")
+    if compression == "xz":
+        return lzma.LZMAFile(file_t)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compressed uploads need the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(file_t)
+    raise ValueError("Unsupported compression, use gzip, xz or zstd")
+
+
+def decompressed_chunks(reader, chunk_size=DEFAULT_CHUNK_SIZE, max_size=DEFAULT_MAX_DECOMPRESSED_SIZE):
+    """ Yield the decompressed contents of reader in chunks. Every read
+    decompresses at most chunk_size bytes, so a compression bomb is stopped
+    with DecompressedSizeError as soon as it exceeds max_size bytes. Corrupt
+    input raises ValueError. """
+    errors = (OSError, EOFError, lzma.LZMAError, zlib.error)
+    if zstandard is not None:
+        errors += (zstandard.ZstdError,)
+    size = 0
+    while True:
+        try:
+            chunk = reader.read(chunk_size)
+        except errors as e:
+            raise ValueError("Failed to decompress the upload: " + str(e))
+        if not chunk:
+            return
+        size += len(chunk)
+        if size > max_size:
+            raise DecompressedSizeError("Upload decompresses to more than %d bytes" % max_size)
+        yield chunk
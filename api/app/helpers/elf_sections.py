@@ -0,0 +1,106 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import contextlib
+import io
+import mmap
+import struct
+
+from isadetect_features.feature_stream import DEFAULT_CHUNK_SIZE
+
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+SHT_NOBITS = 8
+
+# objcopy -O binary fills the address gaps between the sections with zeros.
+# Larger gaps than this are not filled, so that a crafted section table
+# cannot make the API count terabytes of padding
+MAX_GAP = 64 << 10
+
+_SECTION_HEADERS = {
+    # EI_CLASS: (ELF header fields from e_shoff, offset of e_shoff, section
+    # header fields, section header size)
+    1: ("I4xHHHHH", 32, "IIIIIIIIII", 40),
+    2: ("Q4xHHHHH", 40, "IIQQQQIIQQ", 64),
+}
+
+
+@contextlib.contextmanager
+def file_buffer(file_t):
+    """ Yield the contents of a binary file object as a buffer without
+    reading it into memory where possible: in-memory uploads are used as
+    they are and uploads spooled to disk are memory mapped. """
+    if hasattr(file_t, "getbuffer"):
+        with file_t.getbuffer() as view:
+            yield view
+        return
+    try:
+        mapped = mmap.mmap(file_t.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        # Not a file or an empty one
+        file_t.seek(0)
+        yield file_t.read()
+        return
+    try:
+        yield mapped
+    finally:
+        mapped.close()
+
+
+def code_sections(data):
+    """ Return the (address, offset, size) of every section of an ELF file
+    that is loaded and holds instructions (SHF_EXECINSTR), sorted by address.
+    These are the sections the dataset generator extracts with objcopy for
+    the code model. The list is empty if data is not a well-formed ELF file
+    or has no code. """
+    if len(data) < 64 or data[:4] != b"\x7fELF" or data[4] not in _SECTION_HEADERS or data[5] not in (1, 2):
+        return []
+    order = "<" if data[5] == 1 else ">"
+    header_fields, header_offset, section_fields, section_size = _SECTION_HEADERS[data[4]]
+    shoff, _, _, _, shentsize, shnum = struct.unpack_from(order + header_fields, data, header_offset)
+    if shoff == 0 or shentsize != section_size:
+        return []
+    if shnum == 0:
+        # More sections than fit e_shnum, the count is the size of section 0
+        if shoff + section_size > len(data):
+            return []
+        shnum = struct.unpack_from(order + section_fields, data, shoff)[5]
+    if shoff + shnum * section_size > len(data):
+        return []
+
+    sections = []
+    for i in range(shnum):
+        _, section_type, flags, address, offset, size, _, _, _, _ = struct.unpack_from(
+            order + section_fields, data, shoff + i * section_size)
+        if section_type == SHT_NOBITS or size == 0 or flags & (SHF_ALLOC | SHF_EXECINSTR) != SHF_ALLOC | SHF_EXECINSTR:
+            continue
+        if offset + size > len(data):
+            return []
+        sections.append((address, offset, size))
+    sections.sort()
+    return sections
+
+
+def section_chunks(data, sections, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Yield the contents of sections as zero-copy slices of data, in
+    address order with the gaps between them filled with zeros, the same
+    bytes objcopy -O binary writes. Every address is written once: a section
+    that overlaps the ones before it only adds the bytes after them. """
+    view = memoryview(data)
+    end = None
+    for address, offset, size in sections:
+        skip = 0
+        if end is not None:
+            if address + size <= end:
+                continue
+            if 0 < address - end <= MAX_GAP:
+                yield bytes(address - end)
+            skip = max(0, end - address)
+        for start in range(offset + skip, offset + size, chunk_size):
+            yield view[start:min(start + chunk_size, offset + size)]
+        end = address + size if end is None else max(end, address + size)
@@ -0,0 +1,141 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import struct
+
+# Every header field read below lies within the first bytes of the file,
+# except for PE files with an unusually large DOS stub
+HEADER_SIZE = 4096
+
+# ELF e_machine by (e_machine, EI_CLASS, EI_DATA) to the labels of
+# get_architecture. Machines whose ABI variants share a header, like
+# powerpc and powerpcspe, are left to the model
+_ELFCLASS32, _ELFCLASS64 = 1, 2
+_ELFDATA2LSB, _ELFDATA2MSB = 1, 2
+ELF_MACHINES = {
+    (0x9026, _ELFCLASS64, _ELFDATA2LSB): 1,  # alpha
+    (62, _ELFCLASS64, _ELFDATA2LSB): 2,  # amd64
+    (183, _ELFCLASS64, _ELFDATA2LSB): 3,  # arm64
+    (15, _ELFCLASS32, _ELFDATA2MSB): 6,  # hppa
+    (3, _ELFCLASS32, _ELFDATA2LSB): 7,  # i386
+    (50, _ELFCLASS64, _ELFDATA2LSB): 8,  # ia64
+    (4, _ELFCLASS32, _ELFDATA2MSB): 9,  # m68k
+    (8, _ELFCLASS32, _ELFDATA2MSB): 10,  # mips
+    (8, _ELFCLASS64, _ELFDATA2LSB): 11,  # mips64el
+    (8, _ELFCLASS32, _ELFDATA2LSB): 12,  # mipsel
+    (21, _ELFCLASS64, _ELFDATA2MSB): 15,  # ppc64
+    (21, _ELFCLASS64, _ELFDATA2LSB): 16,  # ppc64el
+    (243, _ELFCLASS64, _ELFDATA2LSB): 17,  # riscv64
+    (22, _ELFCLASS32, _ELFDATA2MSB): 18,  # s390
+    (22, _ELFCLASS64, _ELFDATA2MSB): 19,  # s390x
+    (42, _ELFCLASS32, _ELFDATA2LSB): 20,  # sh4
+    (2, _ELFCLASS32, _ELFDATA2MSB): 21,  # sparc
+    (18, _ELFCLASS32, _ELFDATA2MSB): 21,  # sparc32plus
+    (43, _ELFCLASS64, _ELFDATA2MSB): 22,  # sparc64
+    (62, _ELFCLASS32, _ELFDATA2LSB): 23,  # x32
+}
+_EM_ARM = 40
+_EF_ARM_ABI_FLOAT_SOFT = 0x200
+_EF_ARM_ABI_FLOAT_HARD = 0x400
+
+# PE Machine to (label, optional header magic)
+_PE32, _PE32_PLUS = 0x10b, 0x20b
+PE_MACHINES = {
+    0x14c: (7, _PE32),  # i386
+    0x8664: (2, _PE32_PLUS),  # amd64
+    0xaa64: (3, _PE32_PLUS),  # arm64
+    0x200: (8, _PE32_PLUS),  # ia64
+    0x5064: (17, _PE32_PLUS),  # riscv64
+}
+
+# Mach-O cputype to label, the 64-bit types have CPU_ARCH_ABI64 set
+_CPU_ARCH_ABI64 = 0x01000000
+MACHO_CPU_TYPES = {
+    7: 7,  # i386
+    7 | _CPU_ARCH_ABI64: 2,  # amd64
+    12 | _CPU_ARCH_ABI64: 3,  # arm64
+    18: 13,  # powerpc
+    18 | _CPU_ARCH_ABI64: 15,  # ppc64
+}
+
+
+def _elf_architecture(header, size):
+    if len(header) < 52:
+        return None
+    elf_class, elf_data, elf_version = header[4], header[5], header[6]
+    if elf_class not in (_ELFCLASS32, _ELFCLASS64) or elf_data not in (_ELFDATA2LSB, _ELFDATA2MSB) or elf_version != 1:
+        return None
+    order = "<" if elf_data == _ELFDATA2LSB else ">"
+    if elf_class == _ELFCLASS32:
+        fields = order + "HHIIIIIHHHHHH"
+        ehsize = 52
+    else:
+        fields = order + "HHIQQQIHHHHHH"
+        ehsize = 64
+    if len(header) < ehsize:
+        return None
+    (_, machine, version, _, phoff, shoff, flags, header_size, phentsize, phnum, shentsize, shnum,
+     _) = struct.unpack_from(fields, header, 16)
+    # A header that contradicts itself or the size of the file is more
+    # likely a fragment or a corrupted file than an executable
+    if version != 1 or header_size != ehsize:
+        return None
+    if phoff + phentsize * phnum > size or shoff + shentsize * shnum > size:
+        return None
+
+    if machine == _EM_ARM and elf_class == _ELFCLASS32 and elf_data == _ELFDATA2LSB:
+        if flags & _EF_ARM_ABI_FLOAT_HARD:
+            return 5  # armhf
+        if flags & _EF_ARM_ABI_FLOAT_SOFT:
+            return 4  # armel
+        return None
+    return ELF_MACHINES.get((machine, elf_class, elf_data))
+
+
+def _pe_architecture(header, size):
+    if len(header) < 64:
+        return None
+    pe_offset, = struct.unpack_from("<I", header, 0x3c)
+    if pe_offset + 26 > min(len(header), size) or header[pe_offset:pe_offset + 4] != b"PE\0\0":
+        return None
+    machine, = struct.unpack_from("<H", header, pe_offset + 4)
+    optional_header_size, = struct.unpack_from("<H", header, pe_offset + 20)
+    magic, = struct.unpack_from("<H", header, pe_offset + 24)
+    architecture = PE_MACHINES.get(machine)
+    if architecture is None or optional_header_size == 0 or architecture[1] != magic:
+        return None
+    return architecture[0]
+
+
+def _macho_architecture(header, size):
+    if len(header) < 28:
+        return None
+    for order in ("<", ">"):
+        magic, cputype = struct.unpack_from(order + "Ii", header, 0)
+        if magic in (0xfeedface, 0xfeedfacf):
+            break
+    else:
+        return None
+    # The header of 64-bit files is 64-bit as well
+    if (magic == 0xfeedfacf) != bool(cputype & _CPU_ARCH_ABI64):
+        return None
+    sizeofcmds, = struct.unpack_from(order + "I", header, 20)
+    if (32 if magic == 0xfeedfacf else 28) + sizeofcmds > size:
+        return None
+    return MACHO_CPU_TYPES.get(cputype)
+
+
+def header_architecture(header, size):
+    """ Return the get_architecture label of an ELF, PE or Mach-O executable
+    from its first HEADER_SIZE bytes and its size, or None if header is not
+    a well-formed executable header of an unambiguous architecture. """
+    if header[:4] == b"\x7fELF":
+        return _elf_architecture(header, size)
+    if header[:2] == b"MZ":
+        return _pe_architecture(header, size)
+    return _macho_architecture(header, size)
@@ -0,0 +1,124 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import numpy as np
+import sklearn
+
+# Trees of scikit-learn 1.4 and later store class fractions in their leaves
+# and return them as they are, older versions store weighted counts and
+# normalize them in predict_proba
+_NORMALIZE_LEAVES = tuple(int(part) for part in sklearn.__version__.split(".")[:2]) < (1, 4)
+
+# Rows traversed at once, bounds the size of the gathered leaf distributions
+ROWS_PER_STEP = 256
+
+
+def _float32_at_most(threshold):
+    # Largest float32 that is not above the float64 threshold. Features are
+    # compared as float32 like in scikit-learn, and for a float32 x,
+    # x <= threshold holds exactly when x <= this value
+    rounded = threshold.astype(np.float32)
+    above = rounded.astype(np.float64) > threshold
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+    return rounded
+
+
+class FlatForest():
+    """ A trained random forest flattened into contiguous arrays, scored with
+    vectorized NumPy traversal instead of one scikit-learn call per tree.
+
+    The nodes of all trees are stored one after another. Every node has a
+    feature index, a float32 threshold and the global offsets of its
+    children. Leaves point to themselves and have an infinite threshold, so
+    a fixed number of steps takes every row to a leaf in every tree. Leaf
+    class distributions are exported as the trees would return them, and
+    predict_proba adds them up in the order of the trees, which gives the
+    same probabilities as RandomForestClassifier.predict_proba.
+    """
+
+    def __init__(self, classes, roots, feature, threshold, children_left, children_right, leaf_index, leaf_values,
+                 max_depth, n_features_in_, feature_schema=None):
+        self.classes_ = classes
+        self.roots = roots
+        self.feature = feature
+        self.threshold = threshold
+        self.children_left = children_left
+        self.children_right = children_right
+        self.leaf_index = leaf_index
+        self.leaf_values = leaf_values
+        self.max_depth = max_depth
+        self.n_features_in_ = n_features_in_
+        if feature_schema is not None:
+            self.feature_schema = feature_schema
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """ Export a fitted RandomForestClassifier with a single output. """
+        if getattr(model, "n_outputs_", None) != 1 or not hasattr(model, "estimators_"):
+            raise ValueError("Only fitted single output random forest classifiers can be flattened")
+
+        trees = [estimator.tree_ for estimator in model.estimators_]
+        sizes = np.array([tree.node_count for tree in trees], dtype=np.int64)
+        roots = np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(np.int32)
+        features, thresholds, lefts, rights, leaf_indices, leaf_values = [], [], [], [], [], []
+        leaf_count = 0
+        for root, tree in zip(roots.tolist(), trees):
+            nodes = np.arange(tree.node_count, dtype=np.int64)
+            is_leaf = tree.children_left < 0
+            features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+            thresholds.append(_float32_at_most(np.where(is_leaf, np.inf, tree.threshold)))
+            lefts.append((np.where(is_leaf, nodes, tree.children_left) + root).astype(np.int32))
+            rights.append((np.where(is_leaf, nodes, tree.children_right) + root).astype(np.int32))
+
+            leaf_index = np.full(tree.node_count, -1, dtype=np.int32)
+            leaf_index[is_leaf] = np.arange(leaf_count, leaf_count + is_leaf.sum(), dtype=np.int32)
+            leaf_count += int(is_leaf.sum())
+            leaf_indices.append(leaf_index)
+
+            values = tree.value[is_leaf, 0, :len(model.classes_)].astype(np.float64)
+            if _NORMALIZE_LEAVES:
+                # The same normalization DecisionTreeClassifier.predict_proba does
+                normalizer = values.sum(axis=1)[:, np.newaxis]
+                normalizer[normalizer == 0.0] = 1.0
+                values = values / normalizer
+            leaf_values.append(values)
+
+        return cls(np.asarray(model.classes_), roots,
+                   np.concatenate(features), np.concatenate(thresholds),
+                   np.concatenate(lefts), np.concatenate(rights),
+                   np.concatenate(leaf_indices), np.concatenate(leaf_values),
+                   max(tree.max_depth for tree in trees),
+                   getattr(model, "n_features_in_", trees[0].n_features),
+                   getattr(model, "feature_schema", None))
+
+    def apply(self, features):
+        """ Return the global leaf node of every row in every tree. """
+        features = np.asarray(features, dtype=np.float32)
+        rows = np.arange(len(features))[:, np.newaxis]
+        nodes = np.repeat(self.roots[np.newaxis, :], len(features), axis=0)
+        for _ in range(self.max_depth):
+            go_left = features[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.children_left[nodes], self.children_right[nodes])
+        return nodes
+
+    def predict_proba(self, features):
+        features = np.atleast_2d(features)
+        if features.shape[1] != self.n_features_in_:
+            raise ValueError("Expected %d features, got %d" % (self.n_features_in_, features.shape[1]))
+
+        probabilities = np.empty((len(features), len(self.classes_)), dtype=np.float64)
+        for first in range(0, len(features), ROWS_PER_STEP):
+            leaves = self.leaf_index[self.apply(features[first:first + ROWS_PER_STEP])]
+            # Summed over the tree axis in tree order, like the forest
+            # accumulates the predictions of its estimators
+            probabilities[first:first + ROWS_PER_STEP] = self.leaf_values[leaves].sum(axis=1)
+        probabilities /= len(self.roots)
+        return probabilities
+
+    def predict(self, features):
+        return self.classes_[self.predict_proba(features).argmax(axis=1)]
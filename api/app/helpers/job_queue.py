@@ -0,0 +1,142 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import json
+import logging
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+DEFAULT_JOB_WORKERS = 2
+DEFAULT_JOB_QUEUE_SIZE = 16
+DEFAULT_JOB_RETENTION = 60 * 60
+
+JOB_ID = re.compile("[0-9a-f]{32}")
+
+
+class JobQueue():
+    """ Bounded queue of jobs run by a pool of worker threads.
+
+    submit returns a job id right away, get returns the status of the job
+    and its result once it is done. The status of every job is kept in a
+    file in directory, so any worker process of a server can answer get for
+    a job that another worker runs. Jobs run in the process that queued
+    them and max_queued is a bound per process. Finished jobs are forgotten
+    retention seconds after they finished. Worker threads are started on
+    the first submit in every process, so the queue can be created before
+    a server forks its workers.
+    """
+
+    def __init__(self, workers=DEFAULT_JOB_WORKERS, max_queued=DEFAULT_JOB_QUEUE_SIZE,
+                 retention=DEFAULT_JOB_RETENTION, directory=None, clock=time.time):
+        self.workers = workers
+        self.retention = retention
+        self.clock = clock
+        self.directory = os.path.join(directory or tempfile.gettempdir(), "isadetect-jobs")
+        os.makedirs(self.directory, exist_ok=True)
+        self.queue = queue.Queue(max_queued)
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def _start(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            for i in range(self.workers):
+                threading.Thread(target=self._work, name="job-worker-%d" % i, daemon=True).start()
+            self.pid = os.getpid()
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, job_id + ".json")
+
+    def _write(self, job):
+        # Replaced atomically, readers never see a partly written status
+        fd, path = tempfile.mkstemp(dir=self.directory, prefix=".job-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(job, f)
+            os.replace(path, self._path(job["job_id"]))
+        except BaseException:
+            os.remove(path)
+            raise
+
+    def _read(self, job_id):
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _work(self):
+        while True:
+            job, function, args = self.queue.get()
+            self._write(dict(job, status="running"))
+            try:
+                state = {"status": "done", "result": function(*args)}
+            except Exception as e:
+                logging.error("Job %s failed: %s", job["job_id"], e)
+                state = {"status": "failed", "message": str(e)}
+            state["finished"] = self.clock()
+            try:
+                self._write(dict(job, **state))
+            except (OSError, TypeError, ValueError) as e:
+                logging.error("Failed to store the result of job %s: %s", job["job_id"], e)
+
+    def _expire(self):
+        # A status file is not modified after the job finished, so only
+        # files older than the retention need to be read
+        now = self.clock()
+        for name in os.listdir(self.directory):
+            job_id, extension = os.path.splitext(name)
+            if extension != ".json" or not JOB_ID.fullmatch(job_id):
+                continue
+            try:
+                if os.path.getmtime(self._path(job_id)) + self.retention > now:
+                    continue
+            except OSError:
+                continue
+            job = self._read(job_id)
+            if job is not None and "finished" in job and job["finished"] + self.retention <= now:
+                try:
+                    os.remove(self._path(job_id))
+                except OSError:
+                    pass
+
+    def submit(self, function, *args):
+        """ Queue function(*args) and return the id of the job. Raises
+        queue.Full if the queue is full. """
+        self._start()
+        job = {"job_id": uuid.uuid4().hex, "status": "queued"}
+        self._expire()
+        # The status is written before the job can start, so it cannot
+        # overwrite the status written by the worker
+        self._write(job)
+        try:
+            self.queue.put_nowait((job, function, args))
+        except queue.Full:
+            os.remove(self._path(job["job_id"]))
+            raise
+        return job["job_id"]
+
+    def get(self, job_id):
+        """ Return the status of a job and its result or error message, or
+        None if there is no such job. """
+        if not JOB_ID.fullmatch(job_id):
+            return None
+        job = self._read(job_id)
+        if job is None:
+            return None
+        if "finished" in job and job["finished"] + self.retention <= self.clock():
+            return None
+        return {key: value for key, value in job.items() if key != "finished"}
@@ -0,0 +1,201 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import bisect
+import threading
+import time
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+# Bucket bounds from 1 microsecond to about 10 minutes, four per doubling,
+# so quantiles are estimated within 19% with a fixed amount of memory
+BUCKET_BOUNDS = [1e-6 * 2 ** (i / 4) for i in range(4 * 30)]
+
+# Micro-batch sizes are counted in powers of two
+BATCH_SIZE_BOUNDS = [2 ** i for i in range(13)]
+
+
+class Histogram():
+    """ Count, sum and log scale buckets of observed durations, or of other
+    values with the given bucket bounds. """
+
+    def __init__(self, bounds=BUCKET_BOUNDS):
+        self.bounds = bounds
+        self.count = 0
+        self.sum = 0.0
+        self.bytes = 0
+        self.buckets = [0] * (len(bounds) + 1)
+
+    def observe(self, value, byte_count=0):
+        self.count += 1
+        self.sum += value
+        self.bytes += byte_count
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+
+    def quantile(self, q):
+        """ Return the upper bound of the bucket holding the q quantile. """
+        if self.count == 0:
+            return float("nan")
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return self.bounds[i] if i < len(self.bounds) else float("inf")
+        return float("inf")
+
+
+class RequestTimer():
+    """ Durations of the stages of one request. """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.byte_counts = {}
+
+    def add(self, stage, seconds, byte_count=0):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+        if byte_count:
+            self.byte_counts[stage] = self.byte_counts.get(stage, 0) + byte_count
+
+    def time(self, stage, function, *args):
+        """ Call function with args and add its duration to stage. """
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def chunks(self, stage, chunks):
+        """ Yield chunks, adding the time spent waiting for every chunk and
+        their size to stage. """
+        iterator = iter(chunks)
+        while True:
+            start = time.perf_counter()
+            chunk = next(iterator, None)
+            if chunk is None:
+                self.add(stage, time.perf_counter() - start)
+                return
+            self.add(stage, time.perf_counter() - start, len(chunk))
+            yield chunk
+
+    def finish(self):
+        """ Add the time since the timer was created as the total stage. """
+        self.add("total", time.perf_counter() - self.started)
+
+    def server_timing(self):
+        """ Return the value of a Server-Timing header, durations in ms. """
+        return ", ".join("%s;dur=%.3f" % (stage, seconds * 1e3) for stage, seconds in self.timings.items())
+
+
+def _value(value):
+    if value != value:
+        return "NaN"
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value)
+
+
+def _labels(**labels):
+    return "{" + ",".join('%s="%s"' % (key, value) for key, value in labels.items()) + "}"
+
+
+class Metrics():
+    """ Per stage and model type latency histograms and processed bytes of
+    this process, the rows cascades answered with their cheap model or let
+    fall through, the sizes of micro-batches and the requests rejected by
+    admission control, rendered in the Prometheus text format. """
+
+    def __init__(self):
+        self.histograms = {}
+        self.cascades = {}
+        self.batch_sizes = {}
+        self.rejections = {}
+        self.lock = threading.Lock()
+
+    def observe(self, model_type, timer):
+        """ Add the stage durations of a finished request. """
+        with self.lock:
+            for stage, seconds in timer.timings.items():
+                histogram = self.histograms.get((stage, model_type))
+                if histogram is None:
+                    histogram = self.histograms[(stage, model_type)] = Histogram()
+                histogram.observe(seconds, timer.byte_counts.get(stage, 0))
+
+    def observe_cascade(self, model_type, rows, fell_through):
+        """ Count rows classified by a cascade, fell_through of them by its
+        full model. """
+        with self.lock:
+            counts = self.cascades.setdefault(model_type, [0, 0])
+            counts[0] += rows
+            counts[1] += fell_through
+
+    def observe_batch(self, model_type, size):
+        """ Add the number of rows of a micro-batch. """
+        with self.lock:
+            histogram = self.batch_sizes.get(model_type)
+            if histogram is None:
+                histogram = self.batch_sizes[model_type] = Histogram(BATCH_SIZE_BOUNDS)
+            histogram.observe(size)
+
+    def observe_rejection(self, lane, status):
+        """ Count a request an admission control lane rejected with status. """
+        with self.lock:
+            self.rejections[(lane, status)] = self.rejections.get((lane, status), 0) + 1
+
+    def render(self):
+        lines = [
+            "# HELP isadetect_stage_seconds Time spent in each stage of a classification request",
+            "# TYPE isadetect_stage_seconds summary",
+        ]
+        with self.lock:
+            items = sorted(self.histograms.items())
+            for (stage, model_type), histogram in items:
+                for q in QUANTILES:
+                    lines.append("isadetect_stage_seconds%s %s" % (
+                        _labels(stage=stage, model_type=model_type, quantile=q), _value(histogram.quantile(q))))
+                labels = _labels(stage=stage, model_type=model_type)
+                lines.append("isadetect_stage_seconds_sum%s %s" % (labels, _value(histogram.sum)))
+                lines.append("isadetect_stage_seconds_count%s %d" % (labels, histogram.count))
+            lines.append("# HELP isadetect_stage_bytes_total Bytes processed by each stage of a classification request")
+            lines.append("# TYPE isadetect_stage_bytes_total counter")
+            for (stage, model_type), histogram in items:
+                if histogram.bytes:
+                    lines.append("isadetect_stage_bytes_total%s %d" % (_labels(stage=stage, model_type=model_type),
+                                                                       histogram.bytes))
+            if self.cascades:
+                lines.append("# HELP isadetect_cascade_rows_total Rows classified by a cascade")
+                lines.append("# TYPE isadetect_cascade_rows_total counter")
+                for model_type, (rows, _) in sorted(self.cascades.items()):
+                    lines.append("isadetect_cascade_rows_total%s %d" % (_labels(model_type=model_type), rows))
+                lines.append("# HELP isadetect_cascade_fall_through_total Rows a cascade classified with its full model")
+                lines.append("# TYPE isadetect_cascade_fall_through_total counter")
+                for model_type, (_, fell_through) in sorted(self.cascades.items()):
+                    lines.append("isadetect_cascade_fall_through_total%s %d" % (_labels(model_type=model_type),
+                                                                               fell_through))
+                lines.append("# HELP isadetect_cascade_fall_through_ratio Fraction of the rows a cascade classified with its full model")
+                lines.append("# TYPE isadetect_cascade_fall_through_ratio gauge")
+                for model_type, (rows, fell_through) in sorted(self.cascades.items()):
+                    lines.append("isadetect_cascade_fall_through_ratio%s %s" % (
+                        _labels(model_type=model_type), _value(fell_through / rows if rows else float("nan"))))
+            if self.batch_sizes:
+                lines.append("# HELP isadetect_micro_batch_size Rows classified together by the micro-batcher")
+                lines.append("# TYPE isadetect_micro_batch_size summary")
+                for model_type, histogram in sorted(self.batch_sizes.items()):
+                    for q in QUANTILES:
+                        lines.append("isadetect_micro_batch_size%s %s" % (
+                            _labels(model_type=model_type, quantile=q), _value(histogram.quantile(q))))
+                    labels = _labels(model_type=model_type)
+                    lines.append("isadetect_micro_batch_size_sum%s %s" % (labels, _value(histogram.sum)))
+                    lines.append("isadetect_micro_batch_size_count%s %d" % (labels, histogram.count))
+            if self.rejections:
+                lines.append("# HELP isadetect_admission_rejected_total Requests rejected by admission control")
+                lines.append("# TYPE isadetect_admission_rejected_total counter")
+                for (lane, status), count in sorted(self.rejections.items()):
+                    lines.append("isadetect_admission_rejected_total%s %d" % (_labels(lane=lane, status=status), count))
+        return "\n".join(lines) + "\n"
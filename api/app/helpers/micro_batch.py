@@ -0,0 +1,116 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+import numpy as np
+
+# Model types that can be micro-batched, cascades classify their uploads in
+# two stages and are never batched
+MICRO_BATCH_TYPES = ("code", "full", "fragment")
+
+DEFAULT_MICRO_BATCH_SIZE = 64
+DEFAULT_MICRO_BATCH_LATENCY = 0.002
+# Seconds a request waits for the result of its micro-batch
+DEFAULT_MICRO_BATCH_TIMEOUT = 30.0
+
+
+class MicroBatcher():
+    """ Collects the feature rows of concurrent requests and classifies them
+    with one predict_proba call per predictor, so that many tiny requests
+    pay the per call overhead of the model once.
+
+    A batch is closed when it has max_batch rows or max_latency seconds
+    after its first row arrived, whichever comes first. Rows of different
+    model types or model versions are classified separately. The batching
+    thread is started on the first request in every process. A request
+    gives up with TimeoutError after waiting timeout seconds for its batch.
+    If metrics (metrics.Metrics) are given, the size of every batch is
+    observed.
+    """
+
+    def __init__(self, max_batch=DEFAULT_MICRO_BATCH_SIZE, max_latency=DEFAULT_MICRO_BATCH_LATENCY, metrics=None,
+                 timeout=DEFAULT_MICRO_BATCH_TIMEOUT):
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.timeout = timeout
+        self.metrics = metrics
+        self.queue = queue.Queue()
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            threading.Thread(target=self._work, name="micro-batcher", daemon=True).start()
+            self.pid = os.getpid()
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_latency
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _work(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._classify_batch(batch)
+            except Exception as e:
+                # The thread has to survive, and every request of the batch
+                # gets an answer
+                for _, _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _classify_batch(self, batch):
+        groups = {}
+        for model_type, predictor, row, future in batch:
+            # Requests that timed out have cancelled their future
+            if future.set_running_or_notify_cancel():
+                groups.setdefault((model_type, id(predictor)), (predictor, []))[1].append((row, future))
+        for (model_type, _), (predictor, items) in groups.items():
+            self._classify(model_type, predictor, items)
+
+    def _classify(self, model_type, predictor, items):
+        try:
+            probabilities = predictor.predict_proba(np.array([row for row, _ in items], dtype=np.float64))
+        except Exception as e:
+            for _, future in items:
+                future.set_exception(e)
+            return
+        if self.metrics is not None:
+            self.metrics.observe_batch(model_type, len(items))
+        for i, (_, future) in enumerate(items):
+            future.set_result(probabilities[i:i + 1])
+
+    def predict_proba(self, model_type, predictor, features):
+        """ Return the class probabilities of one feature row, classified
+        together with the rows of concurrent calls. """
+        self._start()
+        future = Future()
+        self.queue.put((model_type, predictor, features, future))
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
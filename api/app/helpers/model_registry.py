@@ -0,0 +1,126 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from isadetect_features.feature_schema import FEATURE_SCHEMA
+
+MODEL_TYPES = ("code", "full", "fragment")
+DEFAULT_RELOAD_INTERVAL = 10.0
+
+
+class ModelRegistry():
+    """ Serves the newest model version of every type from a registry
+    directory and swaps in new versions while the API is running.
+
+    The registry has a subdirectory per model type, each holding model files
+    named by their version, for example code/2019-06-01.ml. The version whose
+    file name sorts last is active. Files starting with a dot are ignored,
+    so a new version can be copied in under a temporary name and renamed
+    into place when it is complete.
+
+    A new version is loaded, checked against the feature schema and warmed
+    up in the background while the old one keeps serving requests. Then the
+    predictor of the type in config is replaced with one assignment, so a
+    request either uses the old or the new version as a whole. A version
+    that fails to load is logged and skipped.
+    """
+
+    def __init__(self, path, config, store, engine="sklearn", interval=DEFAULT_RELOAD_INTERVAL):
+        self.path = path
+        self.config = config
+        self.store = store
+        self.engine = engine
+        self.interval = interval
+        self.active = {}
+        self.failed = {}
+        self.thread_pid = None
+        self.lock = threading.Lock()
+        self.thread_lock = threading.Lock()
+
+    def latest(self, model_type):
+        """ Return the path of the newest version of a model type, or None. """
+        directory = os.path.join(self.path, model_type)
+        try:
+            names = [name for name in os.listdir(directory) if not name.startswith(".")]
+        except FileNotFoundError:
+            return None
+        names = [name for name in names if os.path.isfile(os.path.join(directory, name))]
+        if not names:
+            return None
+        return os.path.join(directory, max(names))
+
+    def _load(self, path):
+        entry = self.store.load(path)
+        FEATURE_SCHEMA.check(entry["model"])
+        predictor = self.store.predictor(entry, self.engine)
+        predictor.warm_up()
+        return predictor
+
+    def reload(self):
+        """ Swap in the newest version of every model type. Returns the types
+        whose version changed. """
+        changed = []
+        with self.lock:
+            for model_type in MODEL_TYPES:
+                path = self.latest(model_type)
+                if path is None or path == self.active.get(model_type):
+                    continue
+                try:
+                    mtime = os.stat(path).st_mtime
+                except FileNotFoundError:
+                    continue
+                if self.failed.get(path) == mtime:
+                    continue
+                try:
+                    predictor = self._load(path)
+                except Exception as e:
+                    logging.error("Failed to load %s model %s: %s", model_type, path, e)
+                    self.failed[path] = mtime
+                    continue
+                self.config[model_type] = predictor
+                self.active[model_type] = path
+                changed.append(model_type)
+                logging.info("Serving %s model %s (version %s)", model_type, path, predictor.version)
+            if changed:
+                self.store.prune(self._serving())
+        return changed
+
+    def _serving(self):
+        # Predictors of the loaded model files that are in use, a cascade
+        # uses two of them
+        predictors = []
+        for model_type in MODEL_TYPES + ("cascade",):
+            predictor = self.config.get(model_type)
+            if predictor is not None:
+                predictors.extend(getattr(predictor, "stages", [predictor]))
+        return predictors
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.reload()
+            except Exception as e:
+                logging.error("Failed to reload models from %s: %s", self.path, e)
+
+    def start(self):
+        """ Watch the registry in a background thread. Safe to call in every
+        request, a thread is started once per process, so it also runs in
+        workers forked after the registry was created. """
+        if self.thread_pid == os.getpid():
+            return
+        with self.thread_lock:
+            if self.thread_pid == os.getpid():
+                return
+            thread = threading.Thread(target=self._watch, name="model-registry", daemon=True)
+            thread.start()
+            self.thread_pid = os.getpid()
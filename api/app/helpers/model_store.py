@@ -0,0 +1,137 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import os
+import threading
+
+import joblib
+import numpy as np
+
+from .flat_forest import FlatForest
+from .predictor import Predictor
+from .result_cache import file_sha256
+
+
+def _mapped_memory(path):
+    # Resident and proportional set size in bytes of the mappings of path in
+    # this process, from /proc/self/smaps. Pss divides shared pages between
+    # the processes that map them
+    path = os.path.realpath(path)
+    rss = pss = 0
+    mapped = False
+    try:
+        with open("/proc/self/smaps") as f:
+            for line in f:
+                fields = line.split()
+                if not fields[0].endswith(":"):
+                    # Header line of the next mapping
+                    mapped = " ".join(fields[5:]) == path
+                elif mapped and fields[0] == "Rss:":
+                    rss += int(fields[1]) * 1024
+                elif mapped and fields[0] == "Pss:":
+                    pss += int(fields[1]) * 1024
+    except OSError:
+        return None, None
+    return rss, pss
+
+
+def _arrays(model):
+    # The NumPy arrays a model consists of. The nodes of scikit-learn trees
+    # live in the Cython Tree objects and are reached through their state
+    for value in vars(model).values():
+        items = value if isinstance(value, (list, tuple)) else [value]
+        for item in items:
+            if isinstance(item, np.ndarray):
+                yield item
+            elif hasattr(item, "tree_"):
+                state = item.tree_.__getstate__()
+                yield state["nodes"]
+                yield state["values"]
+
+
+def _array_bytes(model):
+    # Bytes of array data that are private to this process, memory mapped
+    # arrays are counted from the page tables instead
+    return sum(array.nbytes for array in _arrays(model) if not isinstance(array, np.memmap)
+               and not isinstance(array.base, np.memmap))
+
+
+class ModelStore():
+    """ Loads every model file once per content hash, so the same model given
+    for several types or under several paths is held in memory only once.
+
+    Arrays of uncompressed joblib files are memory mapped read only, so
+    workers that load the same file share its pages through the page cache.
+    Flattened forests (export_forest.py) consist of arrays only and are
+    shared completely. scikit-learn trees copy their nodes when unpickled;
+    they are shared copy-on-write when the store is filled before the
+    server forks its workers (gunicorn --preload).
+    """
+
+    def __init__(self, mmap_mode="r"):
+        self.mmap_mode = mmap_mode
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def load(self, path):
+        """ Return the store entry of the model file at path. """
+        with open(path, "rb") as f:
+            sha256 = file_sha256(f)
+        with self.lock:
+            entry = self.entries.get(sha256)
+            if entry is None:
+                model = joblib.load(path, mmap_mode=self.mmap_mode)
+                entry = {"sha256": sha256, "path": path, "model": model, "predictors": {}}
+                self.entries[sha256] = entry
+            return entry
+
+    def predictor(self, entry, engine="sklearn"):
+        """ Return the Predictor of a store entry for the given engine. Raises
+        ValueError if the model cannot be used with the engine. """
+        with self.lock:
+            predictor = entry["predictors"].get(engine)
+            if predictor is None:
+                model = entry["model"]
+                # The flat engine scores random forests with vectorized
+                # NumPy, models exported with export_forest.py are flat
+                # already
+                if engine == "flat" and not isinstance(model, FlatForest):
+                    model = FlatForest.from_sklearn(model)
+                version = entry["sha256"][:16]
+                predictor = Predictor(model, version, (entry["path"], engine, version))
+                entry["predictors"][engine] = predictor
+            return predictor
+
+    def prune(self, predictors):
+        """ Forget the entries none of the given predictors were created
+        from, so that replaced models can be freed once the requests using
+        them are done. """
+        with self.lock:
+            for sha256, entry in list(self.entries.items()):
+                if not any(p in predictors for p in entry["predictors"].values()):
+                    del self.entries[sha256]
+
+    def memory_usage(self):
+        """ Return the memory used by every loaded model in this process. """
+        usage = []
+        with self.lock:
+            entries = list(self.entries.values())
+        for entry in entries:
+            rss, pss = _mapped_memory(entry["path"])
+            private = _array_bytes(entry["model"])
+            for predictor in entry["predictors"].values():
+                if predictor.model is not entry["model"]:
+                    private += _array_bytes(predictor.model)
+            usage.append({
+                "path": entry["path"],
+                "version": entry["sha256"][:16],
+                "mapped_rss": rss,
+                "mapped_pss": pss,
+                "private_bytes": private,
+            })
+        return usage
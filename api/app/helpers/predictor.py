@@ -0,0 +1,78 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import copy
+
+import numpy as np
+
+# Inputs with fewer rows than this are classified in the calling thread,
+# spreading a handful of rows over a thread pool only adds latency
+SMALL_BATCH_ROWS = 64
+
+
+class Predictor():
+    """ Wraps a loaded scikit-learn classifier and classifies NumPy feature
+    rows with exactly one predict_proba call. The label of a row is the class
+    with the highest probability, the same as model.predict. """
+
+    def __init__(self, model, version=None, source=None):
+        self.model = model
+        self.version = version
+        # (path, engine, version) of the model file, for loading the same
+        # predictor in another process
+        self.source = source
+        self.classes_ = np.asarray(model.classes_).astype(np.int64)
+        # Models trained with n_jobs=-1 dispatch every call to a thread pool,
+        # a shallow copy sharing the fitted trees runs small inputs directly
+        if getattr(model, "n_jobs", None) not in (None, 1):
+            self.small_batch_model = copy.copy(model)
+            self.small_batch_model.n_jobs = None
+        else:
+            self.small_batch_model = model
+
+    def warm_up(self, rows=4, seed=0):
+        """ Classify a few synthetic feature rows, one at a time and as a
+        batch, so that the first requests do not pay for page faults and
+        lazy initialization. """
+        rng = np.random.RandomState(seed)
+        features = np.zeros((rows, self.model.n_features_in_), dtype=np.float64)
+        # Random byte distributions without any fingerprints
+        features[:, :256] = rng.dirichlet(np.ones(256), size=rows)
+        for row in features:
+            self.predict_proba(row)
+        self.predict_proba(features)
+
+    def predict_proba(self, features):
+        """ Return the class probabilities of a feature row or matrix. """
+        features = np.asarray(features, dtype=np.float64)
+        if features.ndim == 1:
+            features = features[None, :]
+        model = self.small_batch_model if len(features) < SMALL_BATCH_ROWS else self.model
+        return model.predict_proba(features)
+
+    def predictions(self, probabilities, top_k=1):
+        """ Return the label, its probability and the top_k labels with their
+        probabilities for every row of probabilities. """
+        probabilities = np.atleast_2d(probabilities)
+        top_k = max(1, min(top_k, len(self.classes_)))
+        # Stable sort so that ties are broken the same way as argmax
+        top = np.argsort(-probabilities, axis=1, kind="stable")[:, :top_k]
+        labels = self.classes_[top].tolist()
+        top_probabilities = np.take_along_axis(probabilities, top, axis=1).tolist()
+        results = []
+        for row_labels, row_probabilities in zip(labels, top_probabilities):
+            results.append({
+                "label": row_labels[0],
+                "probability": row_probabilities[0],
+                "top": list(zip(row_labels, row_probabilities)),
+            })
+        return results
+
+    def predict(self, features, top_k=1):
+        """ Classify a feature row or matrix, see predictions. """
+        return self.predictions(self.predict_proba(features), top_k)
@@ -0,0 +1,127 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from isadetect_features.feature_parallel import read_into_shared_memory
+from isadetect_features.feature_stream import DEFAULT_CHUNK_SIZE, calculate_features_stream
+
+from .model_store import ModelStore
+
+# Predictors of the worker process by model file, engine and version
+_predictors = {}
+_store = None
+
+
+def _predictor(source):
+    global _store
+    path, engine, version = source
+    predictor = _predictors.get(source)
+    if predictor is None:
+        if _store is None:
+            _store = ModelStore()
+        predictor = _store.predictor(_store.load(path), engine)
+        if predictor.version != version:
+            raise ValueError("Model " + path + " has changed since it was loaded by the API")
+        _predictors[source] = predictor
+    return predictor
+
+
+def _retain(sources):
+    # Forget the models the API no longer serves, so that the versions a
+    # registry replaced are freed in the workers too
+    stale = [source for source in _predictors if source not in sources]
+    for source in stale:
+        del _predictors[source]
+    if stale:
+        _store.prune(list(_predictors.values()))
+
+
+def _init_worker(sources):
+    # Importing this module already compiled the fingerprints, load the
+    # models before the first request arrives
+    for source in sources:
+        _predictor(source).warm_up()
+
+
+def _classify(name, size, source, serving=None):
+    # Runs in a worker process, the payload is read from shared memory
+    # instead of being pickled over to it
+    if serving is not None:
+        _retain(set(serving) | {source})
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        view = shm.buf[:size]
+        try:
+            features = calculate_features_stream([view])
+        finally:
+            view.release()
+    finally:
+        shm.close()
+    return features, _predictor(source).predict_proba(features)
+
+
+class ClassifierPool():
+    """ Persistent pool of worker processes that calculate features and
+    classify them, so that concurrent requests of one API process use all
+    cores instead of taking turns on the GIL.
+
+    Uploads are copied into shared memory once and only its name is sent to
+    a worker. Workers load models by file and engine the first time they
+    are used, and those given to the constructor when they start. A model
+    file is loaded once per worker and memory mapped like in the API
+    process. Every request names the models the API serves, a worker
+    forgets the others when it takes the request.
+    """
+
+    def __init__(self, workers=None, sources=(), chunk_size=DEFAULT_CHUNK_SIZE):
+        self.workers = workers or os.cpu_count()
+        self.sources = list(sources)
+        self.chunk_size = chunk_size
+        self.executor = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def _executor(self):
+        # Created on first use in every process, a pool does not survive a
+        # fork of the server
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.executor = ProcessPoolExecutor(self.workers, multiprocessing.get_context("spawn"),
+                                                        initializer=_init_worker, initargs=(self.sources,))
+                    self.pid = os.getpid()
+        return self.executor
+
+    def classify(self, file_t, source, serving=None):
+        """ Return the features and class probabilities of a binary file
+        object, classified with the model of source, a (path, engine,
+        version) tuple. serving is the collection of the sources of all
+        served models, if given. """
+        file_t.seek(0, os.SEEK_END)
+        size = file_t.tell()
+        file_t.seek(0)
+        if size == 0:
+            # Fails the same way as calculate_features
+            calculate_features_stream([])
+
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        try:
+            read = read_into_shared_memory(shm, file_t, size, self.chunk_size)
+            return self._executor().submit(_classify, shm.name, read, source, serving).result()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def shutdown(self):
+        if self.executor is not None and self.pid == os.getpid():
+            self.executor.shutdown()
@@ -0,0 +1,103 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from isadetect_features.feature_stream import DEFAULT_CHUNK_SIZE, read_chunks
+
+DEFAULT_CACHE_SIZE = 4096
+DEFAULT_CACHE_TTL = 24 * 60 * 60
+
+
+def file_sha256(file_t, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Return the sha256 hex digest of a binary file object and rewind it. """
+    digest = hashlib.sha256()
+    for chunk in read_chunks(file_t, chunk_size):
+        digest.update(chunk)
+    file_t.seek(0)
+    return digest.hexdigest()
+
+
+class ResultCache():
+    """ Thread safe LRU cache of results with a maximum number of entries and
+    a time to live.
+
+    Concurrent get_or_compute calls for the same key are coalesced: the
+    first caller computes the value and the others wait for it instead of
+    computing it again.
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _lookup(self, key):
+        # Must be called with the lock held
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires <= self.clock():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def get(self, key):
+        """ Return the cached value of key, or None. """
+        with self.lock:
+            return self._lookup(key)
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (self.clock() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """ Return the cached value of key, calling compute() to create it if
+        it is missing. Exceptions of compute are raised to every caller that
+        waited for it and nothing is cached. """
+        with self.lock:
+            value = self._lookup(key)
+            if value is not None:
+                return value
+            future = self.pending.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.pending[key] = future
+        if not leader:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            self.put(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            with self.lock:
+                del self.pending[key]
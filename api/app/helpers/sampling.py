@@ -0,0 +1,72 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import numpy as np
+
+from isadetect_features.byte_histogram import byte_counts
+from isadetect_features.feature_schema import FEATURE_SCHEMA, SCANNER
+
+# At most 4 MiB of an upload are read in the sampled mode
+DEFAULT_SAMPLE_WINDOWS = 64
+DEFAULT_SAMPLE_WINDOW_SIZE = 64 << 10
+
+# The windows are also split into this many interleaved sub-samples, their
+# agreement estimates how much the prediction depends on the sample
+SAMPLE_GROUPS = 4
+
+
+def sample_windows(size, windows=DEFAULT_SAMPLE_WINDOWS, window_size=DEFAULT_SAMPLE_WINDOW_SIZE, seed=0):
+    """ Return the (start, end) offsets of windows of window_size bytes,
+    one at a random offset in each of windows equally sized strata of a
+    file of size bytes. The whole file is one window if the windows would
+    cover it. The offsets only depend on the arguments, so an upload is
+    always sampled the same way. """
+    if size <= windows * window_size:
+        return [(0, size)]
+    rng = np.random.RandomState(seed)
+    bounds = np.linspace(0, size, windows + 1).astype(np.int64)
+    offsets = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        start += rng.randint(max(end - start - window_size, 0) + 1)
+        offsets.append((int(start), int(min(start + window_size, size))))
+    return offsets
+
+
+def sampled_features(data, offsets, groups=SAMPLE_GROUPS):
+    """ Return the feature vector of the windows of data at offsets, taken
+    together, and the feature vectors of groups interleaved sub-samples of
+    them. Every window is scanned for fingerprints on its own, so no match
+    spans two windows. Sub-samples are only returned if there are at least
+    as many windows as groups. """
+    view = memoryview(data)
+    if len(offsets) < groups:
+        groups = 1
+    counts = []
+    for group in range(groups):
+        # The fingerprint scanner has a fixed cost per call, the windows of
+        # a sub-sample are scanned as the rows of one buffer
+        windows = offsets[group::groups]
+        buf = b"".join(view[start:end] for start, end in windows)
+        row_ends = np.cumsum([end - start for start, end in windows])
+        fingerprint_counts = {key: int(row_counts.sum()) for key, row_counts in SCANNER.count_rows(buf, row_ends).items()}
+        counts.append((byte_counts(buf), fingerprint_counts, len(buf)))
+
+    # The counts of the sub-samples add up to those of the whole sample
+    features = feature_vector(sum(count[0] for count in counts),
+                              {key: sum(count[1][key] for count in counts) for key in FEATURE_SCHEMA.fingerprint_keys},
+                              sum(count[2] for count in counts))
+    if groups == 1:
+        return features, []
+    return features, [feature_vector(*count) for count in counts]
+
+
+def feature_vector(byte_counts, fingerprint_counts, byte_count):
+    if byte_count == 0:
+        raise ZeroDivisionError("division by zero")
+    return (byte_counts / byte_count).tolist() + [fingerprint_counts[key] / byte_count
+                                                  for key in FEATURE_SCHEMA.fingerprint_keys]
@@ -0,0 +1,94 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import numpy as np
+
+from isadetect_features.byte_histogram import block_byte_counts
+from isadetect_features.feature_batch import calculate_features_batch
+from isadetect_features.feature_schema import FEATURE_SCHEMA, SCANNER
+
+from .calculate_features import get_architecture
+
+DEFAULT_WINDOW_SIZE = 2048
+DEFAULT_STRIDE = 1024
+
+
+def window_features(data, window_size=DEFAULT_WINDOW_SIZE, stride=DEFAULT_STRIDE):
+    """ Calculate the feature vector of every window of data.
+
+    Windows start every stride bytes and are window_size bytes long (the last
+    one may be shorter), window_size has to be a multiple of stride. Byte
+    counts of a window are the difference of two rows of a prefix sum over
+    stride sized blocks, so each window costs O(256) instead of
+    O(window_size). Fingerprint matches are found with one scan of the whole
+    data; a window counts the matches that lie completely inside it.
+    Windows that do not overlap (stride equal to window_size) are plain
+    fragments and are featurized with calculate_features_batch instead, each
+    exactly as if it was classified on its own.
+
+    Returns the window start offsets, end offsets and the feature matrix.
+    """
+    if window_size <= 0 or stride <= 0 or window_size % stride != 0:
+        raise ValueError("window_size has to be a positive multiple of stride")
+    if len(data) == 0:
+        raise ValueError("Cannot segment empty data")
+
+    length = len(data)
+    block_count = -(-length // stride)
+    blocks_per_window = window_size // stride
+    first_blocks = np.arange(max(block_count - blocks_per_window, 0) + 1)
+    last_blocks = np.minimum(first_blocks + blocks_per_window, block_count)
+    starts = first_blocks * stride
+    ends = np.minimum(last_blocks * stride, length)
+    lengths = (ends - starts)[:, None]
+
+    features = np.empty((len(starts), len(FEATURE_SCHEMA)), dtype=np.float64)
+    if stride == window_size:
+        full = length // window_size
+        if full:
+            features[:full] = calculate_features_batch(data, starts[:full], window_size, np.float64)
+        if full < len(starts):
+            features[full:] = calculate_features_batch([memoryview(data)[full * window_size:]], dtype=np.float64)
+        return starts, ends, features
+
+    prefix = np.zeros((block_count + 1, 256), dtype=np.int64)
+    np.cumsum(block_byte_counts(data, stride), axis=0, out=prefix[1:])
+    features[:, :256] = (prefix[last_blocks] - prefix[first_blocks]) / lengths
+
+    matches = SCANNER.matches(data)
+    for column, key in enumerate(FEATURE_SCHEMA.fingerprint_keys, 256):
+        match_starts, match_ends = matches[key]
+        # Matches do not overlap, so both offsets are sorted
+        inside = np.searchsorted(match_ends, ends, side="right") - np.searchsorted(match_starts, starts)
+        features[:, column] = np.maximum(inside, 0) / lengths[:, 0]
+    return starts, ends, features
+
+
+def segment(data, model, window_size=DEFAULT_WINDOW_SIZE, stride=DEFAULT_STRIDE):
+    """ Classify every window of data with one predict_proba call and merge
+    adjacent windows with the same prediction into regions. """
+    starts, ends, features = window_features(data, window_size, stride)
+    probabilities = model.predict_proba(features)
+    best = probabilities.argmax(axis=1)
+    labels = model.classes_[best].astype(np.int64)
+    confidences = probabilities[np.arange(len(best)), best]
+
+    # A region starts at its first window and ends where the next region starts
+    boundaries = np.flatnonzero(labels[1:] != labels[:-1]) + 1
+    region_firsts = np.concatenate(([0], boundaries))
+    region_lasts = np.concatenate((boundaries, [len(labels)]))
+    regions = []
+    for first, last in zip(region_firsts.tolist(), region_lasts.tolist()):
+        end = int(starts[last]) if last < len(labels) else len(data)
+        regions.append({
+            "start": int(starts[first]),
+            "end": end,
+            "prediction": get_architecture(labels[first].item()),
+            "prediction_probability": float(confidences[first:last].mean()),
+        })
+    return regions
@@ -6,18 +6,76 @@ Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
 See COPYRIGHT, AUTHORS, LICENSE for more details.
 """
 
-from flask_restplus import Namespace, fields
+from flask_restplus import Namespace, fields, inputs
 from werkzeug.datastructures import FileStorage
+from app.helpers.segmentation import DEFAULT_STRIDE, DEFAULT_WINDOW_SIZE
 
 class BinaryDTO:
     api = Namespace("binary", description="Binary related operations")
 
     parser = api.parser()
     parser.add_argument("binary", type=FileStorage, location="files")
-    parser.add_argument("type", type=str, location="form", default="code", choices=("code", "full", "fragment"),
+    parser.add_argument("type", type=str, location="form", default="code", choices=("code", "full", "fragment", "cascade"),
     help="Type of file to be analyzed.\n \
     Can be 'code' (only code sections), \
-        'full' (full binary with code and data sections),\n or 'fragment' (small fragment to be analyzed, usually less than 2K bytes) ")
+        'full' (full binary with code and data sections),\n 'fragment' (small fragment to be analyzed, usually less than 2K bytes) \
+        or 'cascade' (cheap model first, full model only when it is uncertain) ")
+    parser.add_argument("type", type=str, location="args", choices=("code", "full", "fragment", "cascade"),
+    help="Type as a query parameter, overrides the form. Lets admission control reject the upload before it is received")
+    parser.add_argument("top_k", type=int, location="form",
+    help="Number of the most probable architectures returned in top_predictions")
+    parser.add_argument("compression", type=str, location="form", choices=("gzip", "xz", "zstd"),
+    help="Compression of the uploaded binary, it is decompressed while it is classified")
+    parser.add_argument("sampled", type=inputs.boolean, location="form", default=False,
+    help="Classify stratified windows of the binary instead of all of it, in time bounded by the size of the sample")
+
+    lookup_parser = api.parser()
+    lookup_parser.add_argument("type", type=str, location="args", default="code", choices=("code", "full", "fragment", "cascade"),
+    help="Type of the model the binary was classified with")
+    lookup_parser.add_argument("top_k", type=int, location="args",
+    help="Number of the most probable architectures returned in top_predictions")
+
+    batch_parser = api.parser()
+    batch_parser.add_argument("binaries", type=FileStorage, location="files", action="append",
+    help="Files to be analyzed")
+    batch_parser.add_argument("archive", type=FileStorage, location="files",
+    help="Zip or tar archive of the files to be analyzed, instead of binaries")
+    batch_parser.add_argument("type", type=str, location="form", default="code", choices=("code", "full", "fragment", "cascade"), action="append",
+    help="Type of the files, either one for all of them or one per file in binaries")
+    batch_parser.add_argument("type", type=str, location="args", choices=("code", "full", "fragment", "cascade"), action="append",
+    help="Type as a query parameter, overrides the form. Lets admission control reject the upload before it is received")
+    batch_parser.add_argument("top_k", type=int, location="form",
+    help="Number of the most probable architectures returned in top_predictions")
+
+    raw_parser = api.parser()
+    raw_parser.add_argument("type", type=str, location="args", default="code", choices=("code", "full", "fragment", "cascade"),
+    help="Type of the binary sent as the application/octet-stream body")
+    raw_parser.add_argument("compression", type=str, location="args", choices=("gzip", "xz", "zstd"),
+    help="Compression of the body, instead of a Content-Encoding header")
+    raw_parser.add_argument("sampled", type=inputs.boolean, location="args", default=False,
+    help="Classify stratified windows of the binary instead of all of it")
+    raw_parser.add_argument("top_k", type=int, location="args",
+    help="Number of the most probable architectures returned in top_predictions")
+
+    features_parser = api.parser()
+    features_parser.add_argument("type", type=str, location="args", default="code", choices=("code", "full", "fragment", "cascade"),
+    help="Type of the binary the features were calculated of. The body is the feature vector in the column order of \
+        GET /binary/features, either as JSON or as little endian float32 values (application/octet-stream)")
+    features_parser.add_argument("schema_version", type=str, location="args",
+    help="Version of the feature schema the features were calculated with, checked against the one of the API")
+    features_parser.add_argument("top_k", type=int, location="args",
+    help="Number of the most probable architectures returned in top_predictions")
+
+    segment_parser = api.parser()
+    segment_parser.add_argument("binary", type=FileStorage, location="files")
+    segment_parser.add_argument("type", type=str, location="form", default="fragment", choices=("code", "full", "fragment", "cascade"),
+    help="Type of model used to classify each window")
+    segment_parser.add_argument("type", type=str, location="args", choices=("code", "full", "fragment", "cascade"),
+    help="Type as a query parameter, overrides the form. Lets admission control reject the upload before it is received")
+    segment_parser.add_argument("window_size", type=int, location="form", default=DEFAULT_WINDOW_SIZE,
+    help="Size of the classified windows in bytes, has to be a multiple of stride")
+    segment_parser.add_argument("stride", type=int, location="form", default=DEFAULT_STRIDE,
+    help="Distance between the starts of consecutive windows in bytes")
 
     prediction_output = api.model("Prediction output", {
         "architecture": fields.String(),
@@ -25,8 +83,57 @@ class BinaryDTO:
         "endianness": fields.String()
     })
 
+    top_prediction_output = api.model("Top prediction output", {
+        "prediction": fields.Nested(prediction_output),
+        "prediction_probability": fields.Float()
+    })
+
     binary_output = api.model("Binary output", {
         "prediction": fields.Nested(prediction_output),
-        "prediction_probability": fields.Integer()
+        "prediction_probability": fields.Integer(),
+        "top_predictions": fields.List(fields.Nested(top_prediction_output)),
+        "model_version": fields.String(),
+        "sampled_bytes": fields.Integer(description="Bytes classified in the sampled mode"),
+        "estimated_confidence": fields.Float(description="Fraction of independent sub-samples that give the same prediction, in the sampled mode"),
+        "source": fields.String(description="'header' if the architecture was read from the executable header, "
+                                "'code_sections' if the code sections of an ELF file were classified with the code model, "
+                                "'model' if the upload was classified as a whole")
+    })
+
+    region_output = api.model("Region output", {
+        "start": fields.Integer(),
+        "end": fields.Integer(),
+        "prediction": fields.Nested(prediction_output),
+        "prediction_probability": fields.Float()
+    })
+
+    segments_output = api.model("Segments output", {
+        "regions": fields.List(fields.Nested(region_output)),
+        "model_version": fields.String()
+    })
+
+    job_output = api.model("Job output", {
+        "job_id": fields.String(),
+        "status": fields.String(description="queued, running, done or failed"),
+        "result": fields.Nested(binary_output, allow_null=True),
+        "message": fields.String(description="Error message of a failed job")
     })
 
+    model_output = api.model("Model output", {
+        "path": fields.String(),
+        "version": fields.String(),
+        "types": fields.List(fields.String()),
+        "mapped_rss": fields.Integer(description="Resident bytes of the memory mapped model file"),
+        "mapped_pss": fields.Integer(description="Resident bytes of the memory mapped model file divided between the processes sharing them"),
+        "private_bytes": fields.Integer(description="Bytes of model arrays private to this process")
+    })
+
+    schema_output = api.model("Feature schema output", {
+        "version": fields.String(),
+        "columns": fields.List(fields.String())
+    })
+
+    models_output = api.model("Models output", {
+        "pid": fields.Integer(),
+        "models": fields.List(fields.Nested(model_output))
+    })
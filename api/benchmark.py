@@ -0,0 +1,186 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import argparse
+import csv
+import os
+import re
+import sys
+import time
+
+import joblib
+import numpy
+
+from isadetect_features.feature_schema import FINGERPRINTS
+from isadetect_features.feature_stream import calculate_features_stream
+from isadetect_features.fingerprints import FingerprintScanner
+from app.helpers.flat_forest import FlatForest
+from app.helpers.predictor import Predictor
+from app.helpers.sampling import sample_windows, sampled_features
+
+# (windows, window size) sample budgets of the sampled benchmark
+SAMPLE_BUDGETS = [(4, 4 << 10), (16, 4 << 10), (16, 16 << 10), (64, 16 << 10), (64, 64 << 10)]
+
+
+def throughput(function, data, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(data)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(data) / best / 1e6
+
+
+def latency(function, data, repeat, requests=20):
+    # Best mean latency of requests calls in milliseconds
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(requests):
+            function(data)
+        elapsed = (time.perf_counter() - start) / requests
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1e3
+
+
+def benchmark_fingerprints(data, repeat):
+    regexes = {key: re.compile(value) for key, value in FINGERPRINTS.items()}
+    scanner = FingerprintScanner(FINGERPRINTS)
+
+    def count_with_regexes(data):
+        return {key: sum(1 for _ in regex.finditer(data)) for key, regex in regexes.items()}
+
+    if count_with_regexes(data) != scanner.count(data):
+        sys.exit("Fingerprint counts differ between the regexes and the scanner")
+
+    print("Fingerprint regexes: %.1f MB/s" % throughput(count_with_regexes, data, repeat))
+    print("Fingerprint scanner: %.1f MB/s" % throughput(scanner.count, data, repeat))
+
+
+def benchmark_predict(data, model_path, repeat):
+    # pandas is only needed to time the old classification path
+    import pandas as pd
+
+    model = joblib.load(model_path)
+    predictor = Predictor(model)
+    features = calculate_features_stream([data])
+
+    def predict_with_pandas(features):
+        # The classification of BinaryUpload.post before Predictor
+        query = pd.get_dummies(pd.DataFrame([features]))
+        prediction_int = model.predict(query).astype(numpy.int64)[0].item()
+        return prediction_int, model.predict_proba(query)[0][prediction_int - 1]
+
+    def predict_with_predictor(features):
+        prediction = predictor.predict(features)[0]
+        return prediction["label"], prediction["probability"]
+
+    if predict_with_pandas(features) != predict_with_predictor(features):
+        sys.exit("Predictions differ between the pandas path and Predictor")
+
+    print("pandas, predict and predict_proba: %.2f ms/request" % latency(predict_with_pandas, features, repeat))
+    print("Predictor: %.2f ms/request" % latency(predict_with_predictor, features, repeat))
+
+    try:
+        flat_predictor = Predictor(FlatForest.from_sklearn(model))
+    except ValueError:
+        return
+    if not numpy.array_equal(flat_predictor.predict_proba(features), predictor.predict_proba(features)):
+        sys.exit("Probabilities differ between scikit-learn and the flat engine")
+    print("Predictor, flat engine: %.2f ms/request" % latency(flat_predictor.predict, features, repeat))
+
+
+def benchmark_sampled(paths, models, labels):
+    files = []
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        if data:
+            files.append((path, data))
+    if not files:
+        sys.exit("No non-empty input files")
+
+    for model_type, model_path in models:
+        predictor = Predictor(joblib.load(model_path))
+        full_labels = []
+        full_seconds = 0.0
+        for _, data in files:
+            start = time.perf_counter()
+            full_labels.append(predictor.predict(calculate_features_stream([data]))[0]["label"])
+            full_seconds += time.perf_counter() - start
+        total_bytes = sum(len(data) for _, data in files)
+        line = "%s, every byte: %d bytes" % (model_type, total_bytes)
+        if labels:
+            line += ", accuracy %.1f%%" % (100.0 * numpy.mean([labels.get(os.path.basename(path)) == label
+                                                                for (path, _), label in zip(files, full_labels)]))
+        print(line)
+
+        for windows, window_size in SAMPLE_BUDGETS:
+            sampled_bytes = 0
+            agreement = []
+            correct = []
+            seconds = 0.0
+            for (path, data), full_label in zip(files, full_labels):
+                start = time.perf_counter()
+                offsets = sample_windows(len(data), windows, window_size)
+                features, _ = sampled_features(data, offsets)
+                label = predictor.predict(features)[0]["label"]
+                seconds += time.perf_counter() - start
+                sampled_bytes += sum(end - begin for begin, end in offsets)
+                agreement.append(label == full_label)
+                correct.append(labels.get(os.path.basename(path)) == label)
+            line = "%s, %d x %d KiB windows: %.1f%% of the bytes, %.1f%% agree with every byte, %.1fx faster" % (
+                model_type, windows, window_size >> 10, 100.0 * sampled_bytes / total_bytes, 100.0 * numpy.mean(agreement),
+                full_seconds / seconds)
+            if labels:
+                line += ", accuracy %.1f%%" % (100.0 * numpy.mean(correct))
+            print(line)
+
+
+def read_labels(path):
+    # CSV of file names and architecture labels as numbered by get_architecture
+    with open(path) as f:
+        return {name: int(label) for name, label in csv.reader(f)}
+
+
+def input_files(path):
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure the throughput of the feature calculation")
+    parser.add_argument("benchmark", choices=("fingerprints", "predict", "sampled"), help="Benchmark to run")
+    parser.add_argument("--input", required=True, help="Path to the binary used as benchmark input, "
+                        "or a directory of binaries for the sampled benchmark")
+    parser.add_argument("--model", action="append", help="Path to the trained ML model, required by the predict benchmark. "
+                        "The sampled benchmark takes it once per model type as type=path, for example code=only_code.ml")
+    parser.add_argument("--labels", help="CSV file of file names and architecture labels, the sampled benchmark also reports accuracy")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs, the fastest one is reported")
+    args = parser.parse_args()
+
+    if args.benchmark == "sampled":
+        if not args.model:
+            parser.error("the sampled benchmark requires --model")
+        models = [model.split("=", 1) if "=" in model else ("model", model) for model in args.model]
+        benchmark_sampled(input_files(args.input), models, read_labels(args.labels) if args.labels else {})
+        sys.exit(0)
+
+    with open(args.input, "rb") as f:
+        data = f.read()
+
+    if args.benchmark == "fingerprints":
+        benchmark_fingerprints(data, args.repeat)
+    elif args.benchmark == "predict":
+        if not args.model:
+            parser.error("the predict benchmark requires --model")
+        benchmark_predict(data, args.model[-1], args.repeat)
@@ -0,0 +1,27 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import argparse
+import sys
+
+import joblib
+
+from app.helpers.flat_forest import FlatForest
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export a trained random forest into the flat format used by --engine flat")
+    parser.add_argument("--input", required=True, help="Path to the trained random forest model")
+    parser.add_argument("--output", required=True, help="Path where the flattened model is written")
+    args = parser.parse_args()
+
+    try:
+        forest = FlatForest.from_sklearn(joblib.load(args.input))
+    except ValueError as e:
+        sys.exit("Failed to export model " + args.input + ": " + str(e))
+    joblib.dump(forest, args.output)
+    print("Exported %d trees with %d nodes to %s" % (len(forest.roots), len(forest.feature), args.output))
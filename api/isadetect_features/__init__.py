@@ -0,0 +1,11 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+
+Feature extraction shared by the API and the dataset generator. It does not
+depend on the rest of the API, so the dataset generator imports it without
+Flask.
+"""
@@ -0,0 +1,56 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import numpy as np
+
+
+def byte_counts(data):
+    # View the buffer as unsigned bytes without copying it and count
+    # every byte value in one pass
+    return np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256)
+
+
+def byte_frequencies(data):
+    counts = byte_counts(data)
+    byte_count = len(data)
+    if byte_count == 0:
+        raise ZeroDivisionError("division by zero")
+
+    # Same float64 division as the original per byte loop, so the
+    # frequencies are bit for bit identical
+    return (counts / byte_count).tolist()
+
+
+def block_byte_counts(data, block_size):
+    """ Return the byte counts of every block_size bytes long block of data,
+    the last block may be shorter. One offset bincount per megabyte of data
+    counts all blocks in it at once. """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    full_blocks = len(buf) // block_size
+    block_count = -(-len(buf) // block_size)
+    counts = np.zeros((block_count, 256), dtype=np.int64)
+
+    rows_per_step = max(1, (1 << 20) // block_size)
+    for first in range(0, full_blocks, rows_per_step):
+        last = min(first + rows_per_step, full_blocks)
+        rows = buf[first * block_size:last * block_size].reshape(last - first, block_size)
+        # Shift every row into its own range of 256 bins
+        offsets = (np.arange(last - first, dtype=np.int32) * 256)[:, None]
+        counts[first:last] = np.bincount((rows + offsets).ravel(),
+                                         minlength=(last - first) * 256).reshape(-1, 256)
+    if full_blocks < block_count:
+        counts[full_blocks] = byte_counts(buf[full_blocks * block_size:])
+    return counts
+
+
+def row_byte_counts(data, row_lengths):
+    """ Return the byte counts of consecutive rows of data with the given
+    lengths, all counted with one offset bincount. """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    offsets = np.repeat(np.arange(len(row_lengths), dtype=np.int64) * 256, row_lengths)
+    return np.bincount(offsets + buf, minlength=len(row_lengths) * 256).reshape(-1, 256)
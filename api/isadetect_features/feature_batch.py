@@ -0,0 +1,58 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import numpy as np
+
+from .byte_histogram import block_byte_counts, row_byte_counts
+from .feature_schema import FEATURE_SCHEMA, SCANNER
+
+
+def calculate_features_batch(data, offsets=None, fragment_size=None, dtype=np.float32):
+    """ Calculate the features of many buffers at once.
+
+    data is either a list of buffers, or one buffer that is split into
+    fragment_size bytes long fragments starting at offsets. Returns a float32
+    matrix with one row per buffer or fragment, in FEATURE_SCHEMA order. The
+    rows are scanned as one concatenated buffer, but no fingerprint match is
+    allowed to cross a row boundary, so each row equals calculate_features
+    of that buffer alone, bit for bit with dtype float64.
+    """
+    contiguous = False
+    if offsets is None:
+        row_lengths = np.array([len(buffer) for buffer in data], dtype=np.int64)
+        if len(row_lengths) == 0:
+            return np.zeros((0, len(FEATURE_SCHEMA)), dtype=dtype)
+        buf = np.concatenate([np.frombuffer(buffer, dtype=np.uint8) for buffer in data])
+    else:
+        offsets = np.asarray(offsets, dtype=np.int64)
+        buf = np.frombuffer(data, dtype=np.uint8)
+        if len(offsets) == 0:
+            return np.zeros((0, len(FEATURE_SCHEMA)), dtype=dtype)
+        if fragment_size is None or offsets.min() < 0 or offsets.max() + fragment_size > len(buf):
+            raise ValueError("Fragments have to lie inside the buffer")
+        row_lengths = np.full(len(offsets), fragment_size, dtype=np.int64)
+        if np.all(offsets == offsets[0] + np.arange(len(offsets)) * fragment_size):
+            # Back to back fragments are already laid out as rows
+            buf = buf[offsets[0]:offsets[-1] + fragment_size]
+            contiguous = True
+        else:
+            buf = buf[offsets[:, None] + np.arange(fragment_size)].ravel()
+
+    if np.any(row_lengths == 0):
+        raise ValueError("Cannot calculate features of an empty buffer")
+
+    features = np.empty((len(row_lengths), len(FEATURE_SCHEMA)), dtype=dtype)
+    if contiguous:
+        # Equal rows are counted as blocks, without an offset per byte
+        features[:, :256] = block_byte_counts(buf, fragment_size) / row_lengths[:, None]
+    else:
+        features[:, :256] = row_byte_counts(buf, row_lengths) / row_lengths[:, None]
+    fingerprint_counts = SCANNER.count_rows(buf, np.cumsum(row_lengths))
+    for column, key in enumerate(FEATURE_SCHEMA.fingerprint_keys, 256):
+        features[:, column] = fingerprint_counts[key] / row_lengths
+    return features
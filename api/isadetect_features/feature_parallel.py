@@ -0,0 +1,93 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from .feature_sketch import FeatureSketch
+from .feature_stream import DEFAULT_CHUNK_SIZE, calculate_features_stream, read_chunks
+
+# Inputs smaller than this are not worth the cost of the worker round trips
+DEFAULT_PARALLEL_THRESHOLD = 32 << 20
+
+# Request threads share one pool per process and worker count, a pool does
+# not survive a fork of the server. A pool is never shut down, a concurrent
+# request could still be using it. Workers are spawned, forking a process
+# with several threads running can deadlock the child
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _get_executor(workers):
+    with _executors_lock:
+        key = (os.getpid(), workers)
+        executor = _executors.get(key)
+        if executor is None:
+            executor = _executors[key] = ProcessPoolExecutor(workers, multiprocessing.get_context("spawn"))
+        return executor
+
+
+def _sketch_shard(name, start, end):
+    # Runs in a worker process, the payload is read from shared memory
+    # instead of being pickled over to it
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        view = shm.buf[start:end]
+        try:
+            return FeatureSketch.from_data(view)
+        finally:
+            view.release()
+    finally:
+        shm.close()
+
+
+def _features_from_shared_memory(shm, size, workers):
+    shard_size = -(-size // workers)
+    executor = _get_executor(workers)
+    futures = [executor.submit(_sketch_shard, shm.name, start, min(start + shard_size, size))
+               for start in range(0, size, shard_size)]
+    sketch = futures[0].result()
+    for future in futures[1:]:
+        sketch = sketch.merge(future.result())
+    return sketch.finalize()
+
+
+def read_into_shared_memory(shm, file_t, size, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Copy up to size bytes of a file object into shared memory, return the
+    number of bytes copied. """
+    read = 0
+    for chunk in read_chunks(file_t, chunk_size):
+        chunk = chunk[:size - read]
+        shm.buf[read:read + len(chunk)] = chunk
+        read += len(chunk)
+        if read == size:
+            break
+    return read
+
+
+def calculate_features_parallel(file_t, size, workers=None, threshold=DEFAULT_PARALLEL_THRESHOLD,
+                                chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Calculate the features of a size bytes long binary file object on
+    several cores. The file is read once into shared memory, every worker
+    process sketches one shard of it and the sketches are merged, which
+    gives the same feature vector as the serial path. Files smaller than
+    threshold are processed serially. """
+    workers = workers or os.cpu_count()
+    if size < threshold or workers < 2:
+        return calculate_features_stream(read_chunks(file_t, chunk_size))
+
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        read = read_into_shared_memory(shm, file_t, size, chunk_size)
+        return _features_from_shared_memory(shm, read, workers)
+    finally:
+        shm.close()
+        shm.unlink()
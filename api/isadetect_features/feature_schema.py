@@ -0,0 +1,155 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import hashlib
+
+import numpy as np
+
+from .fingerprints import FingerprintScanner
+
+# Function prolog/epilog and other fingerprints counted as features, shared by
+# the API and the dataset generator
+FINGERPRINTS = {}
+# big endian one
+FINGERPRINTS["be_one"] = br"\x00\x01"
+# little endian one
+FINGERPRINTS["le_one"] = br"\x01\x00"
+# big endian stack
+FINGERPRINTS["be_stack"] = br"\xff\xfe"
+# little endian stack
+FINGERPRINTS["le_stack"] = br"\xfe\xff"
+
+# armel32 prologs
+FINGERPRINTS["armel32_prolog_1"] = br"[\x00-\xff][\x00-\xff]\x2d\xe9"
+FINGERPRINTS["armel32_prolog_2"] = br"\x04\xe0\x2d\xe5"
+
+# armel32 epilogs
+FINGERPRINTS["armel32_epilog_1"] = br"[\x00-\xff]{2}\xbd\xe8\x1e\xff\x2f\xe1"
+FINGERPRINTS["armel32_epilog_2"] = br"\x04\xe0\x9d\xe4\x1e\xff\x2f\xe1"
+
+# arm32 prologs
+FINGERPRINTS["arm32_prolog_1"] = br"\xe9\x2d[\x00-\xff][\x00-\xff]"
+FINGERPRINTS["arm32_prolog_2"] = br"\xe5\x2d\xe0\x04"
+
+# arm32 epilogs
+FINGERPRINTS["arm32_epilog_1"] = br"\xe8\xbd[\x00-\xff]{2}\xe1\x2f\xff\x1e"
+FINGERPRINTS["arm32_epilog_2"] = br"\xe4\x9d\xe0\x04\xe1\x2f\xff\x1e"
+
+# mips32 prologs
+FINGERPRINTS["mips32_prolog_1"] = br"\x27\xbd\xff[\x00-\xff]"
+FINGERPRINTS["mips32_prolog_2"] = br"\x3c\x1c[\x00-\xff][\x00-\xff]\x9c\x27[\x00-\xff][\x00-\xff]"
+
+# mips32 epilog
+FINGERPRINTS["mips32_epilog_1"] = br"\x8f\xbf[\x00-\xff]{2}([\x00-\xff]{4}){0,4}\x03\xe0\x00\x08"
+
+# mips32el prologs
+FINGERPRINTS["mips32el_prolog_1"] = br"[\x00-\xff]\xff\xbd\x27"
+FINGERPRINTS["mips32el_prolog_2"] = br"[\x00-\xff][\x00-\xff]\x1c\x3c[\x00-\xff][\x00-\xff]\x9c\x27"
+
+# mipsel epilog
+FINGERPRINTS["mips32el_epilog_1"] = br"[\x00-\xff]{2}\xbf\x8f([\x00-\xff]{4}){0,4}\x08\x00\xe0\x03"
+
+# ppc32 prolog
+FINGERPRINTS["ppc32_prolog_1"] = br"\x94\x21[\x00-\xff]{2}\x7c\x08\x02\xa6"
+
+# ppc32 epilog
+FINGERPRINTS["ppc32_epilog_1"] = br"[\x00-\xff]{2}\x03\xa6([\x00-\xff]{4}){0,6}\x4e\x80\x00\x20"
+
+# ppcel32 prolog
+FINGERPRINTS["ppcel32_prolog_1"] = br"[\x00-\xff]{2}\x21\x94\xa6\x02\x08\x7c"
+
+# ppcel32 epilog
+FINGERPRINTS["ppcel32_epilog_1"] = br"\xa6\x03[\x00-\xff]{2}([\x00-\xff]{4}){0,6}\x20\x00\x80\x4e"
+
+# ppc64 prologs
+FINGERPRINTS["ppc64_prolog_1"] = br"\x94\x21[\x00-\xff]{2}\x7c\x08\x02\xa6"
+FINGERPRINTS["ppc64_prolog_2"] = br"(?!\x94\x21[\x00-\xff]{2})\x7c\x08\x02\xa6"
+FINGERPRINTS["ppc64_prolog_3"] = br"\xf8\x61[\x00-\xff]{2}"
+
+# ppc64 epilog
+FINGERPRINTS["ppc64_epilog_1"] = br"[\x00-\xff]{2}\x03\xa6([\x00-\xff]{4}){0,6}\x4e\x80\x00\x20"
+
+# ppcel64 prolog
+FINGERPRINTS["ppcel64_prolog_1"] = br"[\x00-\xff]{2}\x21\x94\xa6\x02\x08\x7c"
+
+# ppcel64 epilog
+FINGERPRINTS["ppcel64_epilog_1"] = br"\xa6\x03[\x00-\xff]{2}([\x00-\xff]{4}){0,6}\x20\x00\x80\x4e"
+
+# s390x prolog
+FINGERPRINTS["s390x_prolog_1"] = br'\xeb.[\xf0-\xff]..\x24'
+# s390x epilog
+FINGERPRINTS["s390x_epilog_1"] = br'\x07\xf4'
+
+# amd64 prologs
+FINGERPRINTS["amd64_prolog_1"] = br"\x55\x48\x89\xe5"
+FINGERPRINTS["amd64_prolog_2"] = br"\x48[\x83,\x81]\xec[\x00-\xff]"
+
+# amd64 epilogs
+FINGERPRINTS["amd64_epilog_1"] = br"\xc9\xc3"
+FINGERPRINTS["amd64_epilog_2"] = br"([^\x41][\x50-\x5f]{1}|\x41[\x50-\x5f])\xc3"
+FINGERPRINTS["amd64_epilog_3"] = br"\x48[\x83,\x81]\xc4([\x00-\xff]{1}|[\x00-\xff]{4})\xc3"
+
+# powerpcspe SPE instruction
+FINGERPRINTS["powerpcspe_spe_instruction_isel"] = br"[\x7d-\x7f][\x00-\xff]{2}(\x1e|\x5e|\x9e)"
+FINGERPRINTS["powerpcspe_spe_instruction_evl"] = br"(\x10|\x11|\x12|\x13)[\x00-\xff]{2}(\x01|\xc1|\xc8|\xc9|\xc0|\xd0|\xd1|\xda)"
+
+
+# The byte frequencies come first in every feature vector
+BYTE_FEATURES = 256
+
+
+class FeatureSchema():
+    """ Column order of the feature vector: 256 byte frequencies followed by
+    the fingerprint frequencies in key order. The version is a hash over the
+    column names and the fingerprint patterns, so a model can be checked
+    against the extractor that is serving it. """
+
+    def __init__(self, fingerprints):
+        self.fingerprint_keys = sorted(fingerprints)
+        self.columns = [str(i) for i in range(BYTE_FEATURES)] + self.fingerprint_keys
+        digest = hashlib.sha256()
+        for column in self.columns:
+            digest.update(column.encode() + b"\0")
+            digest.update(fingerprints.get(column, b"") + b"\0")
+        self.version = digest.hexdigest()[:16]
+
+    def __len__(self):
+        return len(self.columns)
+
+    def to_dict(self):
+        return {"version": self.version, "columns": self.columns}
+
+    def validate(self, features):
+        """ Return a feature vector computed elsewhere as a float64 row.
+        Raise ValueError if it does not have the columns of this schema or
+        holds values no feature can have. """
+        features = np.asarray(features, dtype=np.float64)
+        if features.shape != (len(self),):
+            raise ValueError("Expected %d features of feature schema %s, got %s"
+                             % (len(self), self.version, "x".join(str(n) for n in features.shape) or "a scalar"))
+        if not np.isfinite(features).all() or (features < 0).any():
+            raise ValueError("Features must be finite and non-negative")
+        return features
+
+    def check(self, model):
+        """ Raise ValueError if model was not trained on this schema. Models
+        trained with feature_subset "bytes" only use the byte frequencies. """
+        n_features = getattr(model, "n_features_in_", getattr(model, "n_features_", None))
+        expected = BYTE_FEATURES if getattr(model, "feature_subset", None) == "bytes" else len(self)
+        if n_features is not None and n_features != expected:
+            raise ValueError("Model expects %d features, feature schema %s has %d"
+                             % (n_features, self.version, expected))
+        schema = getattr(model, "feature_schema", None)
+        if schema is not None and schema["version"] != self.version:
+            raise ValueError("Model was trained on feature schema %s, extractor uses %s"
+                             % (schema["version"], self.version))
+
+
+# Compiled once per process
+SCANNER = FingerprintScanner(FINGERPRINTS)
+FEATURE_SCHEMA = FeatureSchema(FINGERPRINTS)
@@ -0,0 +1,107 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import numpy as np
+
+from .byte_histogram import byte_counts
+from .feature_schema import FEATURE_SCHEMA, SCANNER
+from .fingerprints import FingerprintCounter
+
+# Bytes of lookahead a fingerprint match can need past its start
+BOUNDARY_SIZE = SCANNER.reach - 1
+
+
+class FeatureSketch():
+    """ Raw feature counts of a shard of a binary that can be merged with the
+    sketch of the following shard.
+
+    Besides the byte counts, a sketch keeps its first and last
+    BOUNDARY_SIZE bytes. Fingerprints are counted in every position except
+    the last BOUNDARY_SIZE ones; those are scanned when the sketch is merged
+    with its right neighbour (or finalized), once the bytes after them are
+    known. Since re.finditer skips positions covered by the previous match,
+    the count of a shard depends on where the last match of the shards
+    before it ends. The sketch therefore keeps a count and the end of the
+    last match for every such end offset in [0, reach), and merging two
+    sketches composes these tables. Merging is associative, and finalizing
+    the merge of all shards of a binary gives exactly the feature vector of
+    calculate_features.
+    """
+
+    def __init__(self, byte_counts, byte_count, head, tail, match_counts, match_ends):
+        self.byte_counts = byte_counts
+        self.byte_count = byte_count
+        self.head = head
+        self.tail = tail
+        self.match_counts = match_counts
+        self.match_ends = match_ends
+
+    @classmethod
+    def from_data(cls, data):
+        return cls.from_chunks([data])
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        counts = np.zeros(256, dtype=np.int64)
+        byte_count = 0
+        head = np.zeros(0, dtype=np.uint8)
+        counter = FingerprintCounter(SCANNER, track_offsets=True)
+        for chunk in chunks:
+            counts += byte_counts(chunk)
+            byte_count += len(chunk)
+            if len(head) < BOUNDARY_SIZE:
+                head = np.concatenate((head, np.frombuffer(chunk, dtype=np.uint8)[:BOUNDARY_SIZE - len(head)]))
+            counter.update(chunk)
+        match_counts, match_ends = counter.transfer_table()
+        return cls(counts, byte_count, head, counter.tail, match_counts, match_ends)
+
+    def merge(self, other):
+        """ Return the sketch of this shard followed directly by other. """
+        seam = np.concatenate((self.tail, other.head))
+        if other.byte_count >= BOUNDARY_SIZE:
+            # other.head holds all the lookahead the tail positions need
+            scanned = len(self.tail)
+        else:
+            # other is shorter than the boundary, the seam is the new tail
+            scanned = max(len(seam) - BOUNDARY_SIZE, 0)
+        counter = FingerprintCounter(SCANNER, track_offsets=True)
+        counter._scan(seam, scanned)
+        seam_counts, seam_ends = counter.transfer_table()
+
+        match_counts = self.match_counts + np.take_along_axis(seam_counts, self.match_ends, axis=1)
+        match_ends = np.take_along_axis(seam_ends, self.match_ends, axis=1)
+        if other.byte_count >= BOUNDARY_SIZE:
+            match_counts += np.take_along_axis(other.match_counts, match_ends, axis=1)
+            match_ends = np.take_along_axis(other.match_ends, match_ends, axis=1)
+            tail = other.tail
+        else:
+            tail = seam[scanned:]
+
+        return FeatureSketch(self.byte_counts + other.byte_counts,
+                             self.byte_count + other.byte_count,
+                             np.concatenate((self.head, other.head))[:BOUNDARY_SIZE],
+                             tail, match_counts, match_ends)
+
+    def fingerprint_counts(self):
+        """ Return the raw fingerprint counts, taking this sketch as the end
+        of the binary. """
+        counter = FingerprintCounter(SCANNER, track_offsets=True)
+        counter._scan(self.tail, len(self.tail))
+        tail_counts, _ = counter.transfer_table()
+        totals = self.match_counts[:, 0] + np.take_along_axis(tail_counts, self.match_ends[:, :1], axis=1)[:, 0]
+        return {key: int(totals[index]) for key, index in SCANNER.key_index.items()}
+
+    def finalize(self):
+        """ Return the feature vector, the same as calculate_features. """
+        if self.byte_count == 0:
+            raise ZeroDivisionError("division by zero")
+        data = (self.byte_counts / self.byte_count).tolist()
+        fingerprint_counts = self.fingerprint_counts()
+        for key in FEATURE_SCHEMA.fingerprint_keys:
+            data.append(fingerprint_counts[key] / self.byte_count)
+        return data
@@ -0,0 +1,101 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import time
+
+import numpy as np
+
+from .byte_histogram import byte_counts
+from .feature_schema import FEATURE_SCHEMA, SCANNER
+
+# Peak memory of the streaming extraction is a small multiple of this
+DEFAULT_CHUNK_SIZE = 4 << 20
+
+
+def read_chunks(file_t, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Yield the contents of a binary file object in chunks. """
+    while True:
+        chunk = file_t.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def buffer_chunks(buffer, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Yield zero-copy slices of a buffer, for example an mmap object. """
+    view = memoryview(buffer)
+    for start in range(0, len(view), chunk_size):
+        yield view[start:start + chunk_size]
+
+
+class FeatureAccumulator():
+    """ Calculates the features of data given in chunks, without holding
+    more than one chunk in memory at a time. If a timer (metrics.RequestTimer)
+    is given, the time spent in the byte histogram and in the fingerprints is
+    added to it. """
+
+    def __init__(self, timer=None):
+        self.byte_counts = np.zeros(256, dtype=np.int64)
+        self.byte_count = 0
+        self.fingerprint_counter = SCANNER.counter()
+        self.timer = timer
+
+    def update(self, chunk):
+        if self.timer is not None:
+            self._timed_update(chunk)
+            return
+        self.byte_counts += byte_counts(chunk)
+        self.byte_count += len(chunk)
+        self.fingerprint_counter.update(chunk)
+
+    def _timed_update(self, chunk):
+        start = time.perf_counter()
+        self.byte_counts += byte_counts(chunk)
+        self.byte_count += len(chunk)
+        histogram_end = time.perf_counter()
+        self.fingerprint_counter.update(chunk)
+        self.timer.add("histogram", histogram_end - start, len(chunk))
+        self.timer.add("fingerprints", time.perf_counter() - histogram_end, len(chunk))
+
+    def finalize(self):
+        """ Return the byte frequencies and the fingerprint frequencies. """
+        if self.byte_count == 0:
+            raise ZeroDivisionError("division by zero")
+        byte_frequencies = (self.byte_counts / self.byte_count).tolist()
+        fingerprints = {}
+        for key, i in self.fingerprint_counter.counts().items():
+            fingerprints[key] = i / self.byte_count
+        return byte_frequencies, fingerprints
+
+
+def calculate_features_stream(chunks, timer=None):
+    """ Same feature vector as calculate_features, from an iterable of chunks. """
+    accumulator = FeatureAccumulator(timer)
+    for chunk in chunks:
+        accumulator.update(chunk)
+    byte_frequencies, fingerprints = accumulator.finalize()
+    data = byte_frequencies
+    for key in FEATURE_SCHEMA.fingerprint_keys:
+        data.append(fingerprints[key])
+    return data
+
+
+def calculate_byte_frequencies_stream(chunks, timer=None):
+    """ Only the byte frequencies of the feature vector, without scanning
+    for fingerprints. """
+    counts = np.zeros(256, dtype=np.int64)
+    byte_count = 0
+    for chunk in chunks:
+        start = time.perf_counter()
+        counts += byte_counts(chunk)
+        byte_count += len(chunk)
+        if timer is not None:
+            timer.add("histogram", time.perf_counter() - start, len(chunk))
+    if byte_count == 0:
+        raise ZeroDivisionError("division by zero")
+    return (counts / byte_count).tolist()
@@ -0,0 +1,525 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import itertools
+
+import numpy as np
+
+# Number of start positions scanned at once. Keeps the temporary masks small
+# even when the analyzed buffer is hundreds of megabytes.
+BLOCK_SIZE = 1 << 20
+
+ANY = None
+_HEX_DIGITS = b"0123456789abcdefABCDEF"
+
+
+def _byte_set(values):
+    lut = bytearray(256)
+    for value in values:
+        lut[value] = 1
+    if all(lut):
+        return ANY
+    return bytes(lut)
+
+
+class Alternative():
+    """ One fixed width way of matching a fingerprint.
+
+    cells holds one byte set per matched byte (ANY for a wildcard) and
+    negatives holds (offset, alternatives) pairs for negative lookaheads.
+    """
+
+    def __init__(self, cells=(), negatives=()):
+        self.cells = tuple(cells)
+        self.negatives = tuple(negatives)
+
+    @property
+    def width(self):
+        return len(self.cells)
+
+    @property
+    def reach(self):
+        reach = self.width
+        for offset, alternatives in self.negatives:
+            for alternative in alternatives:
+                reach = max(reach, offset + alternative.reach)
+        return reach
+
+    def concat(self, other):
+        negatives = self.negatives + tuple((offset + self.width, alternatives)
+                                           for offset, alternatives in other.negatives)
+        return Alternative(self.cells + other.cells, negatives)
+
+    def key(self):
+        return (self.cells, tuple((offset, tuple(a.key() for a in alternatives))
+                                  for offset, alternatives in self.negatives))
+
+
+class _Parser():
+    """ Expands the regex subset used by the fingerprint table into a list of
+    fixed width alternatives, ordered the way the re module would try them. """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.pos = 0
+
+    def parse(self):
+        alternatives = self.alternation()
+        if self.pos != len(self.pattern):
+            self.error("unexpected character")
+        return alternatives
+
+    def error(self, message):
+        raise ValueError("Unsupported fingerprint %r at %d: %s" % (self.pattern, self.pos, message))
+
+    def peek(self):
+        if self.pos < len(self.pattern):
+            return self.pattern[self.pos:self.pos + 1]
+        return b""
+
+    def next(self):
+        char = self.peek()
+        if not char:
+            self.error("unexpected end of pattern")
+        self.pos += 1
+        return char
+
+    def alternation(self):
+        alternatives = self.sequence()
+        while self.peek() == b"|":
+            self.pos += 1
+            alternatives = alternatives + self.sequence()
+        return alternatives
+
+    def sequence(self):
+        alternatives = [Alternative()]
+        while self.peek() not in (b"", b"|", b")"):
+            item = self.quantified()
+            alternatives = [left.concat(right) for left, right in itertools.product(alternatives, item)]
+        return alternatives
+
+    def quantified(self):
+        atom = self.atom()
+        if self.peek() in (b"*", b"+", b"?"):
+            self.error("unbounded or lazy quantifiers are not supported")
+        if self.peek() != b"{":
+            return atom
+        self.pos += 1
+        end = self.pattern.index(b"}", self.pos)
+        bounds = self.pattern[self.pos:end].split(b",")
+        self.pos = end + 1
+        low = int(bounds[0])
+        high = int(bounds[-1])
+        if self.peek() == b"?":
+            self.error("lazy quantifiers are not supported")
+        return self.repeat(atom, low, high)
+
+    def repeat(self, atom, low, high):
+        # Greedy repetition tries one more iteration before giving up on the
+        # current one, which is the order backtracking visits them in
+        if high == 0:
+            return [Alternative()]
+        alternatives = []
+        for alternative in atom:
+            for rest in self.repeat(atom, max(low - 1, 0), high - 1):
+                alternatives.append(alternative.concat(rest))
+        if low == 0:
+            alternatives.append(Alternative())
+        return alternatives
+
+    def atom(self):
+        char = self.next()
+        if char == b"(":
+            negative = False
+            if self.pattern.startswith(b"?!", self.pos):
+                negative = True
+                self.pos += 2
+            elif self.pattern.startswith(b"?:", self.pos):
+                self.pos += 2
+            elif self.peek() == b"?":
+                self.error("unsupported group")
+            alternatives = self.alternation()
+            if self.next() != b")":
+                self.error("unbalanced group")
+            if negative:
+                return [Alternative(negatives=((0, tuple(alternatives)),))]
+            return alternatives
+        if char == b"[":
+            return [Alternative((self.byte_class(),))]
+        if char == b".":
+            # Without re.DOTALL a dot does not match a newline
+            return [Alternative((_byte_set(v for v in range(256) if v != 0x0a),))]
+        if char in (b"^", b"$"):
+            self.error("anchors are not supported")
+        if char == b"\\":
+            return [Alternative((_byte_set((self.escape(),)),))]
+        return [Alternative((_byte_set(char),))]
+
+    def escape(self):
+        char = self.next()
+        if char == b"x":
+            digits = self.next() + self.next()
+            if any(d not in _HEX_DIGITS for d in digits):
+                self.error("invalid hex escape")
+            return int(digits, 16)
+        if char.isalnum():
+            self.error("unsupported escape")
+        return char[0]
+
+    def byte_class(self):
+        negate = False
+        if self.peek() == b"^":
+            negate = True
+            self.pos += 1
+        values = set()
+        first = True
+        while first or self.peek() != b"]":
+            first = False
+            low = self.class_byte()
+            if self.peek() == b"-" and self.pattern[self.pos + 1:self.pos + 2] != b"]":
+                self.pos += 1
+                high = self.class_byte()
+                values.update(range(low, high + 1))
+            else:
+                values.add(low)
+        self.pos += 1
+        if negate:
+            values = set(range(256)) - values
+        return _byte_set(values)
+
+    def class_byte(self):
+        char = self.next()
+        if char == b"\\":
+            return self.escape()
+        return char[0]
+
+
+def compile_fingerprint(pattern):
+    """ Compile a fingerprint regex into its fixed width alternatives. """
+    return _Parser(pattern).parse()
+
+
+def _literal(cell):
+    # Byte value of a cell that matches exactly one byte, otherwise None
+    if cell is ANY or cell.count(1) != 1:
+        return None
+    return cell.index(1)
+
+
+class _CompiledAlternative():
+    """ An alternative split into an anchor that is searched for with one
+    vectorized comparison and the remaining cells that are only checked at
+    the positions the anchor found. """
+
+    def __init__(self, alternative):
+        self.width = alternative.width
+        self.negatives = [(offset, [_CompiledAlternative(inner) for inner in alternatives])
+                          for offset, alternatives in alternative.negatives]
+        cells = alternative.cells
+        literals = [_literal(cell) for cell in cells]
+
+        # Prefer two adjacent literal bytes (one bigram comparison), then a
+        # single literal byte, then any other byte set
+        self.anchor = None
+        for offset in range(len(cells) - 1):
+            if literals[offset] is not None and literals[offset + 1] is not None:
+                self.anchor = (("pair", literals[offset] | literals[offset + 1] << 8), offset, 2)
+                break
+        if self.anchor is None:
+            for offset, literal in enumerate(literals):
+                if literal is not None:
+                    self.anchor = (("byte", literal), offset, 1)
+                    break
+        if self.anchor is None:
+            for offset, cell in enumerate(cells):
+                if cell is not ANY:
+                    self.anchor = (("set", cell), offset, 1)
+                    break
+
+        anchored = ()
+        if self.anchor is not None:
+            anchored = range(self.anchor[1], self.anchor[1] + self.anchor[2])
+        self.checks = [(offset, np.frombuffer(cell, dtype=np.bool_))
+                       for offset, cell in enumerate(cells)
+                       if cell is not ANY and offset not in anchored]
+
+
+class _CompiledFingerprint():
+    def __init__(self, alternatives):
+        self.alternatives = [_CompiledAlternative(alternative) for alternative in alternatives]
+        self.widths = np.array([alternative.width for alternative in alternatives], dtype=np.int64)
+        if self.widths.min() == 0:
+            raise ValueError("Fingerprints matching the empty string are not supported")
+
+
+class _Block():
+    """ One block of the scanned data and the anchor positions found in it,
+    shared between all fingerprints. """
+
+    def __init__(self, data, positions, start=0, row_ends=None):
+        self.data = data
+        self.positions = positions
+        self.start = start
+        self.row_ends = row_ends
+        self.anchors = {}
+        self.pairs = None
+
+    def find(self, anchor):
+        key = anchor[0]
+        if key not in self.anchors:
+            kind, value = key
+            if kind == "pair":
+                if self.pairs is None:
+                    # Shared table of every byte bigram in the block
+                    self.pairs = self.data[:-1].astype(np.uint16)
+                    self.pairs |= self.data[1:].astype(np.uint16) << 8
+                found = np.flatnonzero(self.pairs == value)
+            elif kind == "byte":
+                found = np.flatnonzero(self.data == value)
+            else:
+                found = np.flatnonzero(np.frombuffer(value, dtype=np.bool_)[self.data])
+            self.anchors[key] = found
+        return self.anchors[key]
+
+    def limit(self, found):
+        # End of the data, or of the row a match starting at found is in
+        if self.row_ends is None:
+            return len(self.data)
+        row_ends = self.row_ends[np.searchsorted(self.row_ends, found + self.start, side="right")]
+        return np.minimum(row_ends - self.start, len(self.data))
+
+    def match(self, alternative, offset=0):
+        """ Return the positions in this block where alternative matches. """
+        if alternative.anchor is None:
+            found = np.arange(self.positions + offset, dtype=np.int64)
+        else:
+            found = self.find(alternative.anchor) - alternative.anchor[1]
+        found = found - offset
+        # A match has to start inside this block and may not run past the
+        # end of the data
+        found = found[(found >= 0) & (found < self.positions)]
+        found = found[found + offset + alternative.width <= self.limit(found)]
+        for check_offset, lut in alternative.checks:
+            if len(found) == 0:
+                break
+            found = found[lut[self.data[found + offset + check_offset]]]
+        for negative_offset, inner_alternatives in alternative.negatives:
+            for inner in inner_alternatives:
+                if len(found) == 0:
+                    break
+                found = np.setdiff1d(found, self.match(inner, offset + negative_offset),
+                                     assume_unique=True)
+        return found
+
+
+class FingerprintScanner():
+    """ Counts every fingerprint of a table in one sweep over the data.
+
+    Each distinct fingerprint is compiled into fixed width alternatives. The
+    alternatives are located through anchors (a byte bigram, a byte or a byte
+    set) that are searched for once per block and shared by all fingerprints,
+    and the remaining bytes are only checked at the anchor hits, so the work
+    is linear in the size of the data. Counts follow re.finditer semantics
+    (leftmost, non-overlapping matches), so they are identical to running
+    each regex separately.
+    """
+
+    def __init__(self, fps):
+        self.keys = list(fps)
+        self.fingerprints = []
+        self.key_index = {}
+        compiled = {}
+        self.reach = 1
+        for key, pattern in fps.items():
+            alternatives = compile_fingerprint(pattern)
+            # Identical fingerprints are only scanned once
+            signature = tuple(alternative.key() for alternative in alternatives)
+            if signature not in compiled:
+                compiled[signature] = len(self.fingerprints)
+                self.fingerprints.append(_CompiledFingerprint(alternatives))
+                for alternative in alternatives:
+                    self.reach = max(self.reach, alternative.reach)
+            self.key_index[key] = compiled[signature]
+
+    def count(self, data):
+        """ Return raw match counts of every fingerprint key in data. """
+        counter = self.counter()
+        counter.update(data)
+        return counter.counts()
+
+    def counter(self):
+        """ Return a FingerprintCounter for counting data given in chunks. """
+        return FingerprintCounter(self)
+
+    def matches(self, data):
+        """ Return the start and end offsets of the matches of every key. """
+        counter = FingerprintCounter(self, record_matches=True)
+        counter.update(data)
+        counter.counts()
+        return counter.match_offsets()
+
+    def count_rows(self, data, row_ends):
+        """ Count matches separately in the consecutive rows of data ending at
+        the offsets in row_ends, as if every row was scanned on its own.
+        Returns the per row counts of every key as arrays. """
+        row_ends = np.asarray(row_ends, dtype=np.int64)
+        counter = FingerprintCounter(self, record_matches=True, row_ends=row_ends)
+        counter.update(data)
+        counter.counts()
+        counts = {}
+        for key, (starts, _) in counter.match_offsets().items():
+            rows = np.searchsorted(row_ends, starts, side="right")
+            counts[key] = np.bincount(rows, minlength=len(row_ends))
+        return counts
+
+    def _candidates(self, fingerprint, block, start):
+        """ Return start and end offsets of every position in block where
+        fingerprint matches, overlapping ones included. """
+        if len(fingerprint.alternatives) == 1:
+            positions = block.match(fingerprint.alternatives[0])
+            widths = np.full(len(positions), fingerprint.widths[0])
+        else:
+            # Keep the first alternative, in regex order, matching at each position
+            found = [block.match(alternative) for alternative in fingerprint.alternatives]
+            positions = np.concatenate(found)
+            order = np.repeat(np.arange(len(found)), [len(f) for f in found])
+            sort = np.lexsort((order, positions))
+            positions = positions[sort]
+            first = np.ones(len(positions), dtype=np.bool_)
+            first[1:] = positions[1:] != positions[:-1]
+            positions = positions[first]
+            widths = fingerprint.widths[order[sort][first]]
+        positions = positions + start
+        return positions, positions + widths
+
+    def _select(self, positions, ends, last_end):
+        """ Walk the candidates like re.finditer does: take the leftmost
+        match, then continue searching from its end. Returns a mask of the
+        selected candidates. """
+        if len(positions) == 0 or (positions[0] >= last_end and np.all(positions[1:] >= ends[:-1])):
+            return np.ones(len(positions), dtype=np.bool_)
+        selected = np.zeros(len(positions), dtype=np.bool_)
+        for index, (position, end) in enumerate(zip(positions.tolist(), ends.tolist())):
+            if position >= last_end:
+                selected[index] = True
+                last_end = end
+        return selected
+
+
+class FingerprintCounter():
+    """ Counts fingerprints over data that arrives in chunks.
+
+    The last reach - 1 bytes of the data seen so far are kept back until the
+    next chunk (or counts()) arrives, so that matches crossing a chunk
+    boundary are counted exactly as if the data was scanned in one piece.
+    """
+
+    def __init__(self, scanner, record_matches=False, row_ends=None, track_offsets=False):
+        self.scanner = scanner
+        self.row_ends = row_ends
+        self.tail = np.zeros(0, dtype=np.uint8)
+        self.offset = 0
+        self.match_counts = [0] * len(scanner.fingerprints)
+        self.last_ends = [0] * len(scanner.fingerprints)
+        self.matches = None
+        if record_matches:
+            self.matches = [[] for _ in scanner.fingerprints]
+        # With track_offsets the counter also follows the chains of matches
+        # that would be selected if the data started inside a match ending
+        # at offset 1 ... reach - 1, until they select the same match as the
+        # chain starting at offset 0 and from there on only differ by a count
+        self.chains = None
+        if track_offsets:
+            self.chains = [{initial: (0, initial) for initial in range(1, scanner.reach)}
+                           for _ in scanner.fingerprints]
+            self.count_offsets = [[0] * scanner.reach for _ in scanner.fingerprints]
+
+    def update(self, chunk):
+        buf = np.frombuffer(chunk, dtype=np.uint8)
+        if len(self.tail):
+            buf = np.concatenate((self.tail, buf))
+        # Only positions whose whole match window is available are scanned
+        positions = max(0, len(buf) - self.scanner.reach + 1)
+        self._scan(buf, positions)
+        self.tail = buf[positions:].copy()
+
+    def counts(self):
+        """ Scan the remaining tail and return the counts of every key. """
+        self._scan(self.tail, len(self.tail))
+        self.tail = self.tail[:0]
+        return {key: self.match_counts[index] for key, index in self.scanner.key_index.items()}
+
+    def match_offsets(self):
+        """ Return (starts, ends) arrays of the matches of every key, only
+        available when the counter was created with record_matches. """
+        offsets = []
+        for matches in self.matches:
+            starts = np.concatenate([m[0] for m in matches] or [np.zeros(0, dtype=np.int64)])
+            ends = np.concatenate([m[1] for m in matches] or [np.zeros(0, dtype=np.int64)])
+            offsets.append((starts, ends))
+        return {key: offsets[index] for key, index in self.scanner.key_index.items()}
+
+    def transfer_table(self):
+        """ Return, for every distinct fingerprint and every offset d in
+        [0, reach) at which a match preceding the data ends, the number of
+        matches selected in the positions scanned so far and the end of the
+        last one relative to the first position not scanned yet (0 if it
+        ends before). Only available with track_offsets. """
+        reach = self.scanner.reach
+        counts = np.zeros((len(self.scanner.fingerprints), reach), dtype=np.int64)
+        ends = np.zeros((len(self.scanner.fingerprints), reach), dtype=np.int64)
+        for index in range(len(self.scanner.fingerprints)):
+            for initial in range(reach):
+                if initial in self.chains[index]:
+                    count, last_end = self.chains[index][initial]
+                else:
+                    count = self.match_counts[index] + self.count_offsets[index][initial]
+                    last_end = self.last_ends[index]
+                counts[index, initial] = count
+                ends[index, initial] = max(last_end - self.offset, 0)
+        return counts, ends
+
+    def _scan(self, buf, positions):
+        reach = self.scanner.reach
+        for start in range(0, positions, BLOCK_SIZE):
+            block = _Block(buf[start:start + BLOCK_SIZE + reach - 1], min(BLOCK_SIZE, positions - start),
+                           self.offset + start, self.row_ends)
+            for index, fingerprint in enumerate(self.scanner.fingerprints):
+                candidates, candidate_ends = self.scanner._candidates(fingerprint, block, self.offset + start)
+                if len(candidates) == 0:
+                    continue
+                selected = self.scanner._select(candidates, candidate_ends, self.last_ends[index])
+                if self.chains is not None and self.chains[index]:
+                    self._follow_chains(index, candidates, candidate_ends, selected)
+                starts, ends = candidates[selected], candidate_ends[selected]
+                if len(starts) == 0:
+                    continue
+                self.match_counts[index] += len(starts)
+                self.last_ends[index] = int(ends[-1])
+                if self.matches is not None:
+                    self.matches[index].append((starts, ends))
+        self.offset += positions
+
+    def _follow_chains(self, index, positions, ends, selected):
+        # Last end and count of the offset 0 chain after every candidate
+        base_ends = np.maximum.accumulate(np.where(selected, ends, self.last_ends[index])).tolist()
+        base_counts = (self.match_counts[index] + np.cumsum(selected)).tolist()
+        positions = positions.tolist()
+        ends = ends.tolist()
+        chains = self.chains[index]
+        for initial, (count, last_end) in list(chains.items()):
+            for candidate, position in enumerate(positions):
+                if position >= last_end:
+                    count += 1
+                    last_end = ends[candidate]
+                if last_end == base_ends[candidate]:
+                    self.count_offsets[index][initial] = count - base_counts[candidate]
+                    del chains[initial]
+                    break
+            else:
+                chains[initial] = (count, last_end)
@@ -8,60 +8,187 @@ See COPYRIGHT, AUTHORS, LICENSE for more details.
 
 from flask import Flask
 from app import bp
+from app.controller.binary_controller import DEFAULT_BATCH_SIZE
+from app.helpers.admission import AdmissionControl
+from app.helpers.cascade import CascadePredictor, load_cascade_config
+from app.helpers.decompress import DEFAULT_MAX_DECOMPRESSED_SIZE
+from isadetect_features.feature_schema import FEATURE_SCHEMA
+from isadetect_features.feature_parallel import DEFAULT_PARALLEL_THRESHOLD
+from isadetect_features.feature_stream import DEFAULT_CHUNK_SIZE
+from app.helpers.job_queue import DEFAULT_JOB_QUEUE_SIZE, DEFAULT_JOB_RETENTION, DEFAULT_JOB_WORKERS, JobQueue
+from app.helpers.metrics import Metrics
+from app.helpers.micro_batch import (DEFAULT_MICRO_BATCH_LATENCY, DEFAULT_MICRO_BATCH_SIZE, MICRO_BATCH_TYPES,
+                                     MicroBatcher)
+from app.helpers.model_registry import DEFAULT_RELOAD_INTERVAL, ModelRegistry
+from app.helpers.model_store import ModelStore
+from app.helpers.process_pool import ClassifierPool
+from app.helpers.sampling import DEFAULT_SAMPLE_WINDOW_SIZE, DEFAULT_SAMPLE_WINDOWS
+from app.helpers.result_cache import DEFAULT_CACHE_SIZE, DEFAULT_CACHE_TTL, ResultCache
 import argparse
 import sys
-import joblib
 
 app = Flask(__name__)
 app.register_blueprint(bp)
 
+MODEL_STORE = ModelStore()
+app.config["MODEL_STORE"] = MODEL_STORE
+
+
+def check_schema(model, path):
+    try:
+        FEATURE_SCHEMA.check(model)
+    except ValueError as e:
+        sys.exit("Model " + path + " does not match the feature schema: " + str(e))
+
+
+def load_model(path, engine, debug):
+    # Returns the predictor of the model file at path
+    try:
+        entry = MODEL_STORE.load(path)
+    except Exception as e:
+        if debug:
+            print(e)
+        sys.exit("Failed to load model: " + path)
+    check_schema(entry["model"], path)
+    try:
+        predictor = MODEL_STORE.predictor(entry, engine)
+    except ValueError as e:
+        sys.exit("Failed to use the " + engine + " engine for model " + path + ": " + str(e))
+    return predictor
+
+
+def load_cascade(path, engine, debug):
+    # Returns the cascade predictor of a configuration written by
+    # ml/calibrate_cascade.py
+    try:
+        config = load_cascade_config(path)
+    except (OSError, KeyError, ValueError) as e:
+        sys.exit("Failed to read cascade configuration " + path + ": " + str(e))
+    # The engine only applies to the forest, the cheap model is linear
+    cheap = load_model(config["cheap_model"], "sklearn", debug)
+    full = load_model(config["full_model"], engine, debug)
+    try:
+        return CascadePredictor(cheap, full, config["threshold"])
+    except ValueError as e:
+        sys.exit("Failed to build cascade " + path + ": " + str(e))
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Run API that offers architecture detection endpoint for files")
     parser.add_argument("--input", help="Path to the trained ML model that will be used for all scenarios (code only, full and fragment)")
     parser.add_argument("--code_only_model", help="Path to the trained ML model with code only sections")
     parser.add_argument("--full_binary_model", help="Path to the trained ML model with code only sections")
     parser.add_argument("--fragment_model", help="Path to the trained ML model for code fragments")
+    parser.add_argument("--cascade", help="Cascade configuration written by ml/calibrate_cascade.py, served as the 'cascade' type. "
+                        "A cheap model answers when it is confident and the full model only otherwise")
     parser.add_argument("--port", type=int, help="Port where the API is exposed to. Defaults to 5000", default=5000)
-    parser.add_argument("--debug", action="store_true", help="Used for debug prints")
+    parser.add_argument("--chunk_size", type=int, help="Size of the chunks uploaded files are processed in. Defaults to 4 MiB",
+                        default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--parallel_workers", type=int, help="Calculate features of large uploads with this many worker processes. Disabled by default")
+    parser.add_argument("--parallel_threshold", type=int, help="Uploads smaller than this are processed serially. Defaults to 32 MiB",
+                        default=DEFAULT_PARALLEL_THRESHOLD)
+    parser.add_argument("--cache_size", type=int, help="Number of results cached by the hash of the uploaded binary, 0 disables the cache. Defaults to 4096",
+                        default=DEFAULT_CACHE_SIZE)
+    parser.add_argument("--cache_ttl", type=int, help="Seconds a cached result is kept. Defaults to one day", default=DEFAULT_CACHE_TTL)
+    parser.add_argument("--batch_size", type=int, help="Number of files of a batch request classified at once. Defaults to 64",
+                        default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--engine", choices=("sklearn", "flat"), default="sklearn",
+                        help="Inference engine for random forests, 'flat' gives the same probabilities with lower latency. Defaults to sklearn")
+    parser.add_argument("--model_registry", help="Directory with a subdirectory of model versions per type (code, full, fragment). "
+                        "The newest version of each type is served and new versions are swapped in without a restart")
+    parser.add_argument("--reload_interval", type=float, help="Seconds between checks of the model registry for new versions. Defaults to 10",
+                        default=DEFAULT_RELOAD_INTERVAL)
+    parser.add_argument("--metrics", action="store_true", help="Collect per stage latencies, exposed in the Prometheus format at /metrics")
+    parser.add_argument("--server_timing", action="store_true", help="Add a Server-Timing header with the stage latencies to classification responses")
+    parser.add_argument("--job_workers", type=int, help="Threads classifying binaries posted to /binary/jobs, 0 disables the endpoint. Defaults to 2",
+                        default=DEFAULT_JOB_WORKERS)
+    parser.add_argument("--job_queue_size", type=int, help="Number of jobs that can wait in the queue. Defaults to 16",
+                        default=DEFAULT_JOB_QUEUE_SIZE)
+    parser.add_argument("--job_retention", type=int, help="Seconds the result of a finished job is kept. Defaults to one hour",
+                        default=DEFAULT_JOB_RETENTION)
+    parser.add_argument("--job_dir", help="Directory where queued binaries and the status of jobs are stored, shared by the worker processes. "
+                        "Defaults to the system temporary directory")
+    parser.add_argument("--process_workers", type=int, help="Calculate features and classify uploads in this many worker processes "
+                        "with the models preloaded, so that concurrent requests use all cores. Disabled by default")
+    parser.add_argument("--micro_batch_types", nargs="+", choices=MICRO_BATCH_TYPES, default=[],
+                        help="Model types whose concurrent uploads are classified together in micro-batches, for example fragment")
+    parser.add_argument("--micro_batch_latency", type=float, help="Seconds a micro-batch waits for more uploads. Defaults to 0.002",
+                        default=DEFAULT_MICRO_BATCH_LATENCY)
+    parser.add_argument("--micro_batch_size", type=int, help="Maximum number of uploads in a micro-batch. Defaults to 64",
+                        default=DEFAULT_MICRO_BATCH_SIZE)
+    parser.add_argument("--max_decompressed_size", type=int, help="Compressed uploads that decompress to more bytes than this are rejected. "
+                        "Defaults to 1 GiB", default=DEFAULT_MAX_DECOMPRESSED_SIZE)
+    parser.add_argument("--sample_windows", type=int, help="Number of windows classified of uploads posted with sampled. Defaults to 64",
+                        default=DEFAULT_SAMPLE_WINDOWS)
+    parser.add_argument("--sample_window_size", type=int, help="Size of the windows of sampled uploads. Defaults to 64 KiB",
+                        default=DEFAULT_SAMPLE_WINDOW_SIZE)
+    parser.add_argument("--qos_config", help="JSON file with the concurrency and queue limits of admission control lanes per model type "
+                        "and payload size class. Requests beyond them are rejected with 429 or 503 and Retry-After. Disabled by default")
+    parser.add_argument("--no_header_fast_path", action="store_true",
+                        help="Classify 'full' uploads with the model even if their ELF, PE or Mach-O header names the architecture")
+    parser.add_argument("--no_code_sections", action="store_true",
+                        help="Classify 'full' ELF uploads as a whole with the full model instead of their code sections with the code model")
+    parser.add_argument("--debug", action="store_true", help="Used for debug prints and the Flask debugger")
     args = parser.parse_args()
 
     if args.input:
-        try:
-            model = joblib.load(args.input)
-        except Exception as e:
-            if args.debug:
-                print(e)
-            sys.exit("Failed to load model: " + args.input)
-        app.config["code"] = model
-        app.config["full"] = model
-        app.config["fragment"] = model
+        predictor = load_model(args.input, args.engine, args.debug)
+        app.config["code"] = predictor
+        app.config["full"] = predictor
+        app.config["fragment"] = predictor
     elif args.code_only_model:
-        try:
-            code_only_model = joblib.load(args.code_only_model)
-        except Exception as e:
-            if args.debug:
-                print(e)
-            sys.exit("Failed to load model: " + args.code_only_model)
-        app.config["code"] = code_only_model
-    else:
+        app.config["code"] = load_model(args.code_only_model, args.engine, args.debug)
+    elif not args.model_registry and not args.cascade:
         parser.print_help()
 
     if args.full_binary_model:
-        try:
-            full_binary_model = joblib.load(args.full_binary_model)
-        except:
-            if args.debug:
-                print(e)
-            sys.exit("Failed to load model: " + args.full_binary_model)
-        app.config["full"] = full_binary_model
+        app.config["full"] = load_model(args.full_binary_model, args.engine, args.debug)
 
     if args.fragment_model:
+        app.config["fragment"] = load_model(args.fragment_model, args.engine, args.debug)
+
+    if args.cascade:
+        app.config["cascade"] = load_cascade(args.cascade, args.engine, args.debug)
+
+    if args.model_registry:
+        # Versions in the registry take precedence over the models given above
+        registry = ModelRegistry(args.model_registry, app.config, MODEL_STORE, args.engine, args.reload_interval)
+        registry.reload()
+        registry.start()
+
+    for usage in MODEL_STORE.memory_usage():
+        print("Model %s (%s): %d bytes private, %d bytes mapped" % (usage["path"], usage["version"],
+                                                                   usage["private_bytes"], usage["mapped_rss"] or 0))
+
+    app.config["CHUNK_SIZE"] = args.chunk_size
+    app.config["PARALLEL_WORKERS"] = args.parallel_workers
+    app.config["PARALLEL_THRESHOLD"] = args.parallel_threshold
+    app.config["BATCH_SIZE"] = args.batch_size
+    app.config["SERVER_TIMING"] = args.server_timing
+    app.config["HEADER_FAST_PATH"] = not args.no_header_fast_path
+    app.config["CODE_SECTIONS"] = not args.no_code_sections
+    app.config["MAX_DECOMPRESSED_SIZE"] = args.max_decompressed_size
+    app.config["SAMPLE_WINDOWS"] = args.sample_windows
+    app.config["SAMPLE_WINDOW_SIZE"] = args.sample_window_size
+    app.config["JOB_DIR"] = args.job_dir
+    if args.process_workers:
+        sources = {app.config[model_type].source for model_type in ("code", "full", "fragment") if model_type in app.config}
+        app.config["CLASSIFIER_POOL"] = ClassifierPool(args.process_workers, sources, args.chunk_size)
+    if args.job_workers > 0:
+        app.config["JOB_QUEUE"] = JobQueue(args.job_workers, args.job_queue_size, args.job_retention, args.job_dir)
+    if args.metrics:
+        app.config["METRICS"] = Metrics()
+    if args.micro_batch_types:
+        app.config["MICRO_BATCH_TYPES"] = args.micro_batch_types
+        app.config["MICRO_BATCHER"] = MicroBatcher(args.micro_batch_size, args.micro_batch_latency, app.config.get("METRICS"))
+    if args.qos_config:
         try:
-            fragment_model = joblib.load(args.fragment_model)
-        except:
-            if args.debug:
-                print(e)
-            sys.exit("Failed to load model: " + args.fragment_model)
-        app.config["fragment"] = fragment_model
-
-    app.run(debug=True, host='0.0.0.0', port=args.port)
+            app.config["ADMISSION"] = AdmissionControl.from_config(args.qos_config, app.config.get("METRICS"))
+        except (OSError, ValueError) as e:
+            sys.exit("Failed to read admission control configuration " + args.qos_config + ": " + str(e))
+    if args.cache_size > 0:
+        app.config["RESULT_CACHE"] = ResultCache(args.cache_size, args.cache_ttl)
+
+    # The reloader would run the API in a second process, with its own
+    # copy of every model, worker pool and background thread
+    app.run(debug=args.debug, use_reloader=False, host='0.0.0.0', port=args.port)
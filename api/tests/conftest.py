@@ -0,0 +1,13 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import os
+import sys
+
+# The tests import the API package as app, like main.py and wsgi.py do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,166 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import http
+import io
+import json
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+from app import bp
+from app.helpers.admission import AdmissionControl, AdmissionRejected, Lane
+from app.helpers.metrics import Metrics
+
+SIZE_CLASSES = [["small", 100], ["large", None]]
+
+
+class Clock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def rejection(lane):
+    with pytest.raises(AdmissionRejected) as e:
+        lane.acquire()
+    return e.value
+
+
+def test_full_queue_is_rejected_with_429():
+    lane = Lane("code", concurrency=1)
+    lane.acquire()
+    e = rejection(lane)
+    assert e.status == http.HTTPStatus.TOO_MANY_REQUESTS
+    assert e.retry_after == 1
+
+
+def test_waiting_request_times_out_with_503():
+    lane = Lane("code", concurrency=1, queue=1, queue_timeout=0.05)
+    lane.acquire()
+    started = time.monotonic()
+    e = rejection(lane)
+    assert e.status == http.HTTPStatus.SERVICE_UNAVAILABLE
+    assert time.monotonic() - started >= 0.05
+    assert lane.waiting == 0
+
+
+def test_waiting_request_gets_the_released_slot():
+    lane = Lane("code", concurrency=1, queue=1, queue_timeout=5)
+    acquired = lane.acquire()
+    waiter = threading.Thread(target=lambda: lane.release(lane.acquire()))
+    waiter.start()
+    deadline = time.monotonic() + 5
+    while not lane.waiting and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert lane.waiting == 1
+    # The queue is full while the waiter waits
+    assert rejection(lane).status == http.HTTPStatus.TOO_MANY_REQUESTS
+    lane.release(acquired)
+    waiter.join(5)
+    assert lane.active == 0 and lane.waiting == 0
+
+
+def test_retry_after_follows_the_service_time():
+    clock = Clock()
+    lane = Lane("full", concurrency=2, clock=clock)
+    acquired = lane.acquire()
+    clock.now = 4.5
+    lane.release(acquired)
+    assert lane.service_time == 4.5
+    lane.acquire()
+    lane.acquire()
+    # Two slots share the work of the requests ahead, rounded up
+    assert rejection(lane).retry_after == 3
+
+
+def test_invalid_lane():
+    with pytest.raises(ValueError):
+        Lane("code", concurrency=0)
+    with pytest.raises(ValueError):
+        Lane("code", concurrency=1, queue=-1)
+
+
+@pytest.mark.parametrize("model_type,size,expected", [
+    ("code", 10, "code/small"),
+    ("code", 1000, "code"),
+    ("full", 10, "small"),
+    ("full", 1000, "default"),
+    ("full", None, "default"),
+    (None, 10, "small"),
+    (None, 1000, "default"),
+])
+def test_lane_lookup_order(model_type, size, expected):
+    lanes = {name: {"concurrency": 1} for name in ("code/small", "code", "small", "default")}
+    assert AdmissionControl(lanes, SIZE_CLASSES).lane(model_type, size).name == expected
+
+
+def test_size_classes():
+    admission = AdmissionControl({}, SIZE_CLASSES)
+    assert admission.size_class(0) == "small"
+    assert admission.size_class(100) == "small"
+    assert admission.size_class(101) == "large"
+    # Without a Content-Length the request is in the largest class
+    assert admission.size_class(None) == "large"
+    assert AdmissionControl({}, [["small", 100]]).size_class(None) is None
+
+
+def test_requests_without_a_lane_are_not_limited():
+    admission = AdmissionControl({"code": {"concurrency": 1}})
+    for _ in range(3):
+        admission.acquire("full", 10)
+    assert admission.lane(None, 10) is None
+
+
+def test_rejections_are_counted():
+    metrics = Metrics()
+    admission = AdmissionControl({"default": {"concurrency": 1}}, metrics=metrics)
+    with admission.admit("code", 10):
+        with pytest.raises(AdmissionRejected):
+            admission.acquire("full", 10)
+    assert metrics.rejections == {("default", 429): 1}
+    assert "isadetect_admission_rejected_total" in metrics.render()
+    # The slot was given back at the end of the with block
+    admission.acquire("code", 10)
+
+
+def test_from_config(tmp_path):
+    path = tmp_path / "qos.json"
+    path.write_text(json.dumps({"size_classes": SIZE_CLASSES, "lanes": {"code/large": {"concurrency": 2, "queue": 3}}}))
+    lane = AdmissionControl.from_config(str(path)).lane("code", 1000)
+    assert (lane.name, lane.concurrency, lane.queue) == ("code/large", 2, 3)
+
+
+@pytest.mark.parametrize("config", [
+    {},
+    {"lanes": {"code": {"concurrency": 1, "burst": 2}}},
+    {"lanes": {"code": {"concurrency": 0}}},
+    {"lanes": {"code": 1}},
+    {"lanes": {}, "size_classes": [["small"]]},
+])
+def test_invalid_config(tmp_path, config):
+    path = tmp_path / "qos.json"
+    path.write_text(json.dumps(config))
+    with pytest.raises(ValueError):
+        AdmissionControl.from_config(str(path))
+
+
+def test_rejected_upload_has_retry_after():
+    app = Flask(__name__)
+    app.register_blueprint(bp)
+    admission = app.config["ADMISSION"] = AdmissionControl({"code": {"concurrency": 1}})
+    admission.acquire("code", 10)
+    response = app.test_client().post("/binary/?type=code", data={"binary": (io.BytesIO(b"\x7fELF"), "b")},
+                                      content_type="multipart/form-data")
+    assert response.status_code == http.HTTPStatus.TOO_MANY_REQUESTS
+    assert response.headers["Retry-After"] == "1"
+    assert "message" in response.get_json()
@@ -0,0 +1,67 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+from app.helpers.archive import iter_archive
+from app.helpers.decompress import DecompressedSizeError
+
+
+def zip_archive(members):
+    file_t = io.BytesIO()
+    with zipfile.ZipFile(file_t, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    file_t.seek(0)
+    return file_t
+
+
+def tar_archive(members, mode="w:gz"):
+    file_t = io.BytesIO()
+    with tarfile.open(fileobj=file_t, mode=mode) as archive:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    file_t.seek(0)
+    return file_t
+
+
+def contents(members):
+    return [(name, member if isinstance(member, DecompressedSizeError) else member.read())
+            for name, member in members]
+
+
+@pytest.mark.parametrize("archive", [zip_archive, tar_archive])
+def test_members_within_limit(archive):
+    members = [("a", b"\x01" * 100), ("b", b"\x02" * 50)]
+    assert contents(iter_archive(archive(members), max_size=150)) == members
+
+
+def test_zip_skips_members_that_do_not_fit():
+    members = contents(iter_archive(zip_archive([("a", b"\x01" * 100), ("bomb", bytes(1000)), ("b", b"\x02" * 50)]),
+                                    max_size=200))
+    assert [name for name, _ in members] == ["a", "bomb", "b"]
+    assert isinstance(members[1][1], DecompressedSizeError)
+    assert members[2][1] == b"\x02" * 50
+
+
+def test_tar_stops_at_the_first_member_that_does_not_fit():
+    members = contents(iter_archive(tar_archive([("a", b"\x01" * 100), ("bomb", bytes(1000)), ("b", b"\x02" * 50)]),
+                                    max_size=200))
+    assert [name for name, _ in members] == ["a", "bomb"]
+    assert isinstance(members[1][1], DecompressedSizeError)
+
+
+def test_neither_zip_nor_tar():
+    with pytest.raises(ValueError):
+        iter_archive(io.BytesIO(b"not an archive"))
@@ -0,0 +1,70 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import os
+import random
+import sys
+
+import pytest
+
+from isadetect_features.byte_histogram import block_byte_counts, byte_counts, byte_frequencies, row_byte_counts
+
+SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "plugins", "radare", "samples")
+
+
+def loop_byte_frequencies(data):
+    # The per byte loop byte_frequencies replaced
+    byte_count = 0
+    byte_frequency_counter = [0] * 256
+    for byte in bytearray(data):
+        byte_count += 1
+        byte_frequency_counter[byte] += 1
+    return [(x / byte_count) for x in byte_frequency_counter]
+
+
+def corpus():
+    files = [os.path.join(SAMPLES, name) for name in sorted(os.listdir(SAMPLES))]
+    files.append(sys.executable)
+    for path in files:
+        with open(path, "rb") as f:
+            yield os.path.basename(path), f.read()
+    rng = random.Random(0)
+    yield "one byte", b"\x7f"
+    yield "all values", bytes(range(256))
+    yield "all values twice", bytes(range(256)) * 2 + b"\x00"
+    yield "zeros", bytes(4096)
+    yield "random", bytes(rng.randrange(256) for _ in range(100003))
+
+
+@pytest.mark.parametrize("name,data", list(corpus()), ids=lambda value: value if isinstance(value, str) else "")
+def test_byte_frequencies_match_loop(name, data):
+    # Bit for bit the same floats as the loop, not only close to them
+    assert byte_frequencies(data) == loop_byte_frequencies(data)
+    assert byte_frequencies(memoryview(data)) == loop_byte_frequencies(data)
+
+
+def test_empty_buffer():
+    with pytest.raises(ZeroDivisionError):
+        loop_byte_frequencies(b"")
+    with pytest.raises(ZeroDivisionError):
+        byte_frequencies(b"")
+    assert byte_counts(b"").tolist() == [0] * 256
+
+
+@pytest.mark.parametrize("block_size", [1, 7, 4096])
+def test_block_byte_counts_match_blocks(block_size):
+    data = bytes(random.Random(block_size).randrange(256) for _ in range(10000))
+    counts = block_byte_counts(data, block_size)
+    blocks = [data[i:i + block_size] for i in range(0, len(data), block_size)]
+    assert counts.tolist() == [byte_counts(block).tolist() for block in blocks]
+
+
+def test_row_byte_counts_match_rows():
+    rows = [b"\x01", bytes(range(256)), b"\xff" * 300]
+    counts = row_byte_counts(b"".join(rows), [len(row) for row in rows])
+    assert counts.tolist() == [byte_counts(row).tolist() for row in rows]
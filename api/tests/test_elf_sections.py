@@ -0,0 +1,84 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import os
+import struct
+
+import pytest
+
+from app.helpers.elf_sections import MAX_GAP, SHF_ALLOC, SHF_EXECINSTR, code_sections, section_chunks
+
+CODE_FLAGS = SHF_ALLOC | SHF_EXECINSTR
+
+
+def elf64(body, sections):
+    # Little endian ELF64 file of body followed by a section table with a
+    # null section and the given (flags, address, offset, size) sections
+    shoff = 64 + len(body)
+    header = bytearray(64)
+    header[:6] = b"\x7fELF\x02\x01"
+    struct.pack_into("<Q4xHHHHH", header, 40, shoff, 64, 0, 0, 64, len(sections) + 1)
+    table = bytes(64)
+    for flags, address, offset, size in sections:
+        table += struct.pack("<IIQQQQIIQQ", 0, 1, flags, address, 64 + offset, size, 0, 0, 16, 0)
+    return bytes(header) + body + table
+
+
+def joined(data, sections, chunk_size=7):
+    return b"".join(bytes(chunk) for chunk in section_chunks(data, sections, chunk_size))
+
+
+def test_adjacent_sections_and_gaps():
+    data = os.urandom(300)
+    sections = [(0x1000, 0, 100), (0x1064, 100, 50), (0x1100, 150, 40)]
+    expected = data[:150] + bytes(0x1100 - 0x1096) + data[150:190]
+    assert joined(data, sections) == expected
+
+
+def test_large_gaps_are_not_filled():
+    data = os.urandom(200)
+    assert joined(data, [(0, 0, 100), (100 + MAX_GAP + 1, 100, 100)]) == data
+
+
+@pytest.mark.parametrize("sections", [
+    # The second section starts inside the first one
+    [(0x1000, 0, 100), (0x1040, 200, 100)],
+    # The second section lies completely inside the first one
+    [(0x1000, 0, 100), (0x1010, 200, 20)],
+    # Both start at the same address
+    [(0x1000, 0, 50), (0x1000, 200, 120)],
+    # The third section overlaps both of the others
+    [(0x1000, 0, 60), (0x1030, 100, 60), (0x1020, 200, 90)],
+])
+def test_overlapping_bytes_are_written_once(sections):
+    data = os.urandom(400)
+    sections = sorted(sections)
+    output = joined(data, sections)
+    first = sections[0][0]
+    assert len(output) == max(address + size for address, _, size in sections) - first
+    # Every address is taken from the first section in address order that
+    # covers it, the bytes after the earlier sections come from the later ones
+    end = first
+    expected = bytearray()
+    for address, offset, size in sections:
+        if address + size > end:
+            expected += data[offset + max(0, end - address):offset + size]
+            end = address + size
+    assert output == bytes(expected)
+
+
+def test_overlapping_sections_of_an_elf_file():
+    body = os.urandom(256)
+    data = elf64(body, [(CODE_FLAGS, 0x400000, 0, 128), (CODE_FLAGS, 0x400040, 128, 128), (SHF_ALLOC, 0x500000, 0, 16)])
+    sections = code_sections(data)
+    assert sections == [(0x400000, 64, 128), (0x400040, 192, 128)]
+    assert joined(data, sections) == body[:128] + body[192:256]
+
+
+def test_not_an_elf_file():
+    assert code_sections(os.urandom(128)) == []
@@ -0,0 +1,82 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import functools
+import random
+
+import numpy as np
+import pytest
+
+from app.helpers.calculate_features import calculate_features
+from isadetect_features.feature_schema import SCANNER
+from isadetect_features.feature_sketch import BOUNDARY_SIZE, FeatureSketch
+from isadetect_features.feature_stream import buffer_chunks
+from test_fingerprints import instances
+
+DATA = instances(random.Random(4), 6000)
+
+
+def shards(data, rng):
+    # Shards of random lengths, shorter than the boundary and empty ones included
+    cuts = sorted(rng.randrange(len(data) + 1) for _ in range(rng.randrange(1, 12)))
+    cuts += sorted(rng.choice((0, 1, BOUNDARY_SIZE - 1, BOUNDARY_SIZE, BOUNDARY_SIZE + 1)) + cut for cut in cuts[:2])
+    cuts = sorted(min(cut, len(data)) for cut in cuts)
+    return [data[start:end] for start, end in zip([0] + cuts, cuts + [len(data)])]
+
+
+def merge_tree(sketches, rng):
+    # Merge neighbours in a random order
+    sketches = list(sketches)
+    while len(sketches) > 1:
+        i = rng.randrange(len(sketches) - 1)
+        sketches[i:i + 2] = [sketches[i].merge(sketches[i + 1])]
+    return sketches[0]
+
+
+def assert_same_sketch(a, b):
+    assert a.byte_count == b.byte_count
+    assert np.array_equal(a.byte_counts, b.byte_counts)
+    assert np.array_equal(a.head, b.head)
+    assert np.array_equal(a.tail, b.tail)
+    assert np.array_equal(a.match_counts, b.match_counts)
+    assert np.array_equal(a.match_ends, b.match_ends)
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_merged_shards_equal_the_whole_buffer(seed):
+    rng = random.Random(seed)
+    parts = shards(DATA, rng)
+    sketches = [FeatureSketch.from_data(part) for part in parts]
+    whole = FeatureSketch.from_data(DATA)
+    expected = calculate_features(DATA)
+
+    left = functools.reduce(FeatureSketch.merge, sketches)
+    right = functools.reduce(lambda merged, sketch: sketch.merge(merged), reversed(sketches))
+    tree = merge_tree(sketches, rng)
+    for merged in (left, right, tree):
+        assert merged.fingerprint_counts() == SCANNER.count(DATA)
+        assert merged.finalize() == expected
+        assert_same_sketch(merged, whole)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_merge_is_associative(seed):
+    rng = random.Random(seed)
+    a, b, c = (FeatureSketch.from_data(instances(rng, rng.choice((0, 1, BOUNDARY_SIZE, 500)))) for _ in range(3))
+    assert_same_sketch(a.merge(b).merge(c), a.merge(b.merge(c)))
+
+
+@pytest.mark.parametrize("chunk_size", [1, BOUNDARY_SIZE, 4096])
+def test_from_chunks_equals_from_data(chunk_size):
+    data = DATA[:chunk_size * 200]
+    assert_same_sketch(FeatureSketch.from_chunks(buffer_chunks(data, chunk_size)), FeatureSketch.from_data(data))
+
+
+def test_empty_binary():
+    with pytest.raises(ZeroDivisionError):
+        FeatureSketch.from_data(b"").finalize()
@@ -0,0 +1,67 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import io
+import random
+
+import pytest
+
+from app.helpers.calculate_features import calculate_features
+from isadetect_features.feature_schema import SCANNER
+from isadetect_features.feature_stream import (buffer_chunks, calculate_byte_frequencies_stream,
+                                               calculate_features_stream, read_chunks)
+from test_fingerprints import instances
+
+DATA = instances(random.Random(3), 20000)
+
+
+def data_for(chunk_size):
+    # Every update of a counter has a fixed cost, tiny chunks get less data
+    return DATA[:chunk_size * 400]
+
+
+def random_chunks(data, rng):
+    # Chunks of random lengths, empty ones included
+    start = 0
+    while start < len(data):
+        end = start + rng.choice((0, 1, 2, 3, rng.randrange(100), rng.randrange(5000)))
+        yield data[start:end]
+        start = end
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, SCANNER.reach - 1, SCANNER.reach, SCANNER.reach + 1, 1000, 1 << 20])
+def test_matches_across_chunk_boundaries(chunk_size):
+    data = data_for(chunk_size)
+    counter = SCANNER.counter()
+    for chunk in buffer_chunks(data, chunk_size):
+        counter.update(chunk)
+    assert counter.counts() == SCANNER.count(data)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_chunk_lengths(seed):
+    counter = SCANNER.counter()
+    for chunk in random_chunks(DATA, random.Random(seed)):
+        counter.update(chunk)
+    assert counter.counts() == SCANNER.count(DATA)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096, 1 << 20])
+def test_stream_equals_whole_buffer(chunk_size):
+    data = data_for(chunk_size)
+    expected = calculate_features(data)
+    assert calculate_features_stream(buffer_chunks(data, chunk_size)) == expected
+    assert calculate_features_stream(read_chunks(io.BytesIO(data), chunk_size)) == expected
+    assert calculate_byte_frequencies_stream(buffer_chunks(data, chunk_size)) == expected[:256]
+
+
+def test_empty_stream():
+    with pytest.raises(ZeroDivisionError):
+        calculate_features_stream([])
+    with pytest.raises(ZeroDivisionError):
+        calculate_features_stream([b"", b""])
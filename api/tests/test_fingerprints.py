@@ -0,0 +1,100 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import os
+import random
+import re
+import sys
+
+import numpy as np
+import pytest
+
+from isadetect_features.feature_schema import FINGERPRINTS, SCANNER
+from isadetect_features.fingerprints import ANY, FingerprintScanner, compile_fingerprint
+
+SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "plugins", "radare", "samples")
+
+# Every byte written as an escape in the fingerprint table. Random data drawn
+# from these bytes is full of matches, overlapping and adjacent ones included
+PATTERN_BYTES = sorted({int(value, 16) for pattern in FINGERPRINTS.values()
+                        for value in re.findall(rb"\\x([0-9a-fA-F]{2})", pattern)})
+
+# Patterns with alternations, repeats, byte classes and overlapping matches
+SMALL_TABLE = {
+    "pair": br"\x00\x00",
+    "alternation": br"\x01\x02|\x01\x02\x03|\x02",
+    "class": br"[\x01-\x03]\x00[\x00\x02]",
+    "repeat": br"\x03{2,3}",
+    "wildcard": br"\x01..\x01",
+    "duplicate": br"\x00\x00",
+}
+
+
+def instance(rng, pattern):
+    # Bytes matching one of the alternatives of a pattern, lookaheads aside
+    alternative = rng.choice(compile_fingerprint(pattern))
+    return bytes(rng.getrandbits(8) if cell is ANY else rng.choice([value for value in range(256) if cell[value]])
+                 for cell in alternative.cells)
+
+
+def instances(rng, length):
+    # Matches of random fingerprints back to back and between pattern bytes
+    patterns = list(FINGERPRINTS.values())
+    data = bytearray()
+    while len(data) < length:
+        data += instance(rng, rng.choice(patterns))
+        data += bytes(rng.choice(PATTERN_BYTES) for _ in range(rng.choice((0, 0, 1, 3))))
+    return bytes(data)
+
+
+def finditer_counts(fps, data):
+    # One re.finditer pass per fingerprint, what the scanner replaced
+    return {key: sum(1 for _ in re.finditer(pattern, data)) for key, pattern in fps.items()}
+
+
+def corpus():
+    files = [os.path.join(SAMPLES, name) for name in sorted(os.listdir(SAMPLES))]
+    files.append(sys.executable)
+    for path in files:
+        with open(path, "rb") as f:
+            yield os.path.basename(path), f.read()[:1 << 20]
+    rng = random.Random(0)
+    for length in (0, 1, 2, 3, 5, 17, 1000, 100000):
+        yield "pattern bytes %d" % length, bytes(rng.choice(PATTERN_BYTES) for _ in range(length))
+    yield "instances", instances(rng, 100000)
+    yield "zeros", bytes(10001)
+    yield "random", bytes(rng.getrandbits(8) for _ in range(50000))
+
+
+@pytest.mark.parametrize("name,data", list(corpus()), ids=lambda value: value if isinstance(value, str) else "")
+def test_scanner_counts_like_finditer(name, data):
+    assert SCANNER.count(data) == finditer_counts(FINGERPRINTS, data)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_small_table(seed):
+    rng = random.Random(seed)
+    data = bytes(rng.choice(b"\x00\x01\x02\x03") for _ in range(5000))
+    assert FingerprintScanner(SMALL_TABLE).count(data) == finditer_counts(SMALL_TABLE, data)
+
+
+def test_match_offsets_are_the_finditer_spans():
+    rng = random.Random(1)
+    data = bytes(rng.choice(PATTERN_BYTES) for _ in range(20000))
+    matches = SCANNER.matches(data)
+    for key, pattern in FINGERPRINTS.items():
+        spans = [match.span() for match in re.finditer(pattern, data)]
+        starts, ends = matches[key]
+        assert list(zip(starts.tolist(), ends.tolist())) == spans, key
+
+
+def test_scanner_accepts_buffers():
+    data = bytes(random.Random(2).choice(PATTERN_BYTES) for _ in range(3000))
+    expected = SCANNER.count(data)
+    assert SCANNER.count(memoryview(data)) == expected
+    assert SCANNER.count(np.frombuffer(data, dtype=np.uint8)) == expected
@@ -0,0 +1,95 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.tree import DecisionTreeClassifier
+
+from app.helpers.flat_forest import ROWS_PER_STEP, FlatForest
+
+N_FEATURES = 20
+
+
+def training_data(rng, rows=400):
+    # Frequencies like the byte histogram and a few wide ranged counts
+    features = np.hstack((rng.dirichlet(np.ones(N_FEATURES - 4), rows), rng.integers(0, 5000, (rows, 4))))
+    labels = np.array(["mips", "x86", "arm"])[(features[:, 0] * 30 + features[:, -1] / 1000).astype(int) % 3]
+    return features, labels
+
+
+@pytest.fixture(scope="module")
+def forest():
+    rng = np.random.default_rng(0)
+    features, labels = training_data(rng)
+    model = RandomForestClassifier(n_estimators=15, max_depth=8, random_state=0)
+    return model.fit(features, labels)
+
+
+def threshold_rows(model, rng):
+    # Rows with a feature at, just below and just above the float32 of a
+    # split threshold, where a rounding mistake takes the other branch
+    rows = []
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        for feature, threshold in zip(tree.feature, tree.threshold):
+            if feature < 0:
+                continue
+            value = np.float32(threshold)
+            for candidate in (np.nextafter(value, np.float32(-np.inf)), value, np.nextafter(value, np.float32(np.inf))):
+                row = training_data(rng, 1)[0][0]
+                row[feature] = candidate
+                rows.append(row)
+    return np.array(rows)
+
+
+def test_probabilities_equal_scikit_learn(forest):
+    rng = np.random.default_rng(1)
+    features = np.vstack((training_data(rng, 3 * ROWS_PER_STEP + 5)[0], threshold_rows(forest, rng)))
+    flat = FlatForest.from_sklearn(forest)
+    assert np.array_equal(flat.predict_proba(features), forest.predict_proba(features))
+    assert np.array_equal(flat.predict(features), forest.predict(features))
+
+
+def test_leaves_equal_scikit_learn(forest):
+    features = training_data(np.random.default_rng(2), 50)[0]
+    flat = FlatForest.from_sklearn(forest)
+    leaves = flat.apply(features) - flat.roots
+    assert np.array_equal(leaves, forest.apply(features))
+
+
+def test_single_row(forest):
+    row = training_data(np.random.default_rng(3), 1)[0][0]
+    flat = FlatForest.from_sklearn(forest)
+    assert np.array_equal(flat.predict_proba(row), forest.predict_proba(row[np.newaxis, :]))
+    assert flat.predict([row])[0] == forest.predict([row])[0]
+
+
+def test_binary_forest_with_pure_leaves():
+    rng = np.random.default_rng(4)
+    features = rng.random((200, N_FEATURES))
+    labels = features[:, 3] > 0.5
+    model = RandomForestClassifier(n_estimators=5, random_state=0).fit(features, labels)
+    flat = FlatForest.from_sklearn(model)
+    assert np.array_equal(flat.predict_proba(features), model.predict_proba(features))
+    assert flat.n_features_in_ == N_FEATURES
+
+
+def test_wrong_feature_count(forest):
+    with pytest.raises(ValueError):
+        FlatForest.from_sklearn(forest).predict_proba(np.zeros((1, N_FEATURES + 1)))
+
+
+def test_unsupported_models():
+    features, labels = training_data(np.random.default_rng(5), 50)
+    with pytest.raises(ValueError):
+        FlatForest.from_sklearn(RandomForestClassifier())
+    with pytest.raises(ValueError):
+        FlatForest.from_sklearn(DecisionTreeClassifier().fit(features, labels))
+    with pytest.raises(ValueError):
+        FlatForest.from_sklearn(RandomForestClassifier(n_estimators=2).fit(features, np.stack((labels, labels), 1)))
@@ -0,0 +1,130 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import os
+import queue
+import threading
+import time
+
+import pytest
+
+from app.helpers.job_queue import JobQueue
+
+
+class Clock():
+    # Starts at the real time, expiry compares it to file modification times
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+def wait_for(jobs, job_id, status="done"):
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        job = jobs.get(job_id)
+        if job is not None and job["status"] == status:
+            return job
+        time.sleep(0.01)
+    raise AssertionError("Job %s did not reach %s: %s" % (job_id, status, jobs.get(job_id)))
+
+
+def test_job_status_goes_from_queued_to_done(tmp_path):
+    jobs = JobQueue(workers=1, directory=str(tmp_path))
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocked():
+        started.set()
+        release.wait(5)
+        return "first"
+
+    first = jobs.submit(blocked)
+    second = jobs.submit(lambda value: [value], 7)
+    assert started.wait(5)
+    assert jobs.get(first) == {"job_id": first, "status": "running"}
+    assert jobs.get(second) == {"job_id": second, "status": "queued"}
+    release.set()
+    assert wait_for(jobs, first) == {"job_id": first, "status": "done", "result": "first"}
+    assert wait_for(jobs, second)["result"] == [7]
+    assert os.path.isfile(os.path.join(str(tmp_path), "isadetect-jobs", first + ".json"))
+
+
+def test_failed_job_has_a_message(tmp_path):
+    jobs = JobQueue(directory=str(tmp_path))
+
+    def fail():
+        raise ValueError("not an ELF file")
+
+    job_id = jobs.submit(fail)
+    assert wait_for(jobs, job_id, "failed") == {"job_id": job_id, "status": "failed", "message": "not an ELF file"}
+
+
+def test_another_queue_reads_the_jobs(tmp_path):
+    # Another worker process or a restarted server on the same directory
+    jobs = JobQueue(directory=str(tmp_path))
+    job_id = jobs.submit(lambda: {"architecture": "mips"})
+    wait_for(jobs, job_id)
+    restarted = JobQueue(directory=str(tmp_path))
+    assert restarted.get(job_id) == {"job_id": job_id, "status": "done", "result": {"architecture": "mips"}}
+    assert JobQueue(directory=str(tmp_path / "other")).get(job_id) is None
+
+
+@pytest.mark.parametrize("job_id", ["", "../../etc/passwd", "0" * 31, "0" * 33, "A" * 32, "0" * 32])
+def test_unknown_and_invalid_ids(tmp_path, job_id):
+    assert JobQueue(directory=str(tmp_path)).get(job_id) is None
+
+
+def test_ids_do_not_leave_the_directory(tmp_path):
+    (tmp_path / "other.json").write_text('{"job_id": "other", "status": "done"}')
+    assert JobQueue(directory=str(tmp_path)).get("../other") is None
+
+
+def test_full_queue(tmp_path):
+    jobs = JobQueue(workers=1, max_queued=1, directory=str(tmp_path))
+    started = threading.Event()
+    release = threading.Event()
+    jobs.submit(lambda: started.set() or release.wait(5))
+    assert started.wait(5)
+    queued = jobs.submit(lambda: None)
+    with pytest.raises(queue.Full):
+        jobs.submit(lambda: None)
+    # The rejected job leaves no status file behind
+    assert len(os.listdir(jobs.directory)) == 2
+    release.set()
+    wait_for(jobs, queued)
+
+
+def test_finished_jobs_expire(tmp_path):
+    clock = Clock()
+    jobs = JobQueue(retention=60, directory=str(tmp_path), clock=clock)
+    job_id = jobs.submit(lambda: 1)
+    wait_for(jobs, job_id)
+    clock.now += 59
+    assert jobs.get(job_id)["result"] == 1
+    clock.now += 1
+    assert jobs.get(job_id) is None
+    # The file is removed on the next submit once it is older than the
+    # retention, its modification time is a bit after the job finished
+    assert os.path.isfile(jobs._path(job_id))
+    clock.now += 5
+    wait_for(jobs, jobs.submit(lambda: 2))
+    assert not os.path.isfile(jobs._path(job_id))
+
+
+def test_unfinished_jobs_do_not_expire(tmp_path):
+    clock = Clock()
+    jobs = JobQueue(workers=1, retention=1, directory=str(tmp_path), clock=clock)
+    release = threading.Event()
+    job_id = jobs.submit(release.wait, 5)
+    clock.now += 1000
+    jobs._expire()
+    assert jobs.get(job_id)["status"] in ("queued", "running")
+    release.set()
+    wait_for(jobs, job_id)
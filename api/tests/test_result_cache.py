@@ -0,0 +1,143 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import hashlib
+import io
+import threading
+import time
+
+import pytest
+
+from app.helpers.result_cache import ResultCache, file_sha256
+
+
+class Clock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_file_sha256_rewinds():
+    file_t = io.BytesIO(b"\x7fELF" * 1000)
+    assert file_sha256(file_t, chunk_size=7) == hashlib.sha256(b"\x7fELF" * 1000).hexdigest()
+    assert file_t.tell() == 0
+
+
+def test_entries_expire_after_ttl():
+    clock = Clock()
+    cache = ResultCache(ttl=10, clock=clock)
+    cache.put("a", 1)
+    clock.now = 9.9
+    assert cache.get("a") == 1
+    clock.now = 10
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_disabled_cache_stores_nothing():
+    cache = ResultCache(max_entries=0)
+    cache.put("a", 1)
+    assert cache.get_or_compute("b", lambda: 2) == 2
+    assert len(cache) == 0
+
+
+def test_get_or_compute_caches_the_value():
+    cache = ResultCache()
+    calls = []
+    assert cache.get_or_compute("a", lambda: calls.append(1) or "value") == "value"
+    assert cache.get_or_compute("a", lambda: calls.append(1) or "other") == "value"
+    assert len(calls) == 1
+
+
+def test_concurrent_requests_are_computed_once():
+    cache = ResultCache()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "value"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get_or_compute("a", compute)))
+    leader.start()
+    assert started.wait(5)
+    waiters = [threading.Thread(target=lambda: results.append(cache.get_or_compute("a", compute))) for _ in range(4)]
+    for thread in waiters:
+        thread.start()
+    release.set()
+    for thread in [leader] + waiters:
+        thread.join(5)
+    assert results == ["value"] * 5
+    assert len(calls) == 1
+
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    cache = ResultCache()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError("broken upload")
+
+    errors = []
+
+    def call():
+        try:
+            cache.get_or_compute("a", fail)
+        except ValueError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    assert started.wait(5)
+    waiter = threading.Thread(target=call)
+    waiter.start()
+    # Give the waiter time to wait for the leader, if it comes too late it
+    # computes and fails by itself
+    time.sleep(0.1)
+    release.set()
+    leader.join(5)
+    waiter.join(5)
+    assert errors == ["broken upload"] * 2
+    assert cache.get("a") is None
+    assert cache.get_or_compute("a", lambda: "retried") == "retried"
+
+
+def test_get_or_compute_after_expiry_computes_again():
+    clock = Clock()
+    cache = ResultCache(ttl=1, clock=clock)
+    assert cache.get_or_compute("a", lambda: 1) == 1
+    clock.now = 2
+    assert cache.get_or_compute("a", lambda: 2) == 2
+
+
+@pytest.mark.parametrize("max_entries", [1, 3])
+def test_size_stays_bounded(max_entries):
+    cache = ResultCache(max_entries=max_entries)
+    for i in range(10):
+        cache.get_or_compute(i, lambda: i)
+    assert len(cache) == max_entries
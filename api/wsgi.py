@@ -8,18 +8,118 @@ See COPYRIGHT, AUTHORS, LICENSE for more details.
 
 from flask import Flask
 from app import bp
-import argparse
-import sys
-import joblib
+from app.helpers.admission import AdmissionControl
+from app.helpers.cascade import CascadePredictor, load_cascade_config
+from app.helpers.decompress import DEFAULT_MAX_DECOMPRESSED_SIZE
+from isadetect_features.feature_schema import FEATURE_SCHEMA
+from app.helpers.job_queue import JobQueue
+from app.helpers.metrics import Metrics
+from app.helpers.micro_batch import (DEFAULT_MICRO_BATCH_LATENCY, DEFAULT_MICRO_BATCH_SIZE, MICRO_BATCH_TYPES,
+                                     MicroBatcher)
+from app.helpers.model_registry import DEFAULT_RELOAD_INTERVAL, ModelRegistry
+from app.helpers.model_store import ModelStore
+from app.helpers.process_pool import ClassifierPool
+from app.helpers.result_cache import ResultCache
+from app.helpers.sampling import DEFAULT_SAMPLE_WINDOW_SIZE, DEFAULT_SAMPLE_WINDOWS
+import os
 
 app = Flask(__name__)
 app.register_blueprint(bp)
 
-code_only_model = joblib.load("only_code.ml")
-full_binary_model = joblib.load("full_binaries.ml")
-fragment_model = joblib.load("fragments.ml")
+# Models are loaded when this module is imported. Run gunicorn with
+# --preload to load them once before the workers are forked, so that all
+# workers share the same pages
+MODEL_STORE = ModelStore()
+app.config["MODEL_STORE"] = MODEL_STORE
 
-app.config["code"] = code_only_model
-app.config["full"] = full_binary_model
-app.config["fragment"] = fragment_model
+# ISADETECT_ENGINE=flat scores the random forests with FlatForest
+engine = os.environ.get("ISADETECT_ENGINE", "sklearn")
 
+# ISADETECT_MODEL_REGISTRY serves the models from a registry directory
+# that is watched for new versions instead of the fixed files below
+registry_path = os.environ.get("ISADETECT_MODEL_REGISTRY")
+if registry_path:
+    registry = ModelRegistry(registry_path, app.config, MODEL_STORE, engine,
+                             float(os.environ.get("ISADETECT_RELOAD_INTERVAL", DEFAULT_RELOAD_INTERVAL)))
+    registry.reload()
+    # The watcher thread is started in the worker that serves the request,
+    # threads started before the fork would not run in the workers
+    app.before_request(registry.start)
+else:
+    for model_type, path in (("code", "only_code.ml"), ("full", "full_binaries.ml"), ("fragment", "fragments.ml")):
+        entry = MODEL_STORE.load(path)
+        FEATURE_SCHEMA.check(entry["model"])
+        app.config[model_type] = MODEL_STORE.predictor(entry, engine)
+
+# ISADETECT_CASCADE serves the cascade configuration written by
+# ml/calibrate_cascade.py as the "cascade" type
+cascade_path = os.environ.get("ISADETECT_CASCADE")
+if cascade_path:
+    cascade = load_cascade_config(cascade_path)
+    stages = []
+    for path, stage_engine in ((cascade["cheap_model"], "sklearn"), (cascade["full_model"], engine)):
+        entry = MODEL_STORE.load(path)
+        FEATURE_SCHEMA.check(entry["model"])
+        stages.append(MODEL_STORE.predictor(entry, stage_engine))
+    app.config["cascade"] = CascadePredictor(stages[0], stages[1], cascade["threshold"])
+app.config["RESULT_CACHE"] = ResultCache()
+
+# The status of jobs is kept in files, so a job can be polled from any
+# gunicorn worker. ISADETECT_JOB_DIR sets where they and queued binaries
+# are stored
+app.config["JOB_DIR"] = os.environ.get("ISADETECT_JOB_DIR")
+app.config["JOB_QUEUE"] = JobQueue(directory=app.config["JOB_DIR"])
+
+# ISADETECT_PROCESS_WORKERS=n classifies uploads in n worker processes per
+# API worker, started on the first request
+process_workers = int(os.environ.get("ISADETECT_PROCESS_WORKERS", 0))
+if process_workers:
+    app.config["CLASSIFIER_POOL"] = ClassifierPool(process_workers, {app.config[model_type].source for model_type in
+                                                                     ("code", "full", "fragment") if model_type in app.config})
+
+# ISADETECT_METRICS=1 collects stage latencies for /metrics and
+# ISADETECT_SERVER_TIMING=1 adds them to responses as a Server-Timing header
+if os.environ.get("ISADETECT_METRICS") == "1":
+    app.config["METRICS"] = Metrics()
+app.config["SERVER_TIMING"] = os.environ.get("ISADETECT_SERVER_TIMING") == "1"
+
+# ISADETECT_HEADER_FAST_PATH=0 classifies full binaries with the model even
+# if their header names the architecture
+app.config["HEADER_FAST_PATH"] = os.environ.get("ISADETECT_HEADER_FAST_PATH", "1") != "0"
+
+# ISADETECT_CODE_SECTIONS=0 classifies full ELF binaries as a whole with the
+# full model instead of their code sections with the code model
+app.config["CODE_SECTIONS"] = os.environ.get("ISADETECT_CODE_SECTIONS", "1") != "0"
+
+# ISADETECT_MICRO_BATCH_TYPES=fragment classifies concurrent fragment uploads
+# together, ISADETECT_MICRO_BATCH_LATENCY and ISADETECT_MICRO_BATCH_SIZE
+# close a batch after that many seconds or uploads. Cascade uploads are not
+# micro-batched, only code, full and fragment apply and other types fail at
+# startup
+micro_batch_types = os.environ.get("ISADETECT_MICRO_BATCH_TYPES", "").split()
+for micro_batch_type in micro_batch_types:
+    if micro_batch_type not in MICRO_BATCH_TYPES:
+        raise ValueError("ISADETECT_MICRO_BATCH_TYPES has to list types of %s, not %s"
+                         % (", ".join(MICRO_BATCH_TYPES), micro_batch_type))
+if micro_batch_types:
+    app.config["MICRO_BATCH_TYPES"] = micro_batch_types
+    app.config["MICRO_BATCHER"] = MicroBatcher(int(os.environ.get("ISADETECT_MICRO_BATCH_SIZE", DEFAULT_MICRO_BATCH_SIZE)),
+                                               float(os.environ.get("ISADETECT_MICRO_BATCH_LATENCY",
+                                                                    DEFAULT_MICRO_BATCH_LATENCY)),
+                                               app.config.get("METRICS"))
+
+# ISADETECT_MAX_DECOMPRESSED_SIZE rejects compressed uploads that decompress
+# to more bytes than this
+app.config["MAX_DECOMPRESSED_SIZE"] = int(os.environ.get("ISADETECT_MAX_DECOMPRESSED_SIZE", DEFAULT_MAX_DECOMPRESSED_SIZE))
+
+# ISADETECT_SAMPLE_WINDOWS and ISADETECT_SAMPLE_WINDOW_SIZE bound the bytes
+# classified of uploads posted with sampled
+app.config["SAMPLE_WINDOWS"] = int(os.environ.get("ISADETECT_SAMPLE_WINDOWS", DEFAULT_SAMPLE_WINDOWS))
+app.config["SAMPLE_WINDOW_SIZE"] = int(os.environ.get("ISADETECT_SAMPLE_WINDOW_SIZE", DEFAULT_SAMPLE_WINDOW_SIZE))
+
+# ISADETECT_QOS_CONFIG limits the concurrent and queued requests of each
+# model type and payload size class with the lanes of this JSON file, the
+# limits apply to every gunicorn worker
+qos_config = os.environ.get("ISADETECT_QOS_CONFIG")
+if qos_config:
+    app.config["ADMISSION"] = AdmissionControl.from_config(qos_config, app.config.get("METRICS"))
@@ -11,6 +11,7 @@ from tools.deb_unpacker import UnpackDebianFiles
 from tools.extract_binaries import BinaryExtractor
 from tools.debian_port_converter import DebianPortConverter
 from tools.calculate_features import FeatureCalculator
+from isadetect_features.feature_stream import DEFAULT_CHUNK_SIZE
 from scraper.firmware.spiders.debian_ports_ftp import DebianPortSpider
 from scraper.firmware.spiders.debian import DebianSpider
 from scraper.firmware.spiders.debian_package_list import DebianPackageListSpider
@@ -219,7 +220,8 @@ def calculate_features(verbose, architectures, args):
              sample_size=config["feature_calculator"]["sample_size"],
              input_path=config["binary_extractor"]["output_path"],
              output_path=config["feature_calculator"]["output_path"],
-             create_testset=args.use_dataset)
+             create_testset=args.use_dataset,
+             chunk_size=config["feature_calculator"].get("chunk_size", DEFAULT_CHUNK_SIZE))
     featureCalculator.calculate_bfd()
     print("Calculating features done")
 
@@ -1,6 +1,5 @@
 import binascii
 import collections
-import re
 import json
 import csv
 import enum
@@ -14,7 +13,13 @@ import multiprocessing
 import logging
 import shlex
 import subprocess
+
+# Features are calculated with the isadetect_features package of the API
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "api"))
+
 from helpers.call_cmd import call_cmd
+from isadetect_features.feature_schema import FEATURE_SCHEMA
+from isadetect_features.feature_stream import DEFAULT_CHUNK_SIZE, FeatureAccumulator, read_chunks
 
 
 UNKNOWN_ARCHITECTURE = 99
@@ -62,98 +67,7 @@ class FeatureCalculator():
 
         return switcher.get(argument, UNKNOWN_ARCHITECTURE)
 
-    def initialize_fingerprints(self):
-        self.fps = {}
-        # big endian one
-        self.fps["be_one"] = br"\x00\x01"
-        # little endian one
-        self.fps["le_one"] = br"\x01\x00"
-        # big endian stack
-        self.fps["be_stack"] = br"\xff\xfe"
-        # little endian stack
-        self.fps["le_stack"] = br"\xfe\xff"
-
-        # armel32 prologs
-        self.fps["armel32_prolog_1"] = br"[\x00-\xff][\x00-\xff]\x2d\xe9"
-        self.fps["armel32_prolog_2"] = br"\x04\xe0\x2d\xe5"
-
-        # armel32 epilogs
-        self.fps["armel32_epilog_1"] = br"[\x00-\xff]{2}\xbd\xe8\x1e\xff\x2f\xe1"
-        self.fps["armel32_epilog_2"] = br"\x04\xe0\x9d\xe4\x1e\xff\x2f\xe1"
-
-        # arm32 prologs
-        self.fps["arm32_prolog_1"] = br"\xe9\x2d[\x00-\xff][\x00-\xff]"
-        self.fps["arm32_prolog_2"] = br"\xe5\x2d\xe0\x04"
-
-        # arm32 epilogs
-        self.fps["arm32_epilog_1"] = br"\xe8\xbd[\x00-\xff]{2}\xe1\x2f\xff\x1e"
-        self.fps["arm32_epilog_2"] = br"\xe4\x9d\xe0\x04\xe1\x2f\xff\x1e"
-
-        # mips32 prologs
-        self.fps["mips32_prolog_1"] = br"\x27\xbd\xff[\x00-\xff]"
-        self.fps["mips32_prolog_2"] = br"\x3c\x1c[\x00-\xff][\x00-\xff]\x9c\x27[\x00-\xff][\x00-\xff]"
-
-        # mips32 epilog
-        self.fps["mips32_epilog_1"] = br"\x8f\xbf[\x00-\xff]{2}([\x00-\xff]{4}){0,4}\x03\xe0\x00\x08"
-
-        # mips32el prologs
-        self.fps["mips32el_prolog_1"] = br"[\x00-\xff]\xff\xbd\x27"
-        self.fps["mips32el_prolog_2"] = br"[\x00-\xff][\x00-\xff]\x1c\x3c[\x00-\xff][\x00-\xff]\x9c\x27"
-
-        # mipsel epilog
-        self.fps["mips32el_epilog_1"] = br"[\x00-\xff]{2}\xbf\x8f([\x00-\xff]{4}){0,4}\x08\x00\xe0\x03"
-
-        # ppc32 prolog
-        self.fps["ppc32_prolog_1"] = br"\x94\x21[\x00-\xff]{2}\x7c\x08\x02\xa6"
-
-        # ppc32 epilog
-        self.fps["ppc32_epilog_1"] = br"[\x00-\xff]{2}\x03\xa6([\x00-\xff]{4}){0,6}\x4e\x80\x00\x20"
-
-        # ppcel32 prolog
-        self.fps["ppcel32_prolog_1"] = br"[\x00-\xff]{2}\x21\x94\xa6\x02\x08\x7c"
-
-        # ppcel32 epilog
-        self.fps["ppcel32_epilog_1"] = br"\xa6\x03[\x00-\xff]{2}([\x00-\xff]{4}){0,6}\x20\x00\x80\x4e"
-
-        # ppc64 prologs
-        self.fps["ppc64_prolog_1"] = br"\x94\x21[\x00-\xff]{2}\x7c\x08\x02\xa6"
-        self.fps["ppc64_prolog_2"] = br"(?!\x94\x21[\x00-\xff]{2})\x7c\x08\x02\xa6"
-        self.fps["ppc64_prolog_3"] = br"\xf8\x61[\x00-\xff]{2}"
-
-        # ppc64 epilog
-        self.fps["ppc64_epilog_1"] = br"[\x00-\xff]{2}\x03\xa6([\x00-\xff]{4}){0,6}\x4e\x80\x00\x20"
-
-        # ppcel64 prolog
-        self.fps["ppcel64_prolog_1"] = br"[\x00-\xff]{2}\x21\x94\xa6\x02\x08\x7c"
-
-        # ppcel64 epilog
-        self.fps["ppcel64_epilog_1"] = br"\xa6\x03[\x00-\xff]{2}([\x00-\xff]{4}){0,6}\x20\x00\x80\x4e"
-
-        # s390x prolog
-        self.fps["s390x_prolog_1"] = br'\xeb.[\xf0-\xff]..\x24'
-
-        # s390x epilog
-        self.fps["s390x_epilog_1"] = br'\x07\xf4'
-
-        # amd64 prologs
-        self.fps["amd64_prolog_1"] = br"\x55\x48\x89\xe5"
-        self.fps["amd64_prolog_2"] = br"\x48[\x83,\x81]\xec[\x00-\xff]"
-
-        # amd64 epilogs
-        self.fps["amd64_epilog_1"] = br"\xc9\xc3"
-        self.fps["amd64_epilog_2"] = br"([^\x41][\x50-\x5f]{1}|\x41[\x50-\x5f])\xc3"
-        self.fps["amd64_epilog_3"] = br"\x48[\x83,\x81]\xc4([\x00-\xff]{1}|[\x00-\xff]{4})\xc3"
-
-        # powerpcspe SPE instructions
-        self.fps["powerpcspe_spe_instruction_isel"] = br"[\x7d-\x7f][\x00-\xff]{2}(\x1e|\x5e|\x9e)"
-        self.fps["powerpcspe_spe_instruction_evl"] = br"(\x10|\x11|\x12|\x13)[\x00-\xff]{2}(\x01|\xc1|\xc8|\xc9|\xc0|\xd0|\xd1|\xda)"
-
-
-    def init(self, thread_count, code_section_minimum_size, limit_number_of_binaries, architectures, full_binaries, random_sampling, sample_size, input_path, output_path, create_testset):
-        self.initialize_fingerprints()
-        for key, value in self.fps.items():
-            regex = re.compile(value)
-            self.fps[key] = regex
+    def init(self, thread_count, code_section_minimum_size, limit_number_of_binaries, architectures, full_binaries, random_sampling, sample_size, input_path, output_path, create_testset, chunk_size=DEFAULT_CHUNK_SIZE):
         self.threadLimiter = threading.BoundedSemaphore(int(thread_count))
         self.byte_frequencies = []
         self.fingerprints = []
@@ -168,48 +82,45 @@ class FeatureCalculator():
         self.input_path = input_path
         self.output_path = output_path
         self.create_testset = create_testset
+        self.chunk_size = int(chunk_size)
         self.last_arch = 1
+        self.schema_path = self.output_path + ".schema.json"
 
         if os.path.exists(self.output_path):
             os.remove(self.output_path)
+        if os.path.exists(self.schema_path):
+            os.remove(self.schema_path)
 
 
     def run(self, analyze_this, architecture, count):
         try:
-            byte_count = 0
-
             # architecture to validate model against
             architecture = self.switch_case(architecture)
             if architecture == UNKNOWN_ARCHITECTURE:
                 return
 
 
+            # Features are calculated one chunk at a time, so memory use does
+            # not grow with the size of the binary
+            accumulator = FeatureAccumulator()
             with open(analyze_this, 'rb') as file_t:
-                data = bytearray(file_t.read())
-
-            if self.random_sampling:
-                start_index = random.randint(0, len(data) - self.sample_size)
-                data = bytearray(data[start_index:start_index + self.sample_size])
+                if self.random_sampling:
+                    file_size = os.fstat(file_t.fileno()).st_size
+                    start_index = random.randint(0, file_size - self.sample_size)
+                    file_t.seek(start_index)
+                    chunks = [file_t.read(self.sample_size)]
+                else:
+                    chunks = read_chunks(file_t, self.chunk_size)
+                for chunk in chunks:
+                    accumulator.update(chunk)
 
-            # byte frequencies
-            byte_frequency_counter = [0] * 256
-            for byte in data:
-                byte_count += 1
-                byte_frequency_counter[byte] += 1
+            # byte frequencies and function epilog and prolog fingerprints
             try:
-                byte_frequency_counter = [(x / byte_count)
-                                        for x in byte_frequency_counter]
+                byte_frequency_counter, fingerprints = accumulator.finalize()
             except Exception as e:
                 print(e)
                 return
 
-            # function epilog and prolog fingerprints
-            fingerprints = {}
-            for key, value in self.fps.items():
-                i = 0
-                for match in value.finditer(data):
-                    i += 1
-                fingerprints[key] = i / byte_count
             self.processed_architectures.append(architecture)
             self.byte_frequencies.append(byte_frequency_counter)
             self.fingerprints.append(fingerprints)
@@ -230,7 +141,7 @@ class FeatureCalculator():
                         print("error " + str(self.processed_architectures[i]))
                         continue
                     data = data + self.byte_frequencies[i]
-                    for key in sorted(self.fingerprints[i]):
+                    for key in FEATURE_SCHEMA.fingerprint_keys:
                         data.append(self.fingerprints[i][key])
                     data.append(self.processed_architectures[i])
 
@@ -246,7 +157,7 @@ class FeatureCalculator():
                         print("error " + str(self.processed_architectures[i]))
                         continue
                     data = data + self.byte_frequencies[i]
-                    for key in sorted(self.fingerprints[i]):
+                    for key in FEATURE_SCHEMA.fingerprint_keys:
                         data.append(self.fingerprints[i][key])
                     data.append(self.processed_architectures[i])
 
@@ -257,13 +168,18 @@ class FeatureCalculator():
 
         for i in range(0, 256):
             header.append(i)
-        for key in sorted(self.fingerprints[0]):
+        for key in FEATURE_SCHEMA.fingerprint_keys:
             header.append(key)
         header.append("architecture")
 
         filehandle.writerow(header)
         self.headers_written = True
 
+        # Record the feature schema next to the CSV so that the trained model
+        # can be checked against the feature extractor
+        with open(self.schema_path, 'w') as f:
+            json.dump(FEATURE_SCHEMA.to_dict(), f)
+
     def find_binaries(self, directory):
         output = ""
         # shell-escape directory-variable
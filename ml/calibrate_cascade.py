@@ -0,0 +1,105 @@
+"""
+isadetect - "ML-based ISA detection (architecture and endianness of binary code/sequences)"
+
+Copyright (C) Sami Kairajarvi <sami.kairajarvi@gmail.com>, 2019
+
+See COPYRIGHT, AUTHORS, LICENSE for more details.
+"""
+
+import numpy as np
+
+import joblib
+import argparse
+import json
+import os
+import sys
+
+
+def file_path(string):
+    if os.path.isfile(string):
+        return string
+    else:
+        raise NotADirectoryError(string)
+
+
+def cheap_probabilities(model, X):
+    # Cheap models trained with --byte_histogram_only see the byte
+    # frequencies only
+    if getattr(model, "feature_subset", None) == "bytes":
+        X = X[:, 0:256]
+    return model.predict_proba(X)
+
+
+def calibrate(cheap_confidence, cheap_correct, full_correct, max_accuracy_loss):
+    """ Return the lowest threshold on the top probability of the cheap
+    model at which the cascade is at most max_accuracy_loss less accurate
+    than the full model alone, with its accuracy and fall-through rate.
+    Rows at or above the threshold are answered by the cheap model. """
+    n = len(cheap_confidence)
+    order = np.argsort(-cheap_confidence, kind="stable")
+    confidence = cheap_confidence[order]
+    # Correct answers when the first i rows are answered by the cheap model
+    # and the rest by the full model
+    cheap_correct = np.concatenate([[0], np.cumsum(cheap_correct[order])])
+    full_correct = np.concatenate([np.cumsum(full_correct[order][::-1])[::-1], [0]])
+    accuracy = (cheap_correct + full_correct) / n
+    target = accuracy[0] - max_accuracy_loss
+
+    # Only cut between rows with different confidences, every row with the
+    # confidence of the threshold is answered by the cheap model
+    cuts = [i for i in range(1, n + 1) if i == n or confidence[i] < confidence[i - 1]]
+    best = None
+    for i in cuts:
+        if accuracy[i] >= target:
+            best = i
+    if best is None:
+        # Even the most confident rows are not accurate enough, everything
+        # falls through
+        return 1.0 + 1e-9, accuracy[0], 1.0
+    return float(confidence[best - 1]), accuracy[best], (n - best) / n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Choose the threshold of a cascade of a cheap and a full model on held-out data")
+    parser.add_argument("--input", type=file_path, required=True, help="CSV file of held-out features, not used in training")
+    parser.add_argument("--cheap_model", type=file_path, required=True,
+                        help="Cheap model, for example trained with --byte_histogram_only --classifier logistic_regression_scikit")
+    parser.add_argument("--full_model", type=file_path, required=True, help="Full model, for example a random forest")
+    parser.add_argument("--output", type=str, required=True, help="Cascade configuration for the --cascade option of the API")
+    parser.add_argument("--max_accuracy_loss", type=float, default=0.001,
+                        help="Accuracy the cascade may lose against the full model alone. Defaults to 0.001")
+    args = parser.parse_args()
+
+    final_data = np.genfromtxt(args.input, delimiter=',', skip_header=True, filling_values=0)
+    final_X = final_data[:,0:-1]
+    final_Y = final_data[:,-1]
+
+    cheap_model = joblib.load(args.cheap_model)
+    full_model = joblib.load(args.full_model)
+    missing = np.setdiff1d(cheap_model.classes_, full_model.classes_)
+    if len(missing):
+        sys.exit("Cheap model has classes the full model does not have: " + ", ".join(str(label) for label in missing))
+
+    cheap = cheap_probabilities(cheap_model, final_X)
+    cheap_confidence = cheap.max(axis=1)
+    cheap_correct = np.asarray(cheap_model.classes_)[cheap.argmax(axis=1)] == final_Y
+    full_correct = full_model.predict(final_X) == final_Y
+
+    threshold, accuracy, fall_through_rate = calibrate(cheap_confidence, cheap_correct, full_correct,
+                                                       args.max_accuracy_loss)
+    print("Full model accuracy: %.4f" % full_correct.mean())
+    print("Cheap model accuracy: %.4f" % cheap_correct.mean())
+    print("Cascade threshold: %.6f, accuracy: %.4f, fall-through rate: %.4f" % (threshold, accuracy, fall_through_rate))
+
+    # Model paths are stored relative to the configuration file
+    directory = os.path.dirname(os.path.abspath(args.output))
+    config = {
+        "cheap_model": os.path.relpath(os.path.abspath(args.cheap_model), directory),
+        "full_model": os.path.relpath(os.path.abspath(args.full_model), directory),
+        "threshold": threshold,
+        "accuracy": accuracy,
+        "full_model_accuracy": full_correct.mean(),
+        "fall_through_rate": fall_through_rate,
+    }
+    with open(args.output, "w") as f:
+        json.dump(config, f, indent=4)
@@ -20,6 +20,7 @@ from tensorflow.keras.utils import to_categorical
 
 import joblib
 import argparse
+import json
 import os
 import logging
 
@@ -34,6 +35,8 @@ if __name__ == "__main__":
     parser.add_argument("--input", type=file_path, required=True)
     parser.add_argument("--output", type=str, required=True)
     parser.add_argument("--classifier", type=str, choices=["logistic_regression_keras", "logistic_regression_scikit", "random_forest"], required=True)
+    parser.add_argument("--byte_histogram_only", action="store_true",
+                        help="Train on the 256 byte frequencies only, for the cheap model of a cascade that skips the fingerprints")
     args = parser.parse_args()
 
     if args.input and args.output:
@@ -44,6 +47,8 @@ if __name__ == "__main__":
             # Separate features (X) and the architecture (Y)
             final_X = final_data[:,0:-1]
             final_Y = final_data[:,-1]
+            if args.byte_histogram_only:
+                final_X = final_X[:,0:256]
 
             # Based on user choise, choose the classifier to be trained
             if args.classifier == "random_forest":
@@ -63,6 +68,15 @@ if __name__ == "__main__":
                 final_model = LogisticRegression(penalty='l1', C=1000, multi_class="multinomial", solver="saga", max_iter=100, verbose=True, n_jobs=-1)
                 final_model.fit(final_X, final_Y)
 
+            # Store the feature schema the dataset was generated with, so that
+            # the API can check it serves the model with matching features
+            schema_path = args.input + ".schema.json"
+            if os.path.exists(schema_path):
+                with open(schema_path) as f:
+                    final_model.feature_schema = json.load(f)
+            if args.byte_histogram_only:
+                final_model.feature_subset = "bytes"
+
             # Save model to file
             joblib.dump(final_model, args.output)
         except Exception as e:
@@ -40,12 +40,13 @@ def r2isadetect(_):
         binary_in_hex_cmd = "p8 %s" % file_size
         binary_in_hex = R2P.cmd(binary_in_hex_cmd)
 
-        # Send data to the API using multi-part form data
-        data = {"binary": bytearray.fromhex(binary_in_hex.rstrip())}
-        form = {"type": type}
+        # Send the bytes to the API as the request body, which saves the
+        # multipart form encoding on both sides
+        data = bytes.fromhex(binary_in_hex.rstrip())
         try:
             response = requests.request(
-                "POST", verify=False, url=api_url, files=data, data=form)
+                "POST", verify=False, url=api_url + "raw", params={"type": type}, data=data,
+                headers={"Content-Type": "application/octet-stream"})
         except Exception as e:
             print("Error identifying the architecture")
 